@@ -6,3 +6,8 @@
 echo 'Building frontend'
 
 docker-compose run --rm -e NODE_ENV=production frontend webpack -p
+
+# Persisted queries of the build, shipped in the server image, see
+# `GRAPHQL_PERSISTED_QUERIES`
+mkdir -p server/schema
+cp frontend/schema/persisted_queries.json server/schema/
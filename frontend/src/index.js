@@ -5,13 +5,22 @@ import { Environment, Network, RecordSource, Store } from "relay-runtime";
 import $ from "jquery";
 import { Provider } from "mobx-react";
 import { Store as AppStore } from "./app/store";
+import persistedQueries from "../schema/persisted_queries.json";
 
 const APPLICATION_ID = "application";
 
 const store = new AppStore();
 
-// eslint-disable-next-line no-unused-vars
-const fetchQuery = (operation, variables, cacheConfig, uploadables) => {
+const PERSISTED_QUERY_NOT_FOUND = "PersistedQueryNotFound";
+
+// Persisted query ids by query text, registered at build time by the
+// server `persist-queries` command
+const queryIds = Object.keys(persistedQueries).reduce((ids, id) => {
+  ids[persistedQueries[id]] = id;
+  return ids;
+}, {});
+
+const postQuery = body => {
   return fetch("/graphql", {
     method: "POST",
     headers: {
@@ -22,15 +31,30 @@ const fetchQuery = (operation, variables, cacheConfig, uploadables) => {
       "x-app-current-user-id": store.meId || 0,
       "content-type": "application/json"
     },
-    body: JSON.stringify({
-      query: operation.text, // GraphQL text from input
-      variables
-    })
+    body: JSON.stringify(body)
   }).then(response => {
     return response.json();
   });
 };
 
+// eslint-disable-next-line no-unused-vars
+const fetchQuery = (operation, variables, cacheConfig, uploadables) => {
+  // Sends the persisted query id only, falls back to the GraphQL text
+  // when the query was not registered
+  const id = queryIds[operation.text];
+  const postText = () => postQuery({ query: operation.text, variables });
+  if (!id) {
+    return postText();
+  }
+  return postQuery({ id, variables }).then(
+    result =>
+      result.errors &&
+      result.errors.some(e => e.message === PERSISTED_QUERY_NOT_FOUND)
+        ? postText()
+        : result
+  );
+};
+
 const createEnvironment = () => {
   const source = new RecordSource();
   const store = new Store(source);
@@ -8,24 +8,50 @@ def create_app(config=Config):
 
     app.config.from_object(config)
 
-    from .models import db
+    from .models import db, storage
     db.init_app(app)
+    storage.init_app(app)
+
+    from .graph import graph_store, block_filter
+    graph_store.init_app(app)
+    block_filter.init_app(app)
+
+    from .cache import connection_cache
+    connection_cache.init_app(app)
+
+    from .profiling import profiler
+    profiler.init_app(app)
 
     from .blueprints.views import blueprint as views
     app.register_blueprint(views)
 
-    # graphql endpoint
-    from .graphql import schema
-    from flask_graphql import GraphQLView
-    graphql_view = GraphQLView.as_view('graphql', schema=schema, graphiql=True)
-    app.add_url_rule('/graphql', view_func=graphql_view)
+    # graphql endpoint, the schema and view are built on first request
+    from .graphql.documents import document_cache
+    document_cache.init_app(app)
+    from .graphql.responses import response_cache
+    response_cache.init_app(app)
+    from .graphql import graphql_view
+    app.add_url_rule('/graphql', 'graphql', view_func=graphql_view)
 
     if app.debug and not app.testing:
-        from .samples import load_samples
-        with app.app_context():
-            logger.info('Initializing database..')
-            db.create_all()
-            load_samples()
-            db.session.commit()
+        # On first request rather than on boot, e.g. of `cli.py` commands
+        app.before_first_request(_init_database)
 
     return app
+
+
+def warm_up(app):
+    """Builds what `create_app` defers to the first request, i.e. the
+    GraphQL schema and view. Called by `run`, so that the uwsgi master
+    builds them once before forking the workers."""
+    from .graphql import get_view
+    get_view()
+
+
+def _init_database():
+    from .models import db
+    from .samples import load_samples
+    logger.info('Initializing database..')
+    db.create_all()
+    load_samples()
+    db.session.commit()
@@ -1,28 +1,53 @@
-from ..models import User
-from ..graphql import schema
-import requests
-from flask import (Blueprint, render_template, current_app, Response,
+from ..cache import LRUCache
+from ..models import db, User, USER_ORDER, get_version, replica_reads
+from ..graphql import get_schema
+from flask import (Blueprint, current_app, request, Response,
                    stream_with_context, jsonify, abort)
+from flask.json import htmlsafe_dumps
+from hashlib import sha256
+import os
 
 blueprint = Blueprint('views', __name__)
 
+USER_DIRECTORY_CHUNK_SIZE = 1000
+
+_user_directories = LRUCache(maxsize=4)
+"""The JSON chunks of the user directory by `(version, limit)`."""
+
+_build_versions = {}
+"""The `build_version` by root path of the app."""
+
 
 @blueprint.route('/')
+@replica_reads()
 def index():
-    q = User.query.order_by(User.first_name, User.last_name)
-    users = [{
-        'userId': user.user_id,
-        'fullName': '{} {}'.format(user.first_name, user.last_name),
-        'avatarUrl': user.avatar_url,
-    } for user in q.all()]
-    return render_template('index.html', users=users)
+    """Renders the application with the directory of users embedded, the
+    first `INDEX_USERS_LIMIT` users only when set.
+
+    The page is validated by the version of users and the `build_version`,
+    i.e. `304 Not Modified` until users change or a new build is deployed,
+    and streamed while the directory is serialized. Reads from the replica
+    when configured."""
+    limit = current_app.config.get('INDEX_USERS_LIMIT') or 0
+    version = get_version('users')
+    etag = 'users-{}-{}-{}'.format(version, limit, build_version())
+    if etag in request.if_none_match:
+        response = Response(status=304)
+    else:
+        context = dict(users_json=user_directory(version, limit))
+        current_app.update_template_context(context)
+        template = current_app.jinja_env.get_template('index.html')
+        response = Response(stream_with_context(template.stream(context)))
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
 
 
 @blueprint.route('/graphql/schema')
 def schema_():
     if current_app.debug:
         return jsonify({
-            'data': schema.introspect()
+            'data': get_schema().introspect()
         })
     abort(404)
 
@@ -32,6 +57,8 @@ def lib(filename):
     """Proxy to frontend webpack server,
     else proxies `static/lib` in production."""
     if current_app.debug:
+        # Deferred, only required by development
+        import requests
         url = '{endpoint}/lib/{filename}'.format(
             endpoint=current_app.config.get('DEV_FRONTEND_URI'),
             filename=filename)
@@ -41,3 +68,62 @@ def lib(filename):
             content_type=req.headers['content-type'])
     else:
         return current_app.send_static_file('lib/{}'.format(filename))
+
+
+def build_version():
+    """Returns a digest of the templates and of the frontend bundles (see
+    `lib`), computed once per process, i.e. changes with each deploy."""
+    root = current_app.root_path
+    if root not in _build_versions:
+        digest = sha256()
+        for folder in (current_app.template_folder,
+                       os.path.join(current_app.static_folder, 'lib')):
+            folder = os.path.join(root, folder)
+            for dirpath, dirnames, filenames in os.walk(folder):
+                dirnames.sort()
+                for filename in sorted(filenames):
+                    filepath = os.path.join(dirpath, filename)
+                    digest.update(os.path.relpath(filepath, root).encode())
+                    with open(filepath, 'rb') as fp:
+                        digest.update(fp.read())
+        _build_versions[root] = digest.hexdigest()[:12]
+    return _build_versions[root]
+
+
+def user_directory(version, limit=0):
+    """Returns the JSON array of the users, the first `limit` users only
+    when not 0, as an iterable of chunks.
+
+    Chunks are cached by `version` of users once serialized."""
+    key = (version, limit)
+    found = _user_directories.get_many([key])
+    if found:
+        return found[key]
+    return _serialize_user_directory(key, limit)
+
+
+def _serialize_user_directory(key, limit):
+    q = db.session.query(
+        User.user_id, User.first_name, User.last_name, User.avatar_url).\
+        order_by(*USER_ORDER)
+    if limit:
+        q = q.limit(limit)
+    chunks = []
+    items = ['[']
+    # Streamed after `index` returned, i.e. out of its `replica_reads`
+    with replica_reads():
+        for i, (user_id, first_name, last_name, avatar_url) in enumerate(
+                q.yield_per(USER_DIRECTORY_CHUNK_SIZE)):
+            items.append((',' if i else '') + htmlsafe_dumps({
+                'userId': user_id,
+                'fullName': '{} {}'.format(first_name, last_name),
+                'avatarUrl': avatar_url,
+            }))
+            if len(items) >= USER_DIRECTORY_CHUNK_SIZE:
+                chunks.append(''.join(items))
+                yield chunks[-1]
+                items = []
+    items.append(']')
+    chunks.append(''.join(items))
+    yield chunks[-1]
+    _user_directories.set_many({key: tuple(chunks)})
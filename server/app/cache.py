@@ -0,0 +1,217 @@
+from .logging import logger
+from collections import OrderedDict
+from flask import current_app, has_app_context
+from threading import Lock
+import time
+
+
+class LRUCache(object):
+    """Thread safe in-process cache with bounded size, least recently used
+    eviction and optional time to live (in seconds, 0 never expires).
+
+    Keeps `hits`, `misses` and `evictions` counters, see `stats`.
+    """
+
+    def __init__(self, maxsize=100000, ttl=0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = self.misses = self.evictions = 0
+        self._items = OrderedDict()  # {key: (expires_at, value)}
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def get_many(self, keys):
+        """Returns `{key: value}` of the cached `keys`."""
+        found = {}
+        now = time.time()
+        with self._lock:
+            for key in keys:
+                item = self._items.get(key)
+                if item is not None and item[0] and item[0] < now:
+                    del self._items[key]
+                    item = None
+                if item is None:
+                    self.misses += 1
+                    continue
+                self._items.move_to_end(key)
+                found[key] = item[1]
+                self.hits += 1
+        return found
+
+    def set_many(self, mapping):
+        """Caches every `{key: value}` of `mapping`."""
+        expires_at = time.time() + self.ttl if self.ttl else 0
+        with self._lock:
+            for key, value in mapping.items():
+                self._items[key] = (expires_at, value)
+                self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+                self.evictions += 1
+
+    def delete_many(self, keys):
+        with self._lock:
+            for key in keys:
+                self._items.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def stats(self):
+        return dict(
+            size=len(self._items), hits=self.hits, misses=self.misses,
+            evictions=self.evictions)
+
+
+class UWSGICache(object):
+    """Cache shared by every uwsgi worker, backed by an uwsgi cache, e.g.
+    `cache2 = name=connections,items=100000,purge_lru=1` in `wsgi.ini`.
+
+    Only integer values are supported. Counters are kept per worker.
+    """
+
+    def __init__(self, name, ttl=0):
+        import uwsgi
+        self.uwsgi = uwsgi
+        self.name = name
+        self.ttl = ttl
+        self.hits = self.misses = 0
+
+    def get_many(self, keys):
+        found = {}
+        for key in keys:
+            value = self.uwsgi.cache_get(self._key(key), self.name)
+            if value is None:
+                self.misses += 1
+                continue
+            found[key] = int(value)
+            self.hits += 1
+        return found
+
+    def set_many(self, mapping):
+        for key, value in mapping.items():
+            self.uwsgi.cache_update(
+                self._key(key), str(value).encode(), self.ttl, self.name)
+
+    def delete_many(self, keys):
+        for key in keys:
+            self.uwsgi.cache_del(self._key(key), self.name)
+
+    def clear(self):
+        self.uwsgi.cache_clear(self.name)
+
+    def stats(self):
+        return dict(hits=self.hits, misses=self.misses)
+
+    def _key(self, key):
+        return ':'.join(str(part) for part in key)
+
+
+class ConnectionCache(object):
+    """Flask extension caching `(source_id, target_id) -> connection` across
+    requests, kept current with the committed `ConnectionChange`.
+
+    In-process caches are only updated by the writes of their own process,
+    i.e. with multiple processes (e.g. uwsgi workers) the 'memory' backend
+    serves the writes of the other processes once its entries expired,
+    hence the TTL of a few seconds by default. The 'uwsgi' backend is shared
+    by the workers and can keep entries longer. The cache is cleared once a
+    bulk load bumped the graph version (see `app.models.GRAPH_VERSION_KEY`),
+    which is checked once per app context, i.e. per request.
+
+    Configuration:
+    - `CONNECTION_CACHE_BACKEND`: 'memory', 'uwsgi' or None to disable,
+      'uwsgi' is disabled when not running under uwsgi (e.g. `cli.py`)
+    - `CONNECTION_CACHE_SIZE`: maximum entries of the 'memory' backend
+    - `CONNECTION_CACHE_TTL`: seconds before an entry expires, 0 never,
+      defaults to 5
+    - `CONNECTION_CACHE_NAME`: name of the uwsgi cache
+    """
+
+    backends = {
+        'memory': lambda config: LRUCache(
+            config['CONNECTION_CACHE_SIZE'], config['CONNECTION_CACHE_TTL']),
+        'uwsgi': lambda config: UWSGICache(
+            config['CONNECTION_CACHE_NAME'], config['CONNECTION_CACHE_TTL']),
+    }
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('CONNECTION_CACHE_BACKEND', None)
+        app.config.setdefault('CONNECTION_CACHE_SIZE', 100000)
+        app.config.setdefault('CONNECTION_CACHE_TTL', 5)
+        app.config.setdefault('CONNECTION_CACHE_NAME', 'connections')
+        backend = app.config['CONNECTION_CACHE_BACKEND']
+        if backend:
+            assert backend in self.backends, \
+                'Unsupported connection cache backend: {}'.format(backend)
+            try:
+                app.extensions['connection_cache'] = _ConnectionCacheState(
+                    self.backends[backend](app.config))
+            except ImportError as e:
+                logger.warning(
+                    'Connection cache disabled, {} backend unavailable: '
+                    '{}'.format(backend, e))
+
+    @property
+    def cache(self):
+        """Returns the cache backend, or None when disabled."""
+        if not has_app_context():
+            return None
+        state = current_app.extensions.get('connection_cache')
+        return state.cache if state is not None else None
+
+    def get_many(self, pairs):
+        """Returns `{(source_id, target_id): connection}` of the cached
+        `(source_id, target_id)` pairs."""
+        cache = self.cache
+        if cache is None:
+            return {}
+        self._check_version()
+        return cache.get_many(pairs)
+
+    def set_many(self, connections):
+        """Caches `{(source_id, target_id): connection}`."""
+        cache = self.cache
+        if cache is not None:
+            cache.set_many(connections)
+
+    def apply(self, changes):
+        """Updates the cache with committed `ConnectionChange`."""
+        cache = self.cache
+        if cache is None:
+            return
+        cache.set_many(dict(
+            ((change.source_id, change.target_id), change.new)
+            for change in changes
+        ))
+
+    def stats(self):
+        cache = self.cache
+        return cache.stats() if cache is not None else {}
+
+    def _check_version(self):
+        from .models import get_graph_version
+        state = current_app.extensions['connection_cache']
+        version = get_graph_version()
+        with state.lock:
+            if state.version is not None and state.version != version:
+                state.cache.clear()
+            state.version = version
+
+
+class _ConnectionCacheState(object):
+
+    def __init__(self, cache):
+        self.cache = cache
+        self.version = None  # graph version of the cached connections
+        self.lock = Lock()
+
+
+connection_cache = ConnectionCache()
@@ -8,19 +8,81 @@ class Config(object):
     SECRET_KEY = os.environ['SECRET_KEY']
     DEBUG = bool(os.environ.get('FLASK_DEBUG'))
 
-    # Database
-    DB_NAME = os.environ['POSTGRES_DB']
-    DB_USER = os.environ['POSTGRES_USER']
-    DB_PASS = os.environ['POSTGRES_PASSWORD']
-    DB_SERVICE = os.environ['POSTGRES_SERVICE']
-    DB_PORT = os.environ['POSTGRES_PORT']
+    # Database, postgres unless `DATABASE_URI` is set, e.g.
+    # 'sqlite:////var/lib/app/app.db'
+    DB_NAME = os.environ.get('POSTGRES_DB')
+    DB_USER = os.environ.get('POSTGRES_USER')
+    DB_PASS = os.environ.get('POSTGRES_PASSWORD')
+    DB_SERVICE = os.environ.get('POSTGRES_SERVICE')
+    DB_PORT = os.environ.get('POSTGRES_PORT')
 
     # SqlAlchemy
-    SQLALCHEMY_DATABASE_URI = 'postgresql://{0}:{1}@{2}:{3}/{4}'.format(
-        DB_USER, DB_PASS, DB_SERVICE, DB_PORT, DB_NAME
-    )
+    SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URI') or \
+        'postgresql://{0}:{1}@{2}:{3}/{4}'.format(
+            DB_USER, DB_PASS, DB_SERVICE, DB_PORT, DB_NAME)
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Optional read replica, see `app.models.core.RoutingSession`
+    DB_REPLICA_SERVICE = os.environ.get('POSTGRES_REPLICA_SERVICE')
+    DB_REPLICA_PORT = os.environ.get('POSTGRES_REPLICA_PORT') or DB_PORT
+    SQLALCHEMY_BINDS = {
+        'replica': 'postgresql://{0}:{1}@{2}:{3}/{4}'.format(
+            DB_USER, DB_PASS, DB_REPLICA_SERVICE, DB_REPLICA_PORT, DB_NAME)
+    } if DB_REPLICA_SERVICE else None
     SQLALCHEMY_ECHO = bool(os.environ.get('SQLALCHEMY_ECHO'))
 
+    # Connections storage, 'postgresql', 'sqlite' or 'memory', defaults to
+    # the database, see `app.models.storage`
+    STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND')
+
+    # GraphQL
+    GRAPHQL_MAX_PAGE_SIZE = 100
+    # See `app.graphql.documents.DocumentCache`
+    GRAPHQL_DOCUMENT_CACHE_SIZE = int(
+        os.environ.get('GRAPHQL_DOCUMENT_CACHE_SIZE') or 1000)
+    GRAPHQL_PERSISTED_QUERIES = os.environ.get(
+        'GRAPHQL_PERSISTED_QUERIES',
+        os.path.join(
+            os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+            'schema', 'persisted_queries.json'))
+    # See `app.graphql.responses.ResponseCache`
+    GRAPHQL_RESPONSE_CACHE_SIZE = int(
+        os.environ.get('GRAPHQL_RESPONSE_CACHE_SIZE') or 0)
+
+    # GraphQL executor, 'sync' or 'asyncio', see `app.graphql.aio`
+    GRAPHQL_EXECUTOR = os.environ.get('GRAPHQL_EXECUTOR', 'sync')
+    ASYNC_DB_POOL_SIZE = int(os.environ.get('ASYNC_DB_POOL_SIZE') or 10)
+
+    # Index page, number of users embedded, 0 embeds every user
+    INDEX_USERS_LIMIT = int(os.environ.get('INDEX_USERS_LIMIT') or 0)
+
+    # Friend suggestions, number of precomputed suggestions per user
+    SUGGESTIONS_TOP_K = 20
+
+    # Common friends, 'sql' or 'vector', see `common_friends_between`
+    COMMON_FRIENDS_ENGINE = os.environ.get('COMMON_FRIENDS_ENGINE', 'sql')
+
+    # Graph store, see `app.graph.GraphStore`
+    GRAPH_STORE_ENABLED = bool(os.environ.get('GRAPH_STORE_ENABLED'))
+    GRAPH_STORE_REFRESH_INTERVAL = int(
+        os.environ.get('GRAPH_STORE_REFRESH_INTERVAL') or 60)
+    GRAPH_STORE_SNAPSHOT = os.environ.get('GRAPH_STORE_SNAPSHOT')
+    GRAPH_STORE_MAX_DELTAS = int(
+        os.environ.get('GRAPH_STORE_MAX_DELTAS') or 100000)
+
+    # Block filter, see `app.graph.BlockFilter`
+    BLOCK_FILTER_ENABLED = bool(os.environ.get('BLOCK_FILTER_ENABLED'))
+    BLOCK_FILTER_ERROR_RATE = float(
+        os.environ.get('BLOCK_FILTER_ERROR_RATE') or 0.01)
+
+    # Connection cache, see `app.cache.ConnectionCache`
+    CONNECTION_CACHE_BACKEND = os.environ.get('CONNECTION_CACHE_BACKEND')
+    CONNECTION_CACHE_SIZE = int(
+        os.environ.get('CONNECTION_CACHE_SIZE') or 100000)
+    CONNECTION_CACHE_TTL = int(os.environ.get('CONNECTION_CACHE_TTL') or 5)
+
+    # Profiling, see `app.profiling.Profiler`
+    PROFILING_ENABLED = bool(os.environ.get('PROFILING_ENABLED'))
+    PROFILING_SLOWEST = int(os.environ.get('PROFILING_SLOWEST') or 5)
+
     # Development
     DEV_FRONTEND_URI = os.environ.get('DEV_FRONTEND_URI')
@@ -0,0 +1,10 @@
+# flake8: noqa
+from .blocks import BlockFilter, BLOCKS_VERSION_KEY
+from .bloom import BloomFilter
+from .common import group_sorted_edges, intersect_many
+from .csr import CSRIndex
+from .snapshot import map_snapshot, write_snapshot
+from .store import CompactGraph, GraphStore
+
+graph_store = GraphStore()
+block_filter = BlockFilter()
@@ -0,0 +1,140 @@
+from .bloom import BloomFilter
+from ..logging import logger
+from flask import current_app, g, has_app_context
+from threading import RLock
+import time
+
+BLOCKS_VERSION_KEY = 'blocks'
+"""Version bumped whenever a connection gains or loses the block flag, see
+`app.models.versions`."""
+
+BLOCK_FILTER_VERSIONS_KEY = 'block_filter_versions'
+
+
+class BlockFilter(object):
+    """Flask extension answering whether a user may have blocked another,
+    from a `BloomFilter` of the `(blocker_id, blocked_id)` blocks.
+
+    A definite no lets writes skip querying the block, a maybe falls back
+    to the exact check in the database along with the current flags, see
+    `User.apply_connections`. The filter
+    is built from the connections storage on first use and updated with the
+    blocks committed by this process. It is rebuilt once the 'blocks' (or
+    'graph') version was bumped by another process, which is checked once
+    per app context, i.e. per request. Unblocked pairs are left in the
+    filter (false positives) until it is rebuilt.
+
+    Configuration:
+    - `BLOCK_FILTER_ENABLED`: skips block checks ruled out, default False
+    - `BLOCK_FILTER_ERROR_RATE`: target false positive rate, default 0.01
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('BLOCK_FILTER_ENABLED', False)
+        app.config.setdefault('BLOCK_FILTER_ERROR_RATE', 0.01)
+        app.extensions['block_filter'] = _BlockFilterState()
+
+    def might_block(self, blocker_id, blocked_id):
+        """Returns False when `blocker_id` has definitely not blocked
+        `blocked_id`, True when it may have or the filter is disabled."""
+        bloom = self.bloom()
+        return bloom is None or (blocker_id, blocked_id) in bloom
+
+    def bloom(self):
+        """Returns the current `BloomFilter`, or None when disabled.
+
+        Must be used within a flask app context."""
+        if not has_app_context() or \
+                not current_app.config['BLOCK_FILTER_ENABLED']:
+            return None
+        state = current_app.extensions['block_filter']
+        versions = self._versions()
+        with state.lock:
+            if state.bloom is None or state.versions != versions:
+                state.bloom = self.load()
+                state.versions = versions
+            return state.bloom
+
+    def load(self):
+        """Returns a new `BloomFilter` of the blocks of the connections
+        storage, see `app.models.storage`."""
+        from ..models import ConnectionType, storage
+        started = time.time()
+        bloom = BloomFilter.from_pairs(
+            ((source_id, target_id) for source_id, target_id, _
+             in storage.backend().edges(mask=ConnectionType.BLOCK.value)),
+            error_rate=current_app.config['BLOCK_FILTER_ERROR_RATE'])
+        logger.info('Loaded {} blocks into block filter in {:.2f}s'.format(
+            len(bloom), time.time() - started))
+        return bloom
+
+    def prepare(self, changes):
+        """Bumps the 'blocks' version in the transaction committing
+        `changes` when any of them gains or loses the block flag, while the
+        filter is enabled."""
+        from ..models import (
+            db, bump_versions, get_versions, GRAPH_VERSION_KEY
+        )
+        if not current_app.config['BLOCK_FILTER_ENABLED'] or \
+                not _flips_block(changes):
+            return
+        bump_versions([BLOCKS_VERSION_KEY])
+        # The version row stays locked until committed, i.e. these are the
+        # versions once `changes` are applied
+        found = get_versions([BLOCKS_VERSION_KEY, GRAPH_VERSION_KEY])
+        db.session.info[BLOCK_FILTER_VERSIONS_KEY] = \
+            (found[BLOCKS_VERSION_KEY], found[GRAPH_VERSION_KEY])
+
+    def apply(self, changes):
+        """Adds the blocks of committed `ConnectionChange` to the loaded
+        filter, when it was current before they were committed."""
+        from ..models import db, ConnectionType
+        if not has_app_context():
+            return
+        versions = db.session.info.pop(BLOCK_FILTER_VERSIONS_KEY, None)
+        state = current_app.extensions.get('block_filter')
+        # Versions left by a failed commit are replaced by the next changes
+        # flipping a block, see `prepare`
+        if versions is None or state is None or not _flips_block(changes):
+            return
+        with state.lock:
+            if state.bloom is None or \
+                    state.versions != (versions[0] - 1, versions[1]):
+                return
+            for change in changes:
+                if ConnectionType.is_block(change.new):
+                    state.bloom.add((change.source_id, change.target_id))
+            state.versions = versions
+            if len(state.bloom) > state.bloom.capacity:
+                state.bloom = None
+        g.block_filter_versions = versions
+
+    def _versions(self):
+        # Checked once per app context, see `BlockFilter`
+        if 'block_filter_versions' not in g:
+            from ..models import get_versions, GRAPH_VERSION_KEY
+            found = get_versions([BLOCKS_VERSION_KEY, GRAPH_VERSION_KEY])
+            g.block_filter_versions = \
+                (found[BLOCKS_VERSION_KEY], found[GRAPH_VERSION_KEY])
+        return g.block_filter_versions
+
+
+def _flips_block(changes):
+    from ..models import ConnectionType
+    return any(
+        ConnectionType.is_block(change.old) !=
+        ConnectionType.is_block(change.new)
+        for change in changes
+    )
+
+
+class _BlockFilterState(object):
+
+    def __init__(self):
+        self.bloom = None
+        self.versions = None
+        self.lock = RLock()
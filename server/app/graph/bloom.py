@@ -0,0 +1,65 @@
+import math
+
+_MASK64 = (1 << 64) - 1
+
+
+def _mix(x):
+    # splitmix64 finalizer, spreads consecutive ids over the whole range
+    x = (x ^ (x >> 30)) * 0xbf58476d1ce4e5b9 & _MASK64
+    x = (x ^ (x >> 27)) * 0x94d049bb133111eb & _MASK64
+    return x ^ (x >> 31)
+
+
+class BloomFilter(object):
+    """Set of `(int, int)` pairs answering membership with false positives
+    but no false negatives, i.e. `pair in bloom` is False only when `pair`
+    was never added.
+
+    The bit array is sized for `capacity` pairs at `error_rate` false
+    positives, which grows past `capacity`. Pairs cannot be removed.
+    """
+
+    def __init__(self, capacity, error_rate=0.01):
+        self.capacity = max(capacity, 1)
+        self.error_rate = error_rate
+        self.size = max(int(math.ceil(
+            -self.capacity * math.log(error_rate) / math.log(2) ** 2)), 64)
+        self.hash_count = max(
+            int(round(self.size / self.capacity * math.log(2))), 1)
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    @classmethod
+    def from_pairs(cls, pairs, error_rate=0.01, headroom=2.0,
+                   min_capacity=1024):
+        """Returns a `BloomFilter` of `pairs`, sized for `headroom` times as
+        many pairs (and at least `min_capacity`) to leave room for adds."""
+        pairs = list(pairs)
+        bloom = cls(
+            max(int(len(pairs) * headroom), min_capacity), error_rate)
+        for pair in pairs:
+            bloom.add(pair)
+        return bloom
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, pair):
+        bits = self.bits
+        return all(
+            bits[position >> 3] & (1 << (position & 7))
+            for position in self._positions(pair)
+        )
+
+    def add(self, pair):
+        bits = self.bits
+        for position in self._positions(pair):
+            bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def _positions(self, pair):
+        # Double hashing, see Kirsch & Mitzenmacher
+        h1 = _mix((pair[0] & 0xffffffff) << 32 | (pair[1] & 0xffffffff))
+        h2 = _mix(h1) | 1
+        size = self.size
+        return [(h1 + i * h2) % size for i in range(self.hash_count)]
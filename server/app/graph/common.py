@@ -0,0 +1,78 @@
+from itertools import groupby
+
+_numpy = []  # [numpy module or None], imported on first use
+
+
+def _import_numpy():
+    # Deferred, numpy is only needed by the graph reads rather than on boot,
+    # see `tests.test_app`
+    if not _numpy:
+        try:
+            import numpy
+        except ImportError:  # pragma: no cover
+            numpy = None
+        _numpy.append(numpy)
+    return _numpy[0]
+
+
+def group_sorted_edges(edges):
+    """Returns `{node: [neighbor, ..]}` from `(node, neighbor)` edges sorted
+    by `(node, neighbor)`, i.e. sorted neighbor arrays per node."""
+    numpy = _import_numpy()
+    if numpy is not None:
+        edges = numpy.asarray(edges, dtype=numpy.int32).reshape(-1, 2)
+        if not len(edges):
+            return {}
+        nodes, starts = numpy.unique(edges[:, 0], return_index=True)
+        return dict(zip(
+            nodes.tolist(), numpy.split(edges[:, 1], starts[1:])))
+    return dict(
+        (node, [neighbor for _, neighbor in group])
+        for node, group in groupby(edges, key=lambda edge: edge[0])
+    )
+
+
+def intersect_many(source, targets):
+    """Returns the intersection of the sorted `source` array with each of
+    the sorted `targets` arrays, as an array of lists.
+
+    With numpy, every target is checked at once: the targets are
+    concatenated and looked up in `source` with a single `searchsorted`.
+    Otherwise each target is merged with `source` in linear time.
+    """
+    numpy = _import_numpy()
+    if numpy is not None:
+        return _intersect_many_vectorized(numpy, source, targets)
+    return [_intersect_sorted(source, target) for target in targets]
+
+
+def _intersect_many_vectorized(numpy, source, targets):
+    source = numpy.asarray(source, dtype=numpy.int32)
+    targets = [numpy.asarray(target, dtype=numpy.int32) for target in targets]
+    if not len(source) or not targets:
+        return [[] for _ in targets]
+    flat = numpy.concatenate(targets)
+    if not len(flat):
+        return [[] for _ in targets]
+    positions = numpy.searchsorted(source, flat)
+    positions[positions == len(source)] = 0
+    found = source[positions] == flat
+    offsets = numpy.cumsum([len(target) for target in targets])[:-1]
+    return [
+        target[hits].tolist()
+        for target, hits in zip(targets, numpy.split(found, offsets))
+    ]
+
+
+def _intersect_sorted(a, b):
+    i, j, common = 0, 0, []
+    while i < len(a) and j < len(b):
+        if a[i] < b[j]:
+            i += 1
+        elif a[i] > b[j]:
+            j += 1
+        else:
+            common.append(b[j])
+            i += 1
+            j += 1
+    return common
@@ -0,0 +1,82 @@
+from array import array
+from bisect import bisect_left
+
+
+class CSRIndex(object):
+    """Compressed sparse row (CSR) adjacency of `(node, neighbor, flags)`.
+
+    The neighbors of `node` are `neighbors[offsets[node]:offsets[node + 1]]`,
+    sorted ascending, and the connection flags of each edge is kept at the
+    same position in `flags`. Nodes are user_ids, which are dense serial
+    integers, so `offsets` is indexed by the user_id directly.
+
+    `offsets` is an int64 array, `neighbors` and `flags` are int32 arrays,
+    i.e. an edge costs 8 bytes per index.
+    """
+
+    def __init__(self, offsets, neighbors, flags):
+        self.offsets = offsets
+        self.neighbors = neighbors
+        self.flags = flags
+
+    @classmethod
+    def build(cls, nodes, neighbors, flags, size):
+        """Returns a `CSRIndex` of `size` nodes, where `nodes`, `neighbors`
+        and `flags` are parallel arrays of edges.
+
+        Edges are grouped by `nodes` with a (stable) counting sort, so the
+        neighbors of a node are sorted as long as they are sorted in input.
+        """
+        offsets = array('q', [0]) * (size + 1)
+        for node in nodes:
+            offsets[node + 1] += 1
+        for i in range(1, size + 1):
+            offsets[i] += offsets[i - 1]
+        positions = array('q', offsets)
+        sorted_neighbors = array('i', [0]) * len(neighbors)
+        sorted_flags = array('i', [0]) * len(flags)
+        for node, neighbor, flag in zip(nodes, neighbors, flags):
+            position = positions[node]
+            sorted_neighbors[position] = neighbor
+            sorted_flags[position] = flag
+            positions[node] = position + 1
+        return cls(offsets, sorted_neighbors, sorted_flags)
+
+    @property
+    def size(self):
+        return len(self.offsets) - 1
+
+    def row(self, node):
+        """Returns the `(start, end)` slice of `node` neighbors."""
+        if node < 0 or node >= self.size:
+            return 0, 0
+        return self.offsets[node], self.offsets[node + 1]
+
+    def degree(self, node):
+        start, end = self.row(node)
+        return end - start
+
+    def edges_of(self, node):
+        """Yields `(neighbor, flags)` of `node`, sorted by neighbor."""
+        start, end = self.row(node)
+        neighbors, flags = self.neighbors, self.flags
+        for i in range(start, end):
+            yield neighbors[i], flags[i]
+
+    def neighbors_of(self, node, mask, exclude=0):
+        """Returns the sorted neighbors of `node` where the edge flags
+        matches any of `mask` and none of `exclude`."""
+        start, end = self.row(node)
+        neighbors, flags = self.neighbors, self.flags
+        return [
+            neighbors[i] for i in range(start, end)
+            if flags[i] & mask and not flags[i] & exclude
+        ]
+
+    def flags_of(self, node, neighbor):
+        """Returns the flags of `node` -> `neighbor`, 0 if no such edge."""
+        start, end = self.row(node)
+        i = bisect_left(self.neighbors, neighbor, start, end)
+        if i < end and self.neighbors[i] == neighbor:
+            return self.flags[i]
+        return 0
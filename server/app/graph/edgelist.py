@@ -0,0 +1,95 @@
+"""Compact binary edge lists of `(source_id, target_id, flags)` connections,
+see `write_edges` and `read_edges`.
+
+A file is a header followed by chunks of up to `chunk_size` edges:
+- header: `MAGIC`, the format version and the compression (uint8 each)
+- chunk: the number of edges and the payload size (uint32 each), then the
+  payload, i.e. the source_ids, target_ids and flags of the chunk as
+  little endian int32 columns, compressed unless 'none'
+- end: a chunk header of 0 edges and no payload
+
+Files are written and read one chunk at a time, i.e. in constant memory.
+"""
+from array import array
+import struct
+import sys
+import zlib
+
+MAGIC = b'EDGL'
+
+VERSION = 1
+
+COMPRESSIONS = ('none', 'zlib')
+
+_HEADER = struct.Struct('<4sBB')
+
+_CHUNK = struct.Struct('<II')
+
+
+def write_edges(fp, edges, chunk_size=65536, compression='zlib'):
+    """Writes the `(source_id, target_id, flags)` of `edges` into the binary
+    file `fp`, returns the number of edges written."""
+    assert compression in COMPRESSIONS, \
+        'Unsupported compression: {}'.format(compression)
+    fp.write(_HEADER.pack(MAGIC, VERSION, COMPRESSIONS.index(compression)))
+    n_edges = 0
+    columns = _new_columns()
+    for source_id, target_id, flags in edges:
+        columns[0].append(source_id)
+        columns[1].append(target_id)
+        columns[2].append(flags)
+        if len(columns[0]) >= chunk_size:
+            n_edges += _write_chunk(fp, columns, compression)
+            columns = _new_columns()
+    if columns[0]:
+        n_edges += _write_chunk(fp, columns, compression)
+    # Ends the edge list
+    fp.write(_CHUNK.pack(0, 0))
+    return n_edges
+
+
+def read_edges(fp):
+    """Yields the `(source_ids, target_ids, flags)` int32 arrays of each
+    chunk of the binary file `fp`."""
+    magic, version, compression = _HEADER.unpack(_read(fp, _HEADER.size))
+    assert magic == MAGIC, 'Not an edge list'
+    assert version == VERSION, \
+        'Unsupported edge list version: {}'.format(version)
+    compression = COMPRESSIONS[compression]
+    while True:
+        n_edges, size = _CHUNK.unpack(_read(fp, _CHUNK.size))
+        if not n_edges:
+            assert not size, 'Corrupted edge list'
+            return
+        payload = _read(fp, size)
+        if compression == 'zlib':
+            payload = zlib.decompress(payload)
+        data = array('i')
+        data.frombytes(payload)
+        if sys.byteorder == 'big':
+            data.byteswap()
+        yield (
+            data[:n_edges], data[n_edges:2 * n_edges], data[2 * n_edges:])
+
+
+def _new_columns():
+    return array('i'), array('i'), array('i')
+
+
+def _write_chunk(fp, columns, compression):
+    n_edges = len(columns[0])
+    data = columns[0] + columns[1] + columns[2]
+    if sys.byteorder == 'big':
+        data.byteswap()
+    payload = data.tobytes()
+    if compression == 'zlib':
+        payload = zlib.compress(payload)
+    fp.write(_CHUNK.pack(n_edges, len(payload)))
+    fp.write(payload)
+    return n_edges
+
+
+def _read(fp, size):
+    data = fp.read(size)
+    assert len(data) == size, 'Truncated edge list'
+    return data
@@ -0,0 +1,84 @@
+"""Read-only snapshots of the `CSRIndex` of a `CompactGraph`, memory mapped
+by each process, i.e. every uwsgi worker shares the same pages of the page
+cache instead of loading its own copy of the graph.
+
+A snapshot file is a header followed by the `offsets`, `neighbors` and
+`flags` arrays of the forward then reverse indexes, in native byte order
+and each aligned on 8 bytes:
+- header: `MAGIC`, the format version, the byte order, the number of nodes
+  and edges, the time the snapshot was built at and the graph version of
+  the edges, see `app.models.GRAPH_VERSION_KEY`
+- `offsets`: int64 array of `nodes + 1` values
+- `neighbors`, `flags`: int32 arrays of `edges` values
+
+Snapshots are replaced atomically, processes mapping the previous one keep
+reading it until they map the new one.
+"""
+from .csr import CSRIndex
+from array import array
+import mmap
+import os
+import struct
+import sys
+
+MAGIC = b'CSRG'
+
+VERSION = 2
+
+_HEADER = struct.Struct('<4sIc3xqqdq')
+
+_BYTE_ORDERS = {'little': b'<', 'big': b'>'}
+
+
+def write_snapshot(path, forward, reverse, built_at, graph_version):
+    """Writes the `forward` and `reverse` `CSRIndex` into a snapshot at
+    `path`, where `built_at` is the time the edges were read at and
+    `graph_version` the graph version they were read at."""
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tmp_path, 'wb') as fp:
+        header = _HEADER.pack(
+            MAGIC, VERSION, _BYTE_ORDERS[sys.byteorder],
+            forward.size, len(forward.neighbors), built_at, graph_version)
+        fp.write(header)
+        fp.write(b'\0' * (_aligned(len(header)) - len(header)))
+        for index in (forward, reverse):
+            for values in (index.offsets, index.neighbors, index.flags):
+                _write_array(fp, values)
+    os.rename(tmp_path, path)
+
+
+def map_snapshot(path):
+    """Returns the `(forward, reverse, built_at, graph_version)` of the
+    snapshot at `path`, where the arrays of the `CSRIndex` are read-only
+    views of the mapped file."""
+    with open(path, 'rb') as fp:
+        data = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, version, byte_order, size, n_edges, built_at, graph_version = \
+        _HEADER.unpack_from(data)
+    assert magic == MAGIC, 'Not a graph snapshot: {}'.format(path)
+    assert version == VERSION, \
+        'Unsupported graph snapshot version: {}'.format(version)
+    assert byte_order == _BYTE_ORDERS[sys.byteorder], \
+        'Graph snapshot of another byte order: {}'.format(path)
+    view = memoryview(data)
+    position = _aligned(_HEADER.size)
+    indexes = []
+    for _ in range(2):
+        arrays = []
+        for typecode, length in (('q', size + 1), ('i', n_edges),
+                                 ('i', n_edges)):
+            end = position + length * array(typecode).itemsize
+            arrays.append(view[position:end].cast(typecode))
+            position = _aligned(end)
+        indexes.append(CSRIndex(*arrays))
+    return indexes[0], indexes[1], built_at, graph_version
+
+
+def _write_array(fp, values):
+    data = values.tobytes()
+    fp.write(data)
+    fp.write(b'\0' * (_aligned(len(data)) - len(data)))
+
+
+def _aligned(position):
+    return (position + 7) // 8 * 8
@@ -0,0 +1,325 @@
+from .csr import CSRIndex
+from .snapshot import map_snapshot, write_snapshot
+from ..logging import logger
+from array import array
+from collections import defaultdict
+from flask import current_app, has_app_context
+from threading import RLock
+import os
+import time
+
+
+class CompactGraph(object):
+    """In-memory copy of the connections.
+
+    Edges are kept in two `CSRIndex`, `forward` (source -> targets) and
+    `reverse` (target -> sources), together with an overlay of the changes
+    applied since the indexes were built. Once the overlay grows past
+    `compact_threshold` edges (0 never), the indexes are rebuilt with the
+    changes merged in.
+    """
+
+    def __init__(self, forward, reverse, compact_threshold=10000):
+        self.forward = forward
+        self.reverse = reverse
+        self.compact_threshold = compact_threshold
+        self._outgoing = defaultdict(dict)  # {source_id: {target_id: flags}}
+        self._incoming = defaultdict(dict)  # {target_id: {source_id: flags}}
+        self._changes = 0
+        self._lock = RLock()
+
+    @classmethod
+    def from_edges(cls, edges, **kwargs):
+        """Returns a `CompactGraph` of `(source_id, target_id, flags)` edges,
+        which must be sorted by `(source_id, target_id)`."""
+        sources, targets, flags = array('i'), array('i'), array('i')
+        for source_id, target_id, flag in edges:
+            if not flag:
+                continue
+            sources.append(source_id)
+            targets.append(target_id)
+            flags.append(flag)
+        size = max(max(sources), max(targets)) + 1 if sources else 0
+        return cls(
+            CSRIndex.build(sources, targets, flags, size),
+            CSRIndex.build(targets, sources, flags, size),
+            **kwargs
+        )
+
+    def __len__(self):
+        return len(self.forward.neighbors) + self._changes
+
+    def connection(self, source_id, target_id):
+        """Returns the connection flags of `source_id` -> `target_id`."""
+        overlay = self._outgoing.get(source_id)
+        if overlay and target_id in overlay:
+            return overlay[target_id]
+        return self.forward.flags_of(source_id, target_id)
+
+    def successors(self, source_id, mask, exclude=0):
+        """Returns the sorted target_ids connected from `source_id` with
+        any of the `mask` flags and none of the `exclude` flags."""
+        return self._neighbors(
+            self.forward, self._outgoing, source_id, mask, exclude)
+
+    def predecessors(self, target_id, mask, exclude=0):
+        """Returns the sorted source_ids connected to `target_id` with
+        any of the `mask` flags and none of the `exclude` flags."""
+        return self._neighbors(
+            self.reverse, self._incoming, target_id, mask, exclude)
+
+    def apply(self, changes):
+        """Applies an iterable of `ConnectionChange`."""
+        with self._lock:
+            for change in changes:
+                self._outgoing[change.source_id][change.target_id] = \
+                    change.new
+                self._incoming[change.target_id][change.source_id] = \
+                    change.new
+                self._changes += 1
+            if self.compact_threshold and \
+                    self._changes > self.compact_threshold:
+                self.compact()
+
+    def edges(self):
+        """Yields every `(source_id, target_id, flags)` sorted by
+        `(source_id, target_id)`, including the overlay."""
+        with self._lock:
+            size = max([self.forward.size] + [
+                source_id + 1 for source_id in self._outgoing])
+            for source_id in range(size):
+                overlay = self._outgoing.get(source_id)
+                if not overlay:
+                    for target_id, flags in self.forward.edges_of(source_id):
+                        yield source_id, target_id, flags
+                    continue
+                merged = dict(self.forward.edges_of(source_id))
+                merged.update(overlay)
+                for target_id in sorted(merged):
+                    if merged[target_id]:
+                        yield source_id, target_id, merged[target_id]
+
+    def compact(self):
+        """Rebuilds the indexes with the overlay merged in."""
+        with self._lock:
+            graph = CompactGraph.from_edges(self.edges())
+            self.forward, self.reverse = graph.forward, graph.reverse
+            self._outgoing.clear()
+            self._incoming.clear()
+            self._changes = 0
+
+    def _neighbors(self, index, overlays, node, mask, exclude):
+        overlay = overlays.get(node)
+        if not overlay:
+            return index.neighbors_of(node, mask, exclude)
+        neighbors = [
+            neighbor for neighbor, flags in index.edges_of(node)
+            if neighbor not in overlay and
+            flags & mask and not flags & exclude
+        ]
+        neighbors.extend(
+            neighbor for neighbor, flags in overlay.items()
+            if flags & mask and not flags & exclude
+        )
+        neighbors.sort()
+        return neighbors
+
+
+class GraphStore(object):
+    """Flask extension serving graph reads from a `CompactGraph`.
+
+    The graph is loaded from the connections storage on first use and kept
+    current with the committed `ConnectionChange` of this process. Writes
+    made by other processes are picked up when the graph is reloaded every
+    `GRAPH_STORE_REFRESH_INTERVAL` seconds (0 disables reloading, only for
+    single process deployments). Bulk
+    loads bumping the graph version (see `app.models.GRAPH_VERSION_KEY`),
+    checked once per app context, reload the graph right away.
+
+    With `GRAPH_STORE_SNAPSHOT`, the graph is instead mapped from a snapshot
+    file (see `app.graph.snapshot` and `save_snapshot`), i.e. processes start
+    without loading the connections and share the pages of the graph. The
+    changes of this process are kept in a delta log while a snapshot is
+    mapped, replayed on top of newer snapshots once mapped (checked every
+    refresh interval), and are never compacted into private copies of the
+    indexes. Past `GRAPH_STORE_MAX_DELTAS` changes, the graph is instead
+    reloaded from the connections storage by the next read, until a newer
+    snapshot is saved. Snapshots saved before the latest bulk load are
+    ignored.
+
+    Configuration:
+    - `GRAPH_STORE_ENABLED`: serves graph reads from memory, default False
+    - `GRAPH_STORE_REFRESH_INTERVAL`: seconds before reloading, default 60
+    - `GRAPH_STORE_COMPACT_THRESHOLD`: see `CompactGraph`, default 10000
+    - `GRAPH_STORE_SNAPSHOT`: path of the snapshot to map, default None
+    - `GRAPH_STORE_MAX_DELTAS`: changes applied on top of the snapshot
+      before reloading from the storage, default 100000
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('GRAPH_STORE_ENABLED', False)
+        app.config.setdefault('GRAPH_STORE_REFRESH_INTERVAL', 60)
+        app.config.setdefault('GRAPH_STORE_COMPACT_THRESHOLD', 10000)
+        app.config.setdefault('GRAPH_STORE_SNAPSHOT', None)
+        app.config.setdefault('GRAPH_STORE_MAX_DELTAS', 100000)
+        app.extensions['graph_store'] = _GraphStoreState()
+
+    def graph(self):
+        """Returns the current `CompactGraph`, or None when disabled.
+
+        Must be used within a flask app context."""
+        if not has_app_context() or \
+                not current_app.config['GRAPH_STORE_ENABLED']:
+            return None
+        from ..models import get_graph_version
+        state = current_app.extensions['graph_store']
+        interval = current_app.config['GRAPH_STORE_REFRESH_INTERVAL']
+        version = get_graph_version()
+        with state.lock:
+            if state.graph is not None and state.version != version:
+                # Bulk loaded by another process, which the graph and the
+                # delta log predate
+                state.graph = None
+                state.snapshot_stat = None
+                state.clear_deltas()
+            if state.graph is None or \
+                    (interval and time.time() - state.loaded_at > interval):
+                state.loaded_at = time.time()
+                if state.graph is None or not self._snapshot_mapped(state):
+                    state.graph = self.load()
+                    state.version = version
+            return state.graph
+
+    def load(self):
+        """Returns a new `CompactGraph` of the snapshot when configured and
+        saved since the latest bulk load (and not mapped already, see
+        `GRAPH_STORE_MAX_DELTAS`), else of the connections storage, see
+        `app.models.storage`."""
+        state = current_app.extensions['graph_store']
+        path = current_app.config['GRAPH_STORE_SNAPSHOT']
+        if path and os.path.exists(path) and \
+                not self._snapshot_mapped(state):
+            graph = self._map_snapshot(path)
+            if graph is not None:
+                return graph
+        from ..models.storage import storage
+        started = time.time()
+        graph = CompactGraph.from_edges(
+            storage.backend().edges(),
+            compact_threshold=current_app.config[
+                'GRAPH_STORE_COMPACT_THRESHOLD']
+        )
+        logger.info('Loaded {} connections into graph store in {:.2f}s'.format(
+            len(graph), time.time() - started))
+        with state.lock:
+            # Only replayed on top of a mapped snapshot
+            state.mapped = False
+            state.clear_deltas()
+        return graph
+
+    def save_snapshot(self, path=None):
+        """Saves a snapshot of the connections storage at `path`, defaults
+        to `GRAPH_STORE_SNAPSHOT`, returns the number of connections."""
+        from ..models import get_version, storage, GRAPH_VERSION_KEY
+        path = path or current_app.config['GRAPH_STORE_SNAPSHOT']
+        assert path, 'Expects a snapshot path'
+        started = time.time()
+        version = get_version(GRAPH_VERSION_KEY)
+        graph = CompactGraph.from_edges(storage.backend().edges())
+        write_snapshot(path, graph.forward, graph.reverse, started, version)
+        logger.info('Saved {} connections to `{}` in {:.2f}s'.format(
+            len(graph), path, time.time() - started))
+        return len(graph)
+
+    def apply(self, changes):
+        """Applies committed `ConnectionChange` to the loaded graph."""
+        if not has_app_context():
+            return
+        state = current_app.extensions.get('graph_store')
+        if state is None:
+            return
+        with state.lock:
+            if state.graph is None:
+                return
+            state.graph.apply(changes)
+            if not state.mapped:
+                return
+            state.deltas.append((time.time(), changes))
+            state.delta_changes += len(changes)
+            if state.delta_changes > \
+                    current_app.config['GRAPH_STORE_MAX_DELTAS']:
+                logger.info(
+                    'Reloading graph store, {} changes since mapped'.format(
+                        state.delta_changes))
+                state.graph = None
+                state.mapped = False
+                state.clear_deltas()
+
+    def _snapshot_mapped(self, state):
+        """Returns True when the latest snapshot was mapped (or ignored)
+        already."""
+        path = current_app.config['GRAPH_STORE_SNAPSHOT']
+        if not path or state.snapshot_stat is None:
+            return False
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return True
+        return (stat.st_ino, stat.st_mtime) == state.snapshot_stat
+
+    def _map_snapshot(self, path):
+        """Returns the `CompactGraph` of the snapshot at `path` with the
+        delta log replayed, or None when saved before the latest bulk
+        load."""
+        from ..models import get_graph_version
+        state = current_app.extensions['graph_store']
+        stat = os.stat(path)
+        forward, reverse, built_at, version = map_snapshot(path)
+        if version != get_graph_version():
+            logger.warning(
+                'Ignored `{}`, saved before the graph was bulk loaded'.format(
+                    path))
+            with state.lock:
+                # Mapped once saved again, see `_snapshot_mapped`
+                state.snapshot_stat = (stat.st_ino, stat.st_mtime)
+            return None
+        graph = CompactGraph(forward, reverse, compact_threshold=0)
+        with state.lock:
+            # Changes committed once the snapshot was read are replayed,
+            # older ones are part of it
+            state.deltas = [
+                (committed_at, changes)
+                for committed_at, changes in state.deltas
+                if committed_at >= built_at
+            ]
+            state.delta_changes = 0
+            for _, changes in state.deltas:
+                graph.apply(changes)
+                state.delta_changes += len(changes)
+            state.snapshot_stat = (stat.st_ino, stat.st_mtime)
+            state.mapped = True
+        logger.info(
+            'Mapped {} connections from `{}` with {} delta changes'.format(
+                len(graph), path, state.delta_changes))
+        return graph
+
+
+class _GraphStoreState(object):
+
+    def __init__(self):
+        self.graph = None
+        self.loaded_at = 0
+        self.version = None  # graph version of the loaded graph
+        self.snapshot_stat = None  # (st_ino, st_mtime) of the mapped file
+        self.mapped = False  # whether the graph is mapped from the snapshot
+        self.deltas = []  # [(committed_at, changes), ..] of the delta log
+        self.delta_changes = 0  # number of changes of the delta log
+        self.lock = RLock()
+
+    def clear_deltas(self):
+        self.deltas = []
+        self.delta_changes = 0
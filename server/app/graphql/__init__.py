@@ -1,37 +1,34 @@
-import graphene
-from graphene import relay
-from graphene_sqlalchemy import SQLAlchemyConnectionField
-from .users import (
-    User, UserConnectionMutation, current_user
-)
-from ..models import User as UserModel
+"""The GraphQL API, see `get_schema` and `graphql_view`.
 
+Building the schema imports graphene and graphene_sqlalchemy and creates
+every type, i.e. most of the startup time of the app. Both are deferred
+until first used, e.g. by the first request to `/graphql`, unless prebuilt
+by `app.warm_up`.
+"""
 
-class Query(graphene.ObjectType):
+_view = None
 
-    node = relay.Node.Field()
-    me = graphene.Field(User)
 
-    all_users = SQLAlchemyConnectionField(lambda: User)
+def get_schema():
+    """Returns the `graphene.Schema` of the API, built on first call."""
+    from .schema import schema
+    return schema
 
-    def resolve_me(*args):
-        return current_user()
 
-    def resolve_all_users(*args):
-        return UserModel.query.\
-            order_by(UserModel.first_name)
+def get_view():
+    """Returns the `GraphQLView` view function, created on first call."""
+    global _view
+    if _view is None:
+        from .view import GraphQLView
+        _view = GraphQLView.as_view(
+            'graphql', schema=get_schema(), graphiql=True)
+    return _view
 
 
-class Mutation(graphene.ObjectType):
+def graphql_view(**kwargs):
+    """The `/graphql` view, see `get_view`."""
+    return get_view()(**kwargs)
 
-    befriend = UserConnectionMutation.Field()
-    unfriend = UserConnectionMutation.Field()
-    follow = UserConnectionMutation.Field()
-    unfollow = UserConnectionMutation.Field()
-    block = UserConnectionMutation.Field()
-    unblock = UserConnectionMutation.Field()
 
-
-types = [User]
-
-schema = graphene.Schema(query=Query, mutation=Mutation, types=types)
+# Read when the URL rule is added, as `GraphQLView.methods`
+graphql_view.methods = ['GET', 'POST', 'PUT', 'DELETE']
@@ -0,0 +1,122 @@
+"""Asyncio execution of GraphQL requests, used when `GRAPHQL_EXECUTOR` is
+'asyncio', see `app.models.aio`.
+
+Resolvers still run in the request thread, but the DataLoaders are
+replaced by variants whose `batch_load_fn` is a coroutine, i.e. batches
+that do not depend on each other (e.g. the connections and the common
+friends of a page of users) run their queries concurrently.
+"""
+from .users import (
+    UserLoader, CurrentUserCommonFriendIdsLoader, CurrentUserConnectionLoader,
+    RelatedUserIdsLoader, UserDegreesLoader
+)
+from ..models import aio, current_user_id
+from graphql.execution.executors.asyncio import AsyncioExecutor
+from promise import Promise
+import asyncio
+
+
+class LoopExecutor(AsyncioExecutor):
+    """Executes resolvers on the event loop of the current thread, and also
+    waits for the batches of the DataLoaders scheduled meanwhile."""
+
+    def __init__(self):
+        super(LoopExecutor, self).__init__(loop=aio.event_loop())
+
+    def wait_until_finished(self):
+        while True:
+            futures = self.futures + aio.pending()
+            self.futures = []
+            if not futures:
+                return
+            self.loop.run_until_complete(
+                asyncio.wait(futures, loop=self.loop))
+
+
+class AsyncUserLoader(UserLoader):
+
+    def batch_load_fn(self, keys):
+        return Promise.resolve(aio.spawn(self._load(list(keys))))
+
+    @asyncio.coroutine
+    def _load(self, keys):
+        users = yield from aio.users_by_id(keys)
+        return [users.get(user_id, None) for user_id in keys]
+
+
+class AsyncCurrentUserCommonFriendIdsLoader(
+        CurrentUserCommonFriendIdsLoader):
+
+    def batch_load_fn(self, keys):
+        return Promise.resolve(aio.spawn(self._load(list(keys))))
+
+    @asyncio.coroutine
+    def _load(self, keys):
+        common = yield from aio.common_friends_between(
+            current_user_id(), list(set(keys)))
+        friends = dict(common)
+        return [list(friends.get(target_id, [])) for target_id in keys]
+
+
+class AsyncCurrentUserConnectionLoader(CurrentUserConnectionLoader):
+
+    def batch_load_fn(self, keys):
+        return Promise.resolve(aio.spawn(self._load(list(keys))))
+
+    @asyncio.coroutine
+    def _load(self, keys):
+        connects = yield from aio.connections_both_ways(
+            current_user_id(), keys)
+        return [connects.get(target_id, (0, 0)) for target_id in keys]
+
+
+class AsyncUserDegreesLoader(UserDegreesLoader):
+
+    def batch_load_fn(self, keys):
+        return Promise.resolve(aio.spawn(self._load(list(keys))))
+
+    @asyncio.coroutine
+    def _load(self, keys):
+        degrees = yield from aio.degrees_of(keys)
+        return [degrees[user_id] for user_id in keys]
+
+
+class AsyncRelatedUserIdsLoader(RelatedUserIdsLoader):
+
+    def batch_load_fn(self, keys):
+        return Promise.resolve(aio.spawn(self._load(list(keys))))
+
+    @asyncio.coroutine
+    def _load(self, keys):
+        # {page: [user_id, ..]}
+        pages = {}
+        for user_id, page in keys:
+            pages.setdefault(page, []).append(user_id)
+        # Pages are fetched concurrently
+        pages = list(pages.items())
+        results = yield from asyncio.gather(*[
+            aio.related_user_ids_of(
+                user_ids, self.relationship,
+                after=page.after[0] if page.after else None,
+                before=page.before[0] if page.before else None,
+                limit=page.limit + 1,
+                descending=page.reverse)
+            for page, user_ids in pages
+        ], loop=aio.event_loop())
+        related = {}
+        for (page, _), found in zip(pages, results):
+            related.update(
+                ((user_id, page), related_ids)
+                for user_id, related_ids in found.items()
+            )
+        return [related[key] for key in keys]
+
+
+ASYNC_LOADERS = {
+    UserLoader: AsyncUserLoader,
+    CurrentUserCommonFriendIdsLoader: AsyncCurrentUserCommonFriendIdsLoader,
+    CurrentUserConnectionLoader: AsyncCurrentUserConnectionLoader,
+    RelatedUserIdsLoader: AsyncRelatedUserIdsLoader,
+    UserDegreesLoader: AsyncUserDegreesLoader,
+}
+"""Maps the DataLoaders to their asyncio variant."""
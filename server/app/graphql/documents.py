@@ -0,0 +1,95 @@
+from ..cache import LRUCache
+from flask import current_app
+from hashlib import sha256
+import json
+import os
+
+PERSISTED_QUERY_NOT_FOUND = 'PersistedQueryNotFound'
+
+
+def document_id_of(query):
+    """Returns the id of a `query` text, i.e. its sha256 hex digest."""
+    return sha256(query.encode('utf-8')).hexdigest()
+
+
+class DocumentCache(object):
+    """Flask extension caching the parsed and validated GraphQL documents by
+    the sha256 of their text, i.e. repeated queries skip parse and
+    validate.
+
+    Also serves persisted queries, where clients send the `id` of a query
+    registered at build time (see the `persist-queries` command) instead of
+    its text.
+
+    Configuration:
+    - `GRAPHQL_DOCUMENT_CACHE_SIZE`: maximum cached documents, 0 disables
+    - `GRAPHQL_PERSISTED_QUERIES`: path of the `{id: query}` JSON file of
+      the persisted queries, or None
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('GRAPHQL_DOCUMENT_CACHE_SIZE', 1000)
+        app.config.setdefault('GRAPHQL_PERSISTED_QUERIES', None)
+        size = app.config['GRAPHQL_DOCUMENT_CACHE_SIZE']
+        app.extensions['graphql_documents'] = _DocumentCacheState(
+            LRUCache(size) if size else None,
+            load_persisted_queries(app.config['GRAPHQL_PERSISTED_QUERIES']))
+
+    def get(self, schema, query=None, document_id=None):
+        """Returns the `(document, errors)` of the `query` text, or of the
+        persisted query `document_id` when there is no `query`, where
+        `document` is None when it is invalid.
+
+        Only valid documents are cached."""
+        # Deferred, graphql is imported by the first request, see
+        # `app.graphql`
+        from graphql import Source, parse, validate
+        from graphql.error import GraphQLError
+        state = current_app.extensions['graphql_documents']
+        if query is None:
+            query = state.persisted.get(document_id)
+            if query is None:
+                return None, [GraphQLError(PERSISTED_QUERY_NOT_FOUND)]
+        else:
+            document_id = document_id_of(query)
+        if state.cache is not None:
+            found = state.cache.get_many([document_id])
+            if found:
+                return found[document_id], []
+        try:
+            document = parse(Source(query, name='GraphQL request'))
+        except Exception as e:
+            return None, [e]
+        errors = validate(schema, document)
+        if errors:
+            return None, errors
+        if state.cache is not None:
+            state.cache.set_many({document_id: document})
+        return document, []
+
+    def stats(self):
+        cache = current_app.extensions['graphql_documents'].cache
+        return cache.stats() if cache is not None else {}
+
+
+def load_persisted_queries(filepath):
+    """Returns the `{id: query}` of the persisted queries JSON file, which
+    is optional."""
+    if not filepath or not os.path.exists(filepath):
+        return {}
+    with open(filepath) as fp:
+        return json.load(fp)
+
+
+class _DocumentCacheState(object):
+
+    def __init__(self, cache, persisted):
+        self.cache = cache
+        self.persisted = persisted
+
+
+document_cache = DocumentCache()
@@ -0,0 +1,94 @@
+from base64 import b64decode, b64encode
+from collections import namedtuple
+from flask import current_app
+from graphene.relay import PageInfo
+from sqlalchemy import tuple_
+import json
+
+CURSOR_PREFIX = 'keyset:'
+
+
+def encode_cursor(key):
+    """Returns an opaque relay cursor of a keyset `key` tuple."""
+    value = CURSOR_PREFIX + json.dumps(list(key))
+    return b64encode(value.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """Returns the keyset `key` tuple of an `encode_cursor` cursor."""
+    if cursor is None:
+        return None
+    try:
+        value = b64decode(cursor.encode('ascii')).decode('utf-8')
+        assert value.startswith(CURSOR_PREFIX)
+        return tuple(json.loads(value[len(CURSOR_PREFIX):]))
+    except Exception:
+        raise ValueError('Invalid cursor: {}'.format(cursor))
+
+
+class KeysetPage(namedtuple('KeysetPage', (
+        'after', 'before', 'limit', 'reverse'))):
+    """Describes a page of a relay connection paginated with keyset cursors,
+    i.e. the cursor of an edge is the (unique) sort key of its node.
+
+    Unlike offset pagination, fetching the page after a cursor is a
+    `WHERE key > after ORDER BY key LIMIT n`, which is an index range scan
+    costing the same for any page.
+
+    - `after`, `before`: the decoded key of the cursors, or None
+    - `limit`: number of edges, at most `GRAPHQL_MAX_PAGE_SIZE`
+    - `reverse`: True when paginating backwards with `last`
+    """
+
+    @classmethod
+    def from_args(cls, args):
+        """Returns a `KeysetPage` of the relay connection `args`."""
+        first, last = args.get('first'), args.get('last')
+        reverse = first is None and last is not None
+        limit = last if reverse else first
+        max_page_size = current_app.config['GRAPHQL_MAX_PAGE_SIZE']
+        if limit is None or limit > max_page_size:
+            limit = max_page_size
+        assert limit >= 0, 'Expects a positive `first` or `last`'
+        return cls(
+            decode_cursor(args.get('after')),
+            decode_cursor(args.get('before')),
+            limit,
+            reverse,
+        )
+
+    def query(self, query, columns):
+        """Returns the SqlAlchemy `query` restricted to this page, where
+        `columns` are the sort key. Fetches one extra row to tell whether
+        there are more pages, see `connection`."""
+        key = tuple_(*columns)
+        if self.after is not None:
+            query = query.filter(key > tuple_(*self.after))
+        if self.before is not None:
+            query = query.filter(key < tuple_(*self.before))
+        if self.reverse:
+            query = query.order_by(*[column.desc() for column in columns])
+        else:
+            query = query.order_by(*columns)
+        return query.limit(self.limit + 1)
+
+    def connection(self, connection_type, rows):
+        """Returns an instance of `connection_type` of `(key, node)` rows,
+        fetched in page order with up to `limit + 1` rows."""
+        has_more = len(rows) > self.limit
+        rows = rows[:self.limit]
+        if self.reverse:
+            rows.reverse()
+        edges = [
+            connection_type.Edge(node=node, cursor=encode_cursor(key))
+            for key, node in rows
+        ]
+        return connection_type(
+            edges=edges,
+            page_info=PageInfo(
+                start_cursor=edges[0].cursor if edges else None,
+                end_cursor=edges[-1].cursor if edges else None,
+                has_previous_page=self.reverse and has_more,
+                has_next_page=not self.reverse and has_more,
+            )
+        )
@@ -0,0 +1,136 @@
+from ..cache import LRUCache
+from ..models import (
+    db, User as UserModel, current_user_id, get_versions, user_version_key,
+    GRAPH_VERSION_KEY
+)
+from flask import current_app, g
+import json
+
+FIELD_DEPENDENCIES = {
+    'Query.allUsers': 'users',
+    'Query.node': 'users',
+}
+"""The version keys depended on by resolving `Type.field`, in addition to
+the version of every user resolved, see `user_version_key`."""
+
+UNCACHEABLE_FIELDS = frozenset((
+    # Depends on the connections of the friends of the user
+    'User.suggestedFriends',
+))
+
+
+class ResponseCache(object):
+    """Flask extension caching the results of query operations per viewer,
+    by `(current_user_id, document id, operation name, variables)`, where
+    a cache hit skips execution entirely.
+
+    Results are validated by the versions they depend on, i.e. of the
+    viewer and of every user resolved (see `user_version_key`, bumped by
+    profile and connection writes) as well as the `FIELD_DEPENDENCIES`.
+    Invalidation is exact without TTLs, as long as the graph store and
+    connection cache serve data as fresh as the database: when running
+    several processes, use the 'uwsgi' connection cache backend and no
+    graph store with this cache.
+
+    Responses with errors, selecting `UNCACHEABLE_FIELDS` or executed by
+    the asyncio executor (which reads outside of the request snapshot) are
+    not cached.
+
+    Configuration:
+    - `GRAPHQL_RESPONSE_CACHE_SIZE`: maximum cached responses, 0 (the
+      default) disables
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('GRAPHQL_RESPONSE_CACHE_SIZE', 0)
+        size = app.config['GRAPHQL_RESPONSE_CACHE_SIZE']
+        app.extensions['graphql_responses'] = LRUCache(size) if size else None
+
+    @property
+    def cache(self):
+        return current_app.extensions['graphql_responses']
+
+    def key_of(self, document_id, operation_ast, variables):
+        """Returns the cache key of the operation of the current viewer, or
+        None when it is not cacheable."""
+        if self.cache is None or document_id is None or \
+                operation_ast is None or \
+                operation_ast.operation != 'query' or \
+                current_app.config.get('GRAPHQL_EXECUTOR') == 'asyncio':
+            return None
+        operation_name = operation_ast.name.value \
+            if operation_ast.name else None
+        return (
+            current_user_id(), document_id, operation_name,
+            json.dumps(variables or {}, sort_keys=True))
+
+    def get(self, key):
+        """Returns the cached `ExecutionResult` of the operation `key` when
+        its versions are current.
+
+        Otherwise returns None and prepares the current request to execute
+        the operation, i.e. tracks its dependencies (see
+        `DependencyMiddleware`), then `set` its result. Versions and data
+        are read from the same snapshot, which must be the first statements
+        of the request."""
+        if db.engine.dialect.name == 'postgresql':
+            db.session.connection(
+                execution_options=dict(isolation_level='REPEATABLE READ'))
+        found = self.cache.get_many([key])
+        if found:
+            versions, data = found[key]
+            if get_versions(versions) == versions:
+                _end_snapshot()
+                # Deferred, graphql is imported by the first request, see
+                # `app.graphql`
+                from graphql.execution import ExecutionResult
+                return ExecutionResult(data=data)
+            self.cache.delete_many([key])
+        g.response_dependencies = set(
+            [GRAPH_VERSION_KEY, user_version_key(current_user_id())])
+        return None
+
+    def set(self, key, result):
+        """Caches the `ExecutionResult` of the operation `key` executed
+        since `get`, unless it failed or is not cacheable."""
+        dependencies = g.pop('response_dependencies', None)
+        if result is not None and not result.errors and \
+                not result.invalid and dependencies is not None and \
+                None not in dependencies:
+            versions = get_versions(dependencies)
+            self.cache.set_many({key: (versions, result.data)})
+        _end_snapshot()
+
+    def stats(self):
+        cache = self.cache
+        return cache.stats() if cache is not None else {}
+
+
+def _end_snapshot():
+    # Queries do not write, the following statements of the request read
+    # the latest data
+    db.session.rollback()
+
+
+response_cache = ResponseCache()
+
+
+class DependencyMiddleware(object):
+    """GraphQL middleware tracking the versions the response depends on,
+    only used by requests missing the cache, see `ResponseCache.get`."""
+
+    def resolve(self, next, root, args, context, info):
+        dependencies = g.response_dependencies
+        field = '{}.{}'.format(info.parent_type.name, info.field_name)
+        if isinstance(root, UserModel):
+            dependencies.add(user_version_key(root.user_id))
+        if field in FIELD_DEPENDENCIES:
+            dependencies.add(FIELD_DEPENDENCIES[field])
+        elif field in UNCACHEABLE_FIELDS:
+            # Marks the response as not cacheable
+            dependencies.add(None)
+        return next(root, args, context, info)
@@ -0,0 +1,41 @@
+import graphene
+from graphene import relay
+from .pagination import KeysetPage
+from .users import (
+    User, UserConnectionMutation, current_user
+)
+from ..models import db, User as UserModel, USER_ORDER
+
+
+class Query(graphene.ObjectType):
+
+    node = relay.Node.Field()
+    me = graphene.Field(User)
+
+    all_users = relay.ConnectionField(lambda: User)
+
+    def resolve_me(*args):
+        return current_user()
+
+    def resolve_all_users(self, args, context, info):
+        # Paginates by name, with keyset cursors of `USER_ORDER`
+        page = KeysetPage.from_args(args)
+        q = page.query(db.session.query(UserModel, *USER_ORDER), USER_ORDER)
+        return page.connection(User.Connection, [
+            (row[1:], row[0]) for row in q.all()
+        ])
+
+
+class Mutation(graphene.ObjectType):
+
+    befriend = UserConnectionMutation.Field()
+    unfriend = UserConnectionMutation.Field()
+    follow = UserConnectionMutation.Field()
+    unfollow = UserConnectionMutation.Field()
+    block = UserConnectionMutation.Field()
+    unblock = UserConnectionMutation.Field()
+
+
+types = [User]
+
+schema = graphene.Schema(query=Query, mutation=Mutation, types=types)
@@ -1,16 +1,25 @@
 from ..logging import logger  # noqa
+from ..profiling import ProfiledDataLoader
 from ..utils import g_get
+from .pagination import KeysetPage
 from ..models import (
     db, current_user, common_friends_between, current_user_id,
-    User as UserModel, connections, ConnectionType
+    connections_both_ways, related_user_ids_of, suggested_friend_ids,
+    degrees_of, User as UserModel, ConnectionType
 )
+from flask import current_app, g
 from graphene import relay, types
 from graphene_sqlalchemy import SQLAlchemyObjectType
 from promise import Promise
-from promise.dataloader import DataLoader
 
 
-class UserLoader(DataLoader):
+def _loader_class(cls):
+    """Returns the variant of the DataLoader `cls` used by the executor of
+    the current request, see `GraphQLView.get_executor`."""
+    return getattr(g, 'loader_classes', {}).get(cls, cls)
+
+
+class UserLoader(ProfiledDataLoader):
     """Provides deferred batch loading of `User`, example:
 
     `DataLoader.loader().load(user_id)`
@@ -18,7 +27,8 @@ class UserLoader(DataLoader):
 
     @classmethod
     def loader(cls):
-        return g_get('user_loader', lambda: cls(cache=True))
+        return g_get(
+            'user_loader', lambda: _loader_class(cls)(cache=True))
 
     def batch_load_fn(self, keys):
         user_ids = set(keys)
@@ -29,7 +39,7 @@ class UserLoader(DataLoader):
         return Promise.resolve([users.get(user_id, None) for user_id in keys])
 
 
-class CurrentUserCommonFriendIdsLoader(DataLoader):
+class CurrentUserCommonFriendIdsLoader(ProfiledDataLoader):
     """Provides deferred batch loading of common friend's user_id, example:
 
     `CurrentUserCommonFriendIdsLoader.loader().load(user_id)`
@@ -41,7 +51,8 @@ class CurrentUserCommonFriendIdsLoader(DataLoader):
     @classmethod
     def loader(cls):
         return g_get(
-            'current_user_common_friend_ids_loader', lambda: cls(cache=True))
+            'current_user_common_friend_ids_loader',
+            lambda: _loader_class(cls)(cache=True))
 
     def batch_load_fn(self, keys):
         target_ids = set(keys)
@@ -57,35 +68,100 @@ class CurrentUserCommonFriendIdsLoader(DataLoader):
         ])
 
 
-class CurrentUserConnectionLoader(DataLoader):
+class CurrentUserConnectionLoader(ProfiledDataLoader):
     """Provides deferred batch loading of user connection value, example:
 
     `CurrentUserConnectionLoader.loader().load(user_id)`
 
-    Returns a `Promise` object that resolves to an array
-    of ConnectionType value between current_user and user_id.
+    Returns a `Promise` object that resolves to a `(mine, theirs)` tuple
+    of ConnectionType value, where `mine` is from current_user to user_id
+    and `theirs` from user_id to current_user. Both directions of every
+    key are fetched in a single query.
     """
 
     @classmethod
     def loader(cls):
         return g_get(
-            'current_user_connection_loader', lambda: cls(cache=True))
+            'current_user_connection_loader',
+            lambda: _loader_class(cls)(cache=True))
 
     def batch_load_fn(self, keys):
         target_ids = set(keys)
         logger.debug('Batch loading connections with {}'.format(target_ids))
-        q = db.session.query(
-                connections.c.target_id,
-                connections.c.connection,
-            ).\
-            filter(connections.c.source_id == current_user_id()).\
-            filter(connections.c.target_id.in_(target_ids))
-        connects = dict(q.all())
+        connects = connections_both_ways(current_user_id(), target_ids)
         return Promise.resolve([
-            connects.get(target_id, 0) for target_id in keys
+            connects.get(target_id, (0, 0)) for target_id in keys
         ])
 
 
+class UserDegreesLoader(ProfiledDataLoader):
+    """Provides deferred batch loading of the relationship counters of a
+    user, example:
+
+    `UserDegreesLoader.loader().load(user_id)`
+
+    Returns a `Promise` object that resolves to `{degree: count}`, e.g.
+    `{'friends': 2, ..}`, see `app.models.DEGREES`.
+    """
+
+    @classmethod
+    def loader(cls):
+        return g_get(
+            'user_degrees_loader', lambda: _loader_class(cls)(cache=True))
+
+    def batch_load_fn(self, keys):
+        logger.debug('Batch loading degrees of {}'.format(set(keys)))
+        degrees = degrees_of(keys)
+        return Promise.resolve([degrees[user_id] for user_id in keys])
+
+
+class RelatedUserIdsLoader(ProfiledDataLoader):
+    """Provides deferred batch loading of the user_ids related by
+    `relationship` (e.g. 'friends', see `RELATIONSHIPS`), example:
+
+    `RelatedUserIdsLoader.loader('friends').load((user_id, page))`
+
+    Returns a `Promise` object that resolves to the sorted user_ids related
+    to user_id within the `KeysetPage` page, plus one to tell whether there
+    are more pages. Users sharing the same page are fetched in one query.
+    """
+
+    def __init__(self, relationship, **kwargs):
+        super(RelatedUserIdsLoader, self).__init__(**kwargs)
+        self.relationship = relationship
+
+    @classmethod
+    def loader(cls, relationship):
+        return g_get(
+            'related_user_ids_loader_{}'.format(relationship),
+            lambda: _loader_class(cls)(relationship, cache=True))
+
+    @property
+    def profile_name(self):
+        return 'RelatedUserIdsLoader.{}'.format(self.relationship)
+
+    def batch_load_fn(self, keys):
+        logger.debug('Batch loading {} for {}'.format(
+            self.relationship, set(user_id for user_id, _ in keys)))
+        # {page: [user_id, ..]}
+        pages = {}
+        for user_id, page in keys:
+            pages.setdefault(page, []).append(user_id)
+        related = {}
+        for page, user_ids in pages.items():
+            found = related_user_ids_of(
+                user_ids, self.relationship,
+                after=page.after[0] if page.after else None,
+                before=page.before[0] if page.before else None,
+                limit=page.limit + 1,
+                descending=page.reverse)
+            related.update(
+                ((user_id, page), related_ids)
+                for user_id, related_ids in found.items()
+            )
+        return Promise.resolve([related[key] for key in keys])
+
+
 class User(SQLAlchemyObjectType):
 
     class Meta:
@@ -101,37 +177,85 @@ class User(SQLAlchemyObjectType):
             'job',
             'introduction',
             'avatar_url',
-            'friends',
-            'following',
-            'followers',
         )
         local_fields = {
+            'friends': relay.ConnectionField(lambda: User),
+            'following': relay.ConnectionField(lambda: User),
+            'followers': relay.ConnectionField(lambda: User),
             'full_name': types.Field(types.String),
+            'friend_count': types.Field(types.Int),
+            'following_count': types.Field(types.Int),
+            'follower_count': types.Field(types.Int),
+            'subscriber_count': types.Field(types.Int),
             'is_friend_of_me': types.Field(types.Boolean),
             'is_followed_by_me': types.Field(types.Boolean),
             'is_blocked_by_me': types.Field(types.Boolean),
             'is_subscribed_by_me': types.Field(types.Boolean),
+            'follows_me': types.Field(types.Boolean),
+            'is_mutual_friend': types.Field(types.Boolean),
+            'has_blocked_me': types.Field(types.Boolean),
             'common_friends_with_me': types.Field(types.List(lambda: User)),
+            'suggested_friends': types.Field(
+                types.List(lambda: User), first=types.Int()),
         }
 
     def resolve_full_name(self, args, context, info):
         return '{} {}'.format(self.first_name, self.last_name)
 
+    def resolve_friends(self, args, context, info):
+        return _related_users_connection(self, 'friends', args)
+
+    def resolve_following(self, args, context, info):
+        return _related_users_connection(self, 'following', args)
+
+    def resolve_followers(self, args, context, info):
+        return _related_users_connection(self, 'followers', args)
+
+    def resolve_friend_count(self, args, context, info):
+        return UserDegreesLoader.loader().load(self.user_id).\
+            then(lambda degrees: degrees['friends'])
+
+    def resolve_following_count(self, args, context, info):
+        return UserDegreesLoader.loader().load(self.user_id).\
+            then(lambda degrees: degrees['following'])
+
+    def resolve_follower_count(self, args, context, info):
+        return UserDegreesLoader.loader().load(self.user_id).\
+            then(lambda degrees: degrees['followers'])
+
+    def resolve_subscriber_count(self, args, context, info):
+        return UserDegreesLoader.loader().load(self.user_id).\
+            then(lambda degrees: degrees['subscribers'])
+
     def resolve_is_friend_of_me(self, args, context, info):
         return CurrentUserConnectionLoader.loader().load(self.user_id).\
-            then(ConnectionType.is_friend)
+            then(lambda c: ConnectionType.is_friend(c[0]))
 
     def resolve_is_followed_by_me(self, args, context, info):
         return CurrentUserConnectionLoader.loader().load(self.user_id).\
-            then(ConnectionType.is_follow)
+            then(lambda c: ConnectionType.is_follow(c[0]))
 
     def resolve_is_blocked_by_me(self, args, context, info):
         return CurrentUserConnectionLoader.loader().load(self.user_id).\
-            then(ConnectionType.is_block)
+            then(lambda c: ConnectionType.is_block(c[0]))
 
     def resolve_is_subscribed_by_me(self, args, context, info):
         return CurrentUserConnectionLoader.loader().load(self.user_id).\
-            then(ConnectionType.is_subscribed)
+            then(lambda c: ConnectionType.is_subscribed(c[0]))
+
+    def resolve_follows_me(self, args, context, info):
+        return CurrentUserConnectionLoader.loader().load(self.user_id).\
+            then(lambda c: ConnectionType.is_follow(c[1]))
+
+    def resolve_is_mutual_friend(self, args, context, info):
+        return CurrentUserConnectionLoader.loader().load(self.user_id).\
+            then(lambda c: (
+                ConnectionType.is_friend(c[0]) and
+                ConnectionType.is_friend(c[1])))
+
+    def resolve_has_blocked_me(self, args, context, info):
+        return CurrentUserConnectionLoader.loader().load(self.user_id).\
+            then(lambda c: ConnectionType.is_block(c[1]))
 
     def resolve_common_friends_with_me(self, args, context, info):
         if self.user_id == current_user_id():
@@ -141,6 +265,28 @@ class User(SQLAlchemyObjectType):
             then(lambda friend_ids: Promise.resolve(
                 [user_loader.load(friend_id) for friend_id in friend_ids]))
 
+    def resolve_suggested_friends(self, args, context, info):
+        top_k = current_app.config['SUGGESTIONS_TOP_K']
+        limit = min(args.get('first') or top_k, top_k)
+        user_loader = UserLoader.loader()
+        return [
+            user_loader.load(user_id)
+            for user_id in suggested_friend_ids(self, limit)
+        ]
+
+
+def _related_users_connection(user, relationship, args):
+    """Returns a `Promise` of a keyset paginated `User.Connection` of the
+    users related to `user` by `relationship`, where the cursors are the
+    user_id. Both the user_ids and users are batch loaded."""
+    page = KeysetPage.from_args(args)
+    user_loader = UserLoader.loader()
+    return RelatedUserIdsLoader.loader(relationship).\
+        load((user.user_id, page)).\
+        then(lambda user_ids: page.connection(User.Connection, [
+            ((user_id, ), user_loader.load(user_id)) for user_id in user_ids
+        ]))
+
 
 ALLOWED_CONNECTION_MUTATIONS = (
     'block', 'unblock', 'follow', 'unfollow', 'befriend', 'unfriend'
@@ -175,9 +321,7 @@ class UserConnectionMutation(relay.ClientIDMutation):
                     [friend_ids for _, friend_ids in common], [])
             else:
                 related_user_ids = []
-            mutate = getattr(me, mutation)
-            for user_id in user_ids:
-                mutate(user_id)
+            me.apply_connections(mutation, user_ids)
             db.session.commit()
             user_loader = UserLoader.loader()
             return cls(
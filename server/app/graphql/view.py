@@ -0,0 +1,108 @@
+from .documents import document_cache, document_id_of
+from .responses import response_cache, DependencyMiddleware
+from ..models import replica_reads
+from ..profiling import current_profile, ProfilingMiddleware
+from flask import current_app, g, request
+from flask_graphql import GraphQLView as BaseGraphQLView
+from flask_graphql.graphqlview import HttpError
+from graphql.execution import ExecutionResult
+from graphql.utils.get_operation_ast import get_operation_ast
+from werkzeug.exceptions import MethodNotAllowed
+
+
+class GraphQLView(BaseGraphQLView):
+    """The `/graphql` endpoint.
+
+    - Documents are parsed and validated once, see `DocumentCache`
+    - Persisted queries are sent as `{"id": .., "variables": ..}`
+    - Results of queries are cached per viewer when enabled, see
+      `ResponseCache`
+    - Queries read from the replica when configured, see `RoutingSession`
+    - Executes with asyncio when `GRAPHQL_EXECUTOR` is 'asyncio', see
+      `app.graphql.aio`
+    - Adds the `RequestProfile` report to the `extensions` of responses
+      when profiling is enabled
+    """
+
+    profiling_middleware = ProfilingMiddleware()
+
+    dependency_middleware = DependencyMiddleware()
+
+    def get_executor(self, request):
+        if current_app.config.get('GRAPHQL_EXECUTOR') == 'asyncio':
+            # Deferred, asyncio and aiopg are only required by this mode
+            from .aio import LoopExecutor, ASYNC_LOADERS
+            g.loader_classes = ASYNC_LOADERS
+            return LoopExecutor()
+        return super(GraphQLView, self).get_executor(request)
+
+    def get_middleware(self, request):
+        middleware = super(GraphQLView, self).get_middleware(request)
+        if current_profile() is not None:
+            middleware = list(middleware or []) + [self.profiling_middleware]
+        if 'response_dependencies' in g:
+            middleware = list(middleware or []) + [
+                self.dependency_middleware]
+        return middleware
+
+    def json_encode(self, request, d, show_graphiql=False):
+        profile = current_profile()
+        if profile is not None and not self.batch:
+            d = dict(d, extensions=dict(profile=profile.report()))
+        return super(GraphQLView, self).json_encode(request, d, show_graphiql)
+
+    def execute_graphql_request(self, data, query, variables, operation_name,
+                                show_graphiql=False):
+        document_id = request.args.get('id') or data.get('id')
+        if not query and not document_id:
+            return super(GraphQLView, self).execute_graphql_request(
+                data, query, variables, operation_name, show_graphiql)
+        ast, errors = document_cache.get(
+            self.schema, query=query or None, document_id=document_id)
+        if errors:
+            return ExecutionResult(errors=errors, invalid=True)
+
+        operation_ast = get_operation_ast(ast, operation_name)
+        if request.method.lower() == 'get':
+            if operation_ast and operation_ast.operation != 'query':
+                if show_graphiql:
+                    return None
+                raise HttpError(MethodNotAllowed(
+                    ['POST'],
+                    'Can only perform a {} operation from a POST request.'.
+                    format(operation_ast.operation)
+                ))
+
+        if operation_ast is not None and operation_ast.operation == 'query':
+            # Queries do not write, see `RoutingSession`
+            with replica_reads():
+                return self.execute_operation(
+                    ast, operation_ast, variables, operation_name,
+                    document_id_of(query) if query else document_id)
+        return self.execute_operation(
+            ast, operation_ast, variables, operation_name)
+
+    def execute_operation(self, ast, operation_ast, variables,
+                          operation_name, document_id=None):
+        cache_key = response_cache.key_of(
+            document_id, operation_ast, variables)
+        if cache_key is not None:
+            result = response_cache.get(cache_key)
+            if result is not None:
+                return result
+
+        try:
+            result = self.execute(
+                ast,
+                root_value=self.get_root_value(request),
+                variable_values=variables or {},
+                operation_name=operation_name,
+                context_value=self.get_context(request),
+                middleware=self.get_middleware(request),
+                executor=self.get_executor(request)
+            )
+        except Exception as e:
+            return ExecutionResult(errors=[e], invalid=True)
+        if cache_key is not None:
+            response_cache.set(cache_key, result)
+        return result
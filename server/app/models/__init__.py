@@ -1,6 +1,25 @@
 # flake8: noqa
-from .core import db
+from .core import db, replica_reads, reads_from_replica, upgrade_schema
+from .storage import storage, ConnectionStorage
 from .users import (
     User, connections, current_user, current_user_id, common_friends_between,
-    ConnectionType
+    connections_between, connections_both_ways, related_user_ids,
+    related_user_ids_of, iter_related_user_ids,
+    iter_subscriber_ids, on_connection_changed, on_connection_commit,
+    ConnectionChange, ConnectionType, USER_ORDER, user_version_key,
+    connection_flags, RELATIONSHIP_INDEXES, DROPPED_INDEXES
+)
+from .versions import (
+    get_version, get_versions, get_graph_version, bump_versions, versioned,
+    GRAPH_VERSION_KEY
+)
+from .suggestions import (
+    suggested_friend_ids, refresh_friend_suggestions,
+    refresh_all_friend_suggestions
+)
+from .degrees import degrees_of, reconcile_degrees, DEGREES
+from .changefeed import (
+    connection_events_after, iter_connection_events, get_checkpoint,
+    save_checkpoint, consume_connection_events, prune_connection_events,
+    ConnectionEvent
 )
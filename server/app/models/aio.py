@@ -0,0 +1,188 @@
+"""Asyncio variants of the reads batched by the GraphQL DataLoaders, used
+when `GRAPHQL_EXECUTOR` is 'asyncio'.
+
+Statements are executed with aiopg on an event loop of the current thread,
+so that independent batches wait on the database concurrently. Reads fall
+back to their sync variant when they do not need the database (graph
+store), must see the uncommitted writes of the session or the storage is
+not postgres (see `app.models.storage`).
+
+Requires `asyncio` (a backport on python 3.3) and `aiopg`.
+"""
+from .core import db, reads_from_replica, REPLICA_BIND_KEY
+from .degrees import (
+    degrees_select, DEGREES, degrees_of as sync_degrees_of
+)
+from .storage import storage
+from .storage.sql import (
+    PostgresStorage, connections_select, common_friends_select,
+    friend_edges_select, related_user_ids_of_select
+)
+from .users import (
+    User, ConnectionType, CONNECTION_CHANGES_KEY, _graph,
+    common_friends_between as sync_common_friends_between,
+    connections_both_ways as sync_connections_both_ways,
+    related_user_ids_of as sync_related_user_ids_of
+)
+from ..cache import connection_cache
+from ..graph import group_sorted_edges, intersect_many
+from flask import current_app
+import asyncio
+import threading
+
+# `asyncio.async` was renamed `ensure_future` in python 3.4.4
+ensure_future = getattr(asyncio, 'ensure_future', None) or \
+    getattr(asyncio, 'async')
+
+_local = threading.local()
+
+
+def event_loop():
+    """Returns the event loop of the current thread."""
+    loop = getattr(_local, 'loop', None)
+    if loop is None:
+        loop = _local.loop = asyncio.new_event_loop()
+        _local.pending = set()
+        _local.engines = {}
+    return loop
+
+
+def spawn(coro):
+    """Schedules `coro` on the `event_loop`, returns its future which is
+    part of the `pending` futures until done."""
+    future = ensure_future(coro, loop=event_loop())
+    _local.pending.add(future)
+    future.add_done_callback(_local.pending.discard)
+    return future
+
+
+def pending():
+    """Returns the futures of `spawn` that are not done yet."""
+    event_loop()
+    return list(_local.pending)
+
+
+@asyncio.coroutine
+def get_engine():
+    """Returns the aiopg engine of the current thread, connected to the
+    `SQLALCHEMY_DATABASE_URI` (or the replica when the session reads from
+    it) with up to `ASYNC_DB_POOL_SIZE` connections."""
+    import aiopg.sa
+    loop = event_loop()
+    if reads_from_replica():
+        dsn = current_app.config['SQLALCHEMY_BINDS'][REPLICA_BIND_KEY]
+    else:
+        dsn = current_app.config['SQLALCHEMY_DATABASE_URI']
+    if dsn not in _local.engines:
+        _local.engines[dsn] = yield from aiopg.sa.create_engine(
+            dsn=dsn, minsize=1,
+            maxsize=current_app.config.get('ASYNC_DB_POOL_SIZE', 10),
+            loop=loop)
+    return _local.engines[dsn]
+
+
+@asyncio.coroutine
+def fetchall(stmt):
+    """Returns the rows of the SqlAlchemy `stmt`."""
+    engine = yield from get_engine()
+    with (yield from engine) as connection:
+        result = yield from connection.execute(stmt)
+        rows = yield from result.fetchall()
+    return rows
+
+
+def _needs_sync():
+    # Uncommitted changes are only visible to the session, and only the
+    # postgres storage can be read with aiopg
+    return _graph() is not None or \
+        bool(db.session.info.get(CONNECTION_CHANGES_KEY)) or \
+        not isinstance(storage.backend(), PostgresStorage)
+
+
+@asyncio.coroutine
+def users_by_id(user_ids):
+    """Returns `{user_id: User}` of the existing `user_ids`, where the
+    instances are not attached to the session."""
+    users = User.__table__
+    rows = yield from fetchall(
+        users.select().where(users.c.user_id.in_(set(user_ids))))
+    return dict(
+        (row['user_id'], User(**dict(row))) for row in rows)
+
+
+@asyncio.coroutine
+def degrees_of(user_ids):
+    """See `app.models.degrees_of`."""
+    if db.engine.dialect.name != 'postgresql':
+        return sync_degrees_of(user_ids)
+    found = dict(
+        (user_id, dict.fromkeys(DEGREES, 0)) for user_id in set(user_ids))
+    rows = yield from fetchall(degrees_select(user_ids))
+    for row in rows:
+        found[row[0]] = dict(zip(DEGREES, row[1:]))
+    return found
+
+
+@asyncio.coroutine
+def connections_both_ways(user_id, other_ids):
+    """See `app.models.connections_both_ways`."""
+    if _needs_sync():
+        return sync_connections_both_ways(user_id, other_ids)
+    other_ids = set(other_ids)
+    pairs = set((user_id, other_id) for other_id in other_ids)
+    pairs.update((other_id, user_id) for other_id in other_ids)
+    found = connection_cache.get_many(pairs)
+    missing = pairs.difference(found)
+    if missing:
+        rows = yield from fetchall(connections_select(user_id, missing))
+        fetched = dict.fromkeys(missing, ConnectionType.NONE.value)
+        fetched.update(
+            ((source_id, target_id), connection)
+            for source_id, target_id, connection in rows
+        )
+        connection_cache.set_many(fetched)
+        found.update(fetched)
+    return dict(
+        (other_id, (found[(user_id, other_id)], found[(other_id, user_id)]))
+        for other_id in other_ids
+    )
+
+
+@asyncio.coroutine
+def common_friends_between(source_id, target_ids, engine=None):
+    """See `app.models.common_friends_between`."""
+    if engine is None:
+        engine = current_app.config.get('COMMON_FRIENDS_ENGINE', 'sql')
+    if not target_ids or _needs_sync():
+        return sync_common_friends_between(source_id, target_ids, engine)
+    if engine == 'vector':
+        rows = yield from fetchall(
+            friend_edges_select([source_id] + target_ids))
+        friends = group_sorted_edges(rows)
+        common = intersect_many(friends.get(source_id, []), [
+            friends.get(target_id, []) for target_id in target_ids
+        ])
+        return list(zip(target_ids, common))
+    rows = yield from fetchall(common_friends_select(source_id, target_ids))
+    common = dict((target_id, friend_ids) for target_id, friend_ids in rows)
+    return [
+        (target_id, common.get(target_id, []))
+        for target_id in target_ids
+    ]
+
+
+@asyncio.coroutine
+def related_user_ids_of(user_ids, relationship, after=None, before=None,
+                        limit=None, descending=False):
+    """See `app.models.related_user_ids_of`."""
+    if _needs_sync():
+        return sync_related_user_ids_of(
+            user_ids, relationship, after=after, before=before, limit=limit,
+            descending=descending)
+    user_ids = set(user_ids)
+    rows = yield from fetchall(related_user_ids_of_select(
+        user_ids, relationship, after, before, limit, descending))
+    related = dict((user_id, []) for user_id in user_ids)
+    for user_id, related_id in rows:
+        related[user_id].append(related_id)
+    return related
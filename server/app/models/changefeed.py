@@ -0,0 +1,175 @@
+"""The changefeed of the connections, i.e. an outbox of every
+`ConnectionChange` appended in the transaction writing it, which downstream
+consumers (feeds, search, caches) stream from a checkpoint to maintain
+their state incrementally, e.g.
+
+```
+def index(events):
+    for event in events:
+        search.update(event.source_id, event.target_id, event.new)
+
+consume_connection_events('search', index)
+```
+
+Events are numbered by `seq` and tagged with the `txid` of the transaction
+writing them. Consumers read the events after the `(txid, seq)` position
+of their checkpoint, in `(txid, seq)` order, and save it once handled, i.e.
+events are delivered at least once. Only the events of the transactions
+older than any still in progress (below `txid_snapshot_xmin` on postgres)
+are read, i.e. events never appear before a position already read, while
+writers are never serialized. SQLite serializes writes, `txid` is always 0.
+
+Bulk loads (see `app.samples`) bypass the changefeed and bump
+`GRAPH_VERSION_KEY` instead, consumers should then rebuild their state.
+"""
+from .core import db, metadata, insert_ignore
+from .users import on_connection_commit
+from sqlalchemy import (
+    Column, BigInteger, DateTime, Index, Integer, String, Table, and_, func,
+    or_, select
+)
+from sqlalchemy.dialects.postgresql import insert
+from collections import namedtuple
+
+connection_events = Table(
+    'connection_events', metadata,
+    # BIGINT primary keys only autoincrement as INTEGER on sqlite
+    Column(
+        'seq', BigInteger().with_variant(Integer, 'sqlite'),
+        primary_key=True),
+    Column('source_id', Integer, nullable=False),
+    Column('target_id', Integer, nullable=False),
+    Column('old_flags', Integer, nullable=False),
+    Column('new_flags', Integer, nullable=False),
+    Column('ts', DateTime, nullable=False, server_default=func.now()),
+    Column('txid', BigInteger, nullable=False, server_default='0'),
+    Index('ix_connection_events_txid_seq', 'txid', 'seq'),
+    # Never reuses the `seq` of pruned events, i.e. of checkpoints
+    sqlite_autoincrement=True,
+)
+"""The outbox of the connection changes. Not keyed to the users, events
+outlive the users they refer to."""
+
+changefeed_checkpoints = Table(
+    'changefeed_checkpoints', metadata,
+    Column('consumer', String, primary_key=True),
+    Column('seq', BigInteger, nullable=False),
+    Column('txid', BigInteger, nullable=False, server_default='0'),
+)
+"""The `(txid, seq)` position of the last event handled by each
+consumer."""
+
+ConnectionEvent = namedtuple(
+    'ConnectionEvent',
+    ('seq', 'source_id', 'target_id', 'old', 'new', 'ts', 'txid'))
+"""A committed `ConnectionChange` of the changefeed, at the position
+`(txid, seq)`."""
+
+
+def connection_events_after(after=(0, 0), limit=1000):
+    """Returns the first `limit` `ConnectionEvent` after the `(txid, seq)`
+    position `after`, of the transactions older than any in progress."""
+    e = connection_events.c
+    txid, seq = after
+    stmt = select([
+        e.seq, e.source_id, e.target_id, e.old_flags, e.new_flags, e.ts,
+        e.txid
+    ]).where(_after(e, txid, seq))
+    if db.engine.dialect.name == 'postgresql':
+        stmt = stmt.where(e.txid < func.txid_snapshot_xmin(
+            func.txid_current_snapshot()))
+    rows = db.session.execute(
+        stmt.order_by(e.txid, e.seq).limit(limit)).fetchall()
+    return [ConnectionEvent(*row) for row in rows]
+
+
+def iter_connection_events(after=(0, 0), batch_size=1000):
+    """Yields the `ConnectionEvent` after the `(txid, seq)` position `after`
+    in batches of up to `batch_size`, until caught up with the committed
+    events."""
+    while True:
+        events = connection_events_after(after, limit=batch_size)
+        if not events:
+            return
+        yield events
+        if len(events) < batch_size:
+            return
+        after = (events[-1].txid, events[-1].seq)
+
+
+def get_checkpoint(consumer):
+    """Returns the `(txid, seq)` position of the last event handled by
+    `consumer`, `(0, 0)` when it never saved one."""
+    c = changefeed_checkpoints.c
+    row = db.session.execute(
+        select([c.txid, c.seq]).where(c.consumer == consumer)).first()
+    return tuple(row) if row is not None else (0, 0)
+
+
+def save_checkpoint(consumer, position):
+    """Saves the `(txid, seq)` `position` of the last event handled by
+    `consumer`. Must be committed by the caller."""
+    c = changefeed_checkpoints.c
+    txid, seq = position
+    if db.engine.dialect.name == 'postgresql':
+        stmt = insert(changefeed_checkpoints).\
+            values(consumer=consumer, txid=txid, seq=seq)
+        db.session.execute(stmt.on_conflict_do_update(
+            index_elements=('consumer', ),
+            set_=dict(txid=stmt.excluded.txid, seq=stmt.excluded.seq)))
+        return
+    db.session.execute(insert_ignore(changefeed_checkpoints).values(
+        consumer=consumer, txid=txid, seq=seq))
+    db.session.execute(
+        changefeed_checkpoints.update().
+        where(c.consumer == consumer).
+        values(txid=txid, seq=seq))
+
+
+def consume_connection_events(consumer, handler, batch_size=1000):
+    """Calls `handler(events)` with the `ConnectionEvent` after the
+    checkpoint of `consumer` in batches of up to `batch_size`, committing
+    the checkpoint after each batch, returns the number of events handled.
+
+    Events of a batch whose `handler` raises are handled again by the next
+    call."""
+    n_events = 0
+    for events in iter_connection_events(
+            get_checkpoint(consumer), batch_size=batch_size):
+        handler(events)
+        save_checkpoint(consumer, (events[-1].txid, events[-1].seq))
+        db.session.commit()
+        n_events += len(events)
+    return n_events
+
+
+def prune_connection_events():
+    """Deletes the events handled by every consumer, returns the number of
+    events deleted. Must be committed by the caller."""
+    c = changefeed_checkpoints.c
+    row = db.session.execute(
+        select([c.txid, c.seq]).order_by(c.txid, c.seq).limit(1)).first()
+    if row is None:
+        return 0
+    txid, seq = row
+    return db.session.execute(
+        connection_events.delete().
+        where(~_after(connection_events.c, txid, seq))).rowcount
+
+
+def _after(e, txid, seq):
+    # `(e.txid, e.seq) > (txid, seq)`, without row values
+    return or_(e.txid > txid, and_(e.txid == txid, e.seq > seq))
+
+
+@on_connection_commit
+def _append_connection_events(changes):
+    stmt = connection_events.insert()
+    if db.engine.dialect.name == 'postgresql':
+        stmt = stmt.values(txid=func.txid_current())
+    db.session.execute(stmt, [
+        dict(
+            source_id=change.source_id, target_id=change.target_id,
+            old_flags=change.old, new_flags=change.new)
+        for change in changes
+    ])
@@ -1,6 +1,46 @@
-from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy import (
+    SQLAlchemy as BaseSQLAlchemy, SignallingSession, get_state
+)
+from sqlalchemy import inspect, orm, text
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.sql.expression import Select
+from contextlib import contextmanager
 from datetime import datetime
 
+REPLICA_BIND_KEY = 'replica'
+"""The key of the read replica in `SQLALCHEMY_BINDS`, see `replica_reads`."""
+
+REPLICA_READS_KEY = 'replica_reads'
+
+WROTE_KEY = 'wrote'
+
+
+class RoutingSession(SignallingSession):
+    """Session sending reads to the replica within `replica_reads`, when
+    the `REPLICA_BIND_KEY` is configured.
+
+    Only SELECT statements are routed, everything else (flushes, inserts,
+    updates, raw SQL..) goes to the primary. Once the session has written,
+    it reads from the primary too, i.e. reads of the request always see
+    its own writes.
+    """
+
+    def get_bind(self, mapper=None, clause=None):
+        if self._flushing or not (
+                clause is None or isinstance(clause, Select)):
+            self.info[WROTE_KEY] = True
+        elif reads_from_replica(self):
+            return get_state(self.app).db.get_engine(
+                self.app, bind=REPLICA_BIND_KEY)
+        return super(RoutingSession, self).get_bind(mapper, clause)
+
+
+class SQLAlchemy(BaseSQLAlchemy):
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
 db = SQLAlchemy()
 
 Model = db.Model
@@ -10,3 +50,61 @@ metadata = db.metadata
 relationship = db.relationship
 
 now = datetime.utcnow
+
+
+@contextmanager
+def replica_reads(session=None):
+    """Sends the reads of `session` (defaults to `db.session`) to the read
+    replica within, see `RoutingSession`."""
+    session = session or db.session()
+    previous = session.info.get(REPLICA_READS_KEY, False)
+    session.info[REPLICA_READS_KEY] = True
+    try:
+        yield session
+    finally:
+        session.info[REPLICA_READS_KEY] = previous
+
+
+def reads_from_replica(session=None):
+    """Returns True when the reads of `session` (defaults to `db.session`)
+    are sent to the read replica."""
+    session = session or db.session()
+    return bool(
+        session.info.get(REPLICA_READS_KEY) and
+        not session.info.get(WROTE_KEY) and
+        REPLICA_BIND_KEY in (session.app.config['SQLALCHEMY_BINDS'] or ()))
+
+
+def insert_ignore(table):
+    """Returns an insert into `table` skipping the rows which conflict with
+    existing ones, in the SQL dialect of the database."""
+    if db.engine.dialect.name == 'postgresql':
+        return postgresql.insert(table).on_conflict_do_nothing()
+    return table.insert().prefix_with('OR IGNORE')
+
+
+def upgrade_schema(dropped_indexes=()):
+    """Brings the database of a previous schema up to date without losing
+    data: creates the missing tables and indexes of `metadata` and drops the
+    `dropped_indexes` still present. Returns the `(created, dropped)` index
+    names.
+
+    Indexes are built in the transaction, i.e. writes to their table wait
+    until the upgrade is committed."""
+    created, dropped = [], []
+    with db.engine.begin() as connection:
+        metadata.create_all(connection)
+        inspector = inspect(connection)
+        for table in metadata.sorted_tables:
+            existing = set(
+                index['name']
+                for index in inspector.get_indexes(table.name))
+            for name in dropped_indexes:
+                if name in existing:
+                    connection.execute(text('DROP INDEX {}'.format(name)))
+                    dropped.append(name)
+            for index in table.indexes:
+                if index.name not in existing:
+                    index.create(connection)
+                    created.append(index.name)
+    return created, dropped
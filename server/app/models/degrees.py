@@ -0,0 +1,150 @@
+from .core import db, metadata, insert_ignore
+from .users import (
+    User, connections, connection_flags, on_connection_commit, RELATIONSHIPS
+)
+from sqlalchemy import (
+    Column, Integer, Table, ForeignKey, or_, select, func, case, bindparam
+)
+from sqlalchemy.dialects.postgresql import insert
+
+DEGREES = ('friends', 'following', 'followers', 'subscribers')
+"""The relationships counted per user by `user_degrees`, see
+`RELATIONSHIPS`."""
+
+user_degrees = Table(
+    'user_degrees', metadata,
+    Column(
+        'user_id', Integer, ForeignKey('users.user_id', ondelete='CASCADE'),
+        primary_key=True),
+    *[Column(degree, Integer, nullable=False, default=0)
+      for degree in DEGREES]
+)
+"""The number of related users of each `DEGREES` relationship per user,
+maintained by the transactions writing connections. Users without a row
+have no related users. Bulk loads and concurrent writes of stale flags can
+leave them off, see `reconcile_degrees`."""
+
+
+def degrees_of(user_ids):
+    """Returns `{user_id: {degree: count}}` of `user_ids`, see `DEGREES`."""
+    user_ids = set(user_ids)
+    found = dict(
+        (user_id, dict.fromkeys(DEGREES, 0)) for user_id in user_ids)
+    if user_ids:
+        for row in db.session.execute(degrees_select(user_ids)).fetchall():
+            found[row[0]] = dict(zip(DEGREES, row[1:]))
+    return found
+
+
+def degrees_select(user_ids):
+    """Returns the select of the `(user_id, ) + DEGREES` of `user_ids`."""
+    d = user_degrees.c
+    return select([d.user_id] + [d[degree] for degree in DEGREES]).\
+        where(d.user_id.in_(set(user_ids)))
+
+
+def reconcile_degrees(batch_size=1000):
+    """Recounts the `user_degrees` from the connections, and corrects the
+    users whose counters are off, returns the number of users corrected.
+
+    Must be committed by the caller."""
+    rows = db.session.execute(_mismatched_degrees_select()).fetchall()
+    for i in range(0, len(rows), batch_size):
+        _write_degrees(dict(
+            (row[0], dict(zip(DEGREES, row[1:])))
+            for row in rows[i:i + batch_size]
+        ), increment=False)
+    return len(rows)
+
+
+@on_connection_commit
+def _count_degrees(changes):
+    # {user_id: {degree: delta}}
+    deltas = {}
+    for change in changes:
+        for degree in DEGREES:
+            outgoing, mask, exclude = RELATIONSHIPS[degree]
+            delta = _counted(change.new, mask, exclude) - \
+                _counted(change.old, mask, exclude)
+            if delta:
+                user_id = change.source_id if outgoing else change.target_id
+                counts = deltas.setdefault(user_id, dict.fromkeys(DEGREES, 0))
+                counts[degree] += delta
+    _write_degrees(deltas, increment=True)
+
+
+def _counted(connection, mask, exclude):
+    return 1 if connection & mask and not connection & exclude else 0
+
+
+def _write_degrees(degrees, increment):
+    """Adds (or sets unless `increment`) the `{user_id: {degree: count}}`
+    of `degrees`."""
+    if not degrees:
+        return
+    # Sorted, so that concurrent transactions lock the rows in order
+    rows = [
+        dict(user_id=user_id, **degrees[user_id])
+        for user_id in sorted(degrees)
+    ]
+    d = user_degrees.c
+    if db.engine.dialect.name == 'postgresql':
+        stmt = insert(user_degrees).values(rows)
+        db.session.execute(stmt.on_conflict_do_update(
+            index_elements=('user_id', ),
+            set_=dict(
+                (degree, d[degree] + stmt.excluded[degree] if increment
+                 else stmt.excluded[degree])
+                for degree in DEGREES
+            )))
+        return
+    db.session.execute(insert_ignore(user_degrees).values([
+        dict(user_id=row['user_id'], **dict.fromkeys(DEGREES, 0))
+        for row in rows
+    ]))
+    db.session.execute(
+        user_degrees.update().
+        where(d.user_id == bindparam('_user_id')).
+        values(dict(
+            (degree, d[degree] + bindparam('_' + degree) if increment
+             else bindparam('_' + degree))
+            for degree in DEGREES
+        )),
+        [
+            dict(('_' + key, value) for key, value in row.items())
+            for row in rows
+        ])
+
+
+def _mismatched_degrees_select():
+    """Returns the select of the recounted `(user_id, ) + DEGREES` of the
+    users whose `user_degrees` are off."""
+    c = connections.c
+    counted = []  # [(alias, degrees), ..] outgoing then incoming
+    for outgoing in (True, False):
+        user_id = c.source_id if outgoing else c.target_id
+        degrees = [
+            degree for degree in DEGREES
+            if RELATIONSHIPS[degree][0] is outgoing
+        ]
+        counted.append((select([user_id.label('user_id')] + [
+            func.sum(case(
+                [(connection_flags(*RELATIONSHIPS[degree][1:]), 1)],
+                else_=0)).label(degree)
+            for degree in degrees
+        ]).group_by(user_id).alias(
+            'outgoing' if outgoing else 'incoming'), degrees))
+    u, d = User.__table__, user_degrees
+    joined = u.outerjoin(d, d.c.user_id == u.c.user_id)
+    expected = {}
+    for alias, degrees in counted:
+        joined = joined.outerjoin(alias, alias.c.user_id == u.c.user_id)
+        expected.update(
+            (degree, func.coalesce(alias.c[degree], 0)) for degree in degrees)
+    return select([u.c.user_id] + [expected[degree] for degree in DEGREES]).\
+        select_from(joined).\
+        where(or_(*[
+            func.coalesce(d.c[degree], 0) != expected[degree]
+            for degree in DEGREES
+        ])).\
+        order_by(u.c.user_id)
@@ -0,0 +1,124 @@
+"""Storage backends of the connections, see `ConnectionStorage`.
+
+- 'postgresql': the `connections` table, using postgres upserts and
+  aggregates, see `app.models.storage.sql.PostgresStorage`
+- 'sqlite': the `connections` table of an embedded SQLite database, see
+  `app.models.storage.sql.SQLiteStorage`
+- 'memory': process memory, see `app.models.storage.memory.MemoryStorage`
+
+Users are always stored by SqlAlchemy, e.g. in an SQLite database when
+running without postgres. The `User` relationships (e.g. `user.friends`)
+and friend suggestions query the `connections` table, i.e. are empty with
+the 'memory' storage.
+"""
+from flask import current_app
+
+
+class ConnectionStorage(object):
+    """Interface of the connection reads and writes of `app.models.users`,
+    which adds the graph store, connection cache and change tracking on
+    top of it.
+
+    Flags are the bitwise `ConnectionType` values, where missing
+    connections are `ConnectionType.NONE`. Reads see the writes of the
+    current session, including uncommitted ones.
+    """
+
+    name = None
+
+    def user_connections(self, user_id, other_ids, incoming=True):
+        """Returns `{other_id: (outgoing, incoming)}` of the connection flags
+        from `user_id` to each of the `other_ids` which exist as users, and
+        from each of them to `user_id` (always `ConnectionType.NONE` unless
+        `incoming`)."""
+        raise NotImplementedError()
+
+    def connections(self, user_id, pairs):
+        """Returns the `(source_id, target_id, connection)` of the existing
+        `(source_id, target_id)` pairs, which are all from or to
+        `user_id`."""
+        raise NotImplementedError()
+
+    def set_connection(self, source_id, target_id, connection):
+        """Writes the `connection` flags of `source_id` -> `target_id`."""
+        raise NotImplementedError()
+
+    def update_flag(self, source_id, current, flag, adding):
+        """Adds (or removes when `adding` is False) the `flag` to the
+        connections of `source_id` to the `current` flags of
+        `{target_id: flags}`, returns `{target_id: new_flags}`."""
+        raise NotImplementedError()
+
+    def related_user_ids(self, user_id, relationship, after=None,
+                         before=None, limit=None, descending=False):
+        """See `app.models.related_user_ids`."""
+        raise NotImplementedError()
+
+    def iter_related_user_ids(self, user_id, relationship, batch_size):
+        """See `app.models.iter_related_user_ids`."""
+        raise NotImplementedError()
+
+    def related_user_ids_of(self, user_ids, relationship, after=None,
+                            before=None, limit=None, descending=False):
+        """See `app.models.related_user_ids_of`."""
+        raise NotImplementedError()
+
+    def common_friends(self, source_id, target_ids):
+        """Returns `{target_id: [common_friend_id, ..]}` of the `target_ids`
+        having common friends with `source_id`."""
+        raise NotImplementedError()
+
+    def friend_edges(self, user_ids):
+        """Returns the `(user_id, friend_id)` of `user_ids`, sorted."""
+        raise NotImplementedError()
+
+    def edges(self, batch_size=10000, mask=None):
+        """Yields every committed `(source_id, target_id, connection)` with
+        flags (any of the `mask` flags when given), sorted by `(source_id,
+        target_id)`, e.g. to load the graph store. Unlike other reads, the
+        writes of the current session are not included."""
+        raise NotImplementedError()
+
+    def apply(self, changes):
+        """Called with the `ConnectionChange` once committed."""
+
+
+def create_storage(name):
+    """Returns a new `ConnectionStorage` of the backend `name`."""
+    # Deferred, backends import the models
+    if name in ('postgresql', 'postgres'):
+        from .sql import PostgresStorage
+        return PostgresStorage()
+    if name == 'sqlite':
+        from .sql import SQLiteStorage
+        return SQLiteStorage()
+    if name == 'memory':
+        from .memory import MemoryStorage
+        return MemoryStorage()
+    raise ValueError('Unsupported storage backend: {}'.format(name))
+
+
+class Storage(object):
+    """Flask extension providing the `ConnectionStorage` of the app.
+
+    Configuration:
+    - `STORAGE_BACKEND`: 'postgresql', 'sqlite' or 'memory', defaults to
+      the dialect of `SQLALCHEMY_DATABASE_URI`
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('STORAGE_BACKEND', None)
+        name = app.config['STORAGE_BACKEND'] or \
+            app.config['SQLALCHEMY_DATABASE_URI'].split(':')[0].split('+')[0]
+        app.extensions['storage'] = create_storage(name)
+
+    def backend(self):
+        """Returns the `ConnectionStorage` of the current app."""
+        return current_app.extensions['storage']
+
+
+storage = Storage()
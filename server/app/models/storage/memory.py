@@ -0,0 +1,160 @@
+from . import ConnectionStorage
+from ..core import db
+from ..users import User, ConnectionType, RELATIONSHIPS, CONNECTION_CHANGES_KEY
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from threading import RLock
+
+
+class MemoryStorage(ConnectionStorage):
+    """Connections kept in process memory, e.g. for tests, edge workers
+    and single process deployments. Connections are not persisted nor
+    shared by processes.
+
+    Writes are the `ConnectionChange` recorded in the session by
+    `app.models.users`, i.e. they are only visible to the session until
+    committed (see `apply`) and discarded when rolled back.
+    """
+
+    name = 'memory'
+
+    def __init__(self):
+        self._outgoing = defaultdict(dict)  # {source_id: {target_id: flags}}
+        self._incoming = defaultdict(dict)  # {target_id: {source_id: flags}}
+        self._lock = RLock()
+
+    def apply(self, changes):
+        # The flags changed (`old ^ new`) rather than `new`, so that the
+        # sessions committing distinct flags of a connection concurrently
+        # don't overwrite each other
+        with self._lock:
+            for change in changes:
+                source_id, target_id = change.source_id, change.target_id
+                connection = self._outgoing.get(source_id, {}).get(
+                    target_id, ConnectionType.NONE.value)
+                connection ^= change.old ^ change.new
+                if connection:
+                    self._outgoing[source_id][target_id] = connection
+                    self._incoming[target_id][source_id] = connection
+                else:
+                    self._outgoing[source_id].pop(target_id, None)
+                    self._incoming[target_id].pop(source_id, None)
+
+    def user_connections(self, user_id, other_ids, incoming=True):
+        existing = db.session.query(User.user_id).\
+            filter(User.user_id.in_(set(other_ids)))
+        pending = self._pending()
+        return dict(
+            (other_id, (
+                self._connection(user_id, other_id, pending),
+                self._connection(other_id, user_id, pending) if incoming
+                else ConnectionType.NONE.value
+            ))
+            for other_id, in existing
+        )
+
+    def connections(self, user_id, pairs):
+        pending = self._pending()
+        found = []
+        for source_id, target_id in pairs:
+            connection = self._connection(source_id, target_id, pending)
+            if connection:
+                found.append((source_id, target_id, connection))
+        return found
+
+    def set_connection(self, source_id, target_id, connection):
+        pass
+
+    def update_flag(self, source_id, current, flag, adding):
+        return dict(
+            (target_id, connection | flag if adding else connection & ~flag)
+            for target_id, connection in current.items()
+        )
+
+    def related_user_ids(self, user_id, relationship, after=None,
+                         before=None, limit=None, descending=False):
+        outgoing, mask, exclude = RELATIONSHIPS[relationship]
+        user_ids = sorted(
+            other_id
+            for other_id, connection
+            in self._neighbors(user_id, outgoing).items()
+            if connection & mask and not connection & exclude
+        )
+        start = 0 if after is None else bisect_right(user_ids, after)
+        end = len(user_ids) if before is None \
+            else bisect_left(user_ids, before)
+        user_ids = user_ids[start:end]
+        if descending:
+            user_ids.reverse()
+        return user_ids if limit is None else user_ids[:limit]
+
+    def iter_related_user_ids(self, user_id, relationship, batch_size):
+        user_ids = self.related_user_ids(user_id, relationship)
+        for i in range(0, len(user_ids), batch_size):
+            yield user_ids[i:i + batch_size]
+
+    def related_user_ids_of(self, user_ids, relationship, after=None,
+                            before=None, limit=None, descending=False):
+        return dict(
+            (user_id, self.related_user_ids(
+                user_id, relationship, after=after, before=before,
+                limit=limit, descending=descending))
+            for user_id in set(user_ids)
+        )
+
+    def common_friends(self, source_id, target_ids):
+        friends = set(self.related_user_ids(source_id, 'friends'))
+        common = {}
+        for target_id in set(target_ids):
+            found = [
+                friend_id
+                for friend_id in self.related_user_ids(target_id, 'friends')
+                if friend_id in friends
+            ]
+            if found:
+                common[target_id] = found
+        return common
+
+    def friend_edges(self, user_ids):
+        return [
+            (user_id, friend_id)
+            for user_id in sorted(set(user_ids))
+            for friend_id in self.related_user_ids(user_id, 'friends')
+        ]
+
+    def edges(self, batch_size=10000, mask=None):
+        with self._lock:
+            edges = sorted(
+                (source_id, target_id, connection)
+                for source_id, targets in self._outgoing.items()
+                for target_id, connection in targets.items()
+                if connection and (mask is None or connection & mask)
+            )
+        return iter(edges)
+
+    def _pending(self):
+        # {(source_id, target_id): flags} of the uncommitted changes
+        return dict(
+            ((change.source_id, change.target_id), change.new)
+            for change in db.session.info.get(CONNECTION_CHANGES_KEY, ())
+        )
+
+    def _connection(self, source_id, target_id, pending):
+        if (source_id, target_id) in pending:
+            return pending[(source_id, target_id)]
+        with self._lock:
+            return self._outgoing.get(source_id, {}).get(
+                target_id, ConnectionType.NONE.value)
+
+    def _neighbors(self, user_id, outgoing):
+        """Returns `{other_id: flags}` of the connections from `user_id`,
+        or to `user_id` unless `outgoing`."""
+        with self._lock:
+            index = self._outgoing if outgoing else self._incoming
+            found = dict(index.get(user_id, ()))
+        for (source_id, target_id), connection in self._pending().items():
+            if outgoing and source_id == user_id:
+                found[target_id] = connection
+            elif not outgoing and target_id == user_id:
+                found[source_id] = connection
+        return found
@@ -0,0 +1,376 @@
+from . import ConnectionStorage
+from ..core import db, insert_ignore
+from ..users import (
+    User, connections, connection_flags, ConnectionType, RELATIONSHIPS
+)
+from sqlalchemy import and_, null, or_, select, func
+from sqlalchemy.dialects.postgresql import insert
+
+
+class SQLStorage(ConnectionStorage):
+    """Connections of the `connections` table, in portable SQL.
+
+    Flags are updated by the database, e.g. `connection | 1`, while new
+    flags are computed from the current ones given to `update_flag`, read
+    in the same transaction.
+    """
+
+    def user_connections(self, user_id, other_ids, incoming=True):
+        stmt = _user_connections_select(user_id, other_ids, incoming)
+        return dict(
+            (other_id, (
+                outgoing or ConnectionType.NONE.value,
+                incoming or ConnectionType.NONE.value
+            ))
+            for other_id, outgoing, incoming
+            in db.session.execute(stmt).fetchall()
+        )
+
+    def connections(self, user_id, pairs):
+        return db.session.execute(
+            connections_select(user_id, pairs)).fetchall()
+
+    def set_connection(self, source_id, target_id, connection):
+        c = connections.c
+        db.session.execute(insert_ignore(connections).values(
+            source_id=source_id, target_id=target_id, connection=connection))
+        db.session.execute(
+            connections.update().
+            where(and_(c.source_id == source_id, c.target_id == target_id)).
+            values(connection=connection))
+
+    def update_flag(self, source_id, current, flag, adding):
+        c = connections.c
+        if adding:
+            db.session.execute(insert_ignore(connections).values([
+                dict(source_id=source_id, target_id=target_id,
+                     connection=ConnectionType.NONE.value)
+                for target_id in current
+            ]))
+            value = c.connection.op('|')(flag)
+        else:
+            value = c.connection.op('&')(~flag)
+        db.session.execute(
+            connections.update().
+            where(and_(c.source_id == source_id, c.target_id.in_(current))).
+            values(connection=value))
+        return dict(
+            (target_id, connection | flag if adding else connection & ~flag)
+            for target_id, connection in current.items()
+        )
+
+    def related_user_ids(self, user_id, relationship, after=None,
+                         before=None, limit=None, descending=False):
+        stmt, other = related_user_ids_select(user_id, relationship)
+        stmt = stmt.\
+            order_by(other.desc() if descending else other).\
+            limit(limit)
+        if after is not None:
+            stmt = stmt.where(other > after)
+        if before is not None:
+            stmt = stmt.where(other < before)
+        return [user_id for user_id, in db.session.execute(stmt).fetchall()]
+
+    def iter_related_user_ids(self, user_id, relationship, batch_size):
+        stmt, other = related_user_ids_select(user_id, relationship)
+        stmt = stmt.order_by(other).execution_options(stream_results=True)
+        result = db.session.execute(stmt)
+        try:
+            while True:
+                rows = result.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield [user_id for user_id, in rows]
+        finally:
+            result.close()
+
+    def related_user_ids_of(self, user_ids, relationship, after=None,
+                            before=None, limit=None, descending=False):
+        user_ids = set(user_ids)
+        stmt = related_user_ids_of_select(
+            user_ids, relationship, after, before, limit, descending)
+        related = dict((user_id, []) for user_id in user_ids)
+        for user_id, related_id in db.session.execute(stmt).fetchall():
+            related[user_id].append(related_id)
+        return related
+
+    def common_friends(self, source_id, target_ids):
+        stmt = common_friend_edges_select(source_id, target_ids)
+        common = {}
+        for target_id, friend_id in db.session.execute(stmt).fetchall():
+            common.setdefault(target_id, []).append(friend_id)
+        return common
+
+    def friend_edges(self, user_ids):
+        return db.session.execute(friend_edges_select(user_ids)).fetchall()
+
+    def edges(self, batch_size=10000, mask=None):
+        c = connections.c
+        stmt = select([c.source_id, c.target_id, c.connection]).\
+            where(c.connection != 0)
+        if mask is not None:
+            stmt = stmt.where(connection_flags(mask))
+        stmt = stmt.order_by(c.source_id, c.target_id)
+        # Out of the session, whose uncommitted writes may be rolled back
+        with db.engine.connect() as connection:
+            result = connection.\
+                execution_options(stream_results=True).\
+                execute(stmt)
+            while True:
+                rows = result.fetchmany(batch_size)
+                if not rows:
+                    break
+                for source_id, target_id, connection in rows:
+                    yield source_id, target_id, connection
+
+
+class SQLiteStorage(SQLStorage):
+    """Connections of the `connections` table of an embedded SQLite
+    database (e.g. `sqlite:////var/lib/app/app.db`), i.e. single node
+    deployments without a database server. Requires SQLite 3.25 or later,
+    for window functions."""
+
+    name = 'sqlite'
+
+
+class PostgresStorage(SQLStorage):
+    """Connections of the `connections` table of postgres, where writes are
+    upserts returning the new flags, and common friends are aggregated by
+    the database."""
+
+    name = 'postgresql'
+
+    def set_connection(self, source_id, target_id, connection):
+        db.session.execute(insert(connections).values(
+            source_id=source_id,
+            target_id=target_id,
+            connection=connection
+        ).on_conflict_do_update(
+            index_elements=('source_id', 'target_id'),
+            set_=dict(connection=connection)
+        ))
+
+    def update_flag(self, source_id, current, flag, adding):
+        c = connections.c
+        if adding:
+            stmt = insert(connections).values([
+                dict(source_id=source_id, target_id=target_id,
+                     connection=flag)
+                for target_id in current
+            ]).on_conflict_do_update(
+                index_elements=('source_id', 'target_id'),
+                set_=dict(connection=c.connection.op('|')(flag))
+            )
+        else:
+            stmt = connections.update().\
+                where(and_(
+                    c.source_id == source_id,
+                    c.target_id.in_(current)
+                )).\
+                values(connection=c.connection.op('&')(~flag))
+        stmt = stmt.returning(c.target_id, c.connection)
+        return dict(db.session.execute(stmt).fetchall())
+
+    def common_friends(self, source_id, target_ids):
+        stmt = common_friends_select(source_id, target_ids)
+        # {target_id: [common_friend_id, ..]}
+        return dict(db.session.execute(stmt).fetchall())
+
+
+def _user_connections_select(user_id, other_ids, with_incoming=True):
+    # Fetch the users with both the outgoing (user -> other) and
+    # incoming (other -> user, NULL unless `with_incoming`) connections in
+    # a single round trip:
+    # ----------------------------------------------------------------
+    # SELECT users.user_id, outgoing.connection, incoming.connection
+    # FROM users
+    # LEFT OUTER JOIN connections AS outgoing ON
+    #   outgoing.source_id = [user] AND outgoing.target_id = users.user_id
+    # LEFT OUTER JOIN connections AS incoming ON
+    #   incoming.source_id = users.user_id AND incoming.target_id = [user]
+    # WHERE users.user_id IN ([other_ids])
+    # ----------------------------------------------------------------
+    users = User.__table__
+    outgoing = connections.alias('outgoing')
+    incoming = connections.alias('incoming')
+    joined = users.outerjoin(outgoing, and_(
+        outgoing.c.source_id == user_id,
+        outgoing.c.target_id == users.c.user_id
+    ))
+    if with_incoming:
+        joined = joined.outerjoin(incoming, and_(
+            incoming.c.source_id == users.c.user_id,
+            incoming.c.target_id == user_id
+        ))
+    return select([
+            users.c.user_id,
+            outgoing.c.connection,
+            incoming.c.connection if with_incoming else null(),
+        ]).\
+        select_from(joined).\
+        where(users.c.user_id.in_(other_ids))
+
+
+def connections_select(user_id, pairs):
+    """Returns the select of the `(source_id, target_id, connection)` of
+    the `(source_id, target_id)` pairs from or to `user_id`."""
+    c = connections.c
+    # Fetches both directions in one statement:
+    # WHERE (source_id = [user] AND target_id IN ([others])) OR
+    #       (target_id = [user] AND source_id IN ([others]))
+    targets = [t for s, t in pairs if s == user_id]
+    sources = [s for s, t in pairs if t == user_id]
+    conditions = []
+    if targets:
+        conditions.append(
+            and_(c.source_id == user_id, c.target_id.in_(targets)))
+    if sources:
+        conditions.append(
+            and_(c.target_id == user_id, c.source_id.in_(sources)))
+    return select([c.source_id, c.target_id, c.connection]).\
+        where(or_(*conditions))
+
+
+def related_user_ids_of_select(user_ids, relationship, after, before,
+                               limit, descending):
+    """Returns the select of the sorted `(user_id, related_id)` of
+    `related_user_ids_of`."""
+    this, other, condition = relationship_columns(relationship)
+    conditions = [this.in_(user_ids), condition]
+    if after is not None:
+        conditions.append(other > after)
+    if before is not None:
+        conditions.append(other < before)
+    order = other.desc() if descending else other
+    if limit is None:
+        stmt = select([this, other]).\
+            where(and_(*conditions)).\
+            order_by(this, order)
+    else:
+        # Ranks the related users of each user to keep the first `limit`:
+        # ------------------------------------------------------------------
+        # SELECT user_id, related_id FROM (
+        #   SELECT source_id AS user_id, target_id AS related_id,
+        #     row_number() OVER (
+        #       PARTITION BY source_id ORDER BY target_id) AS rank
+        #   FROM connections
+        #   WHERE source_id IN ([user_ids]) AND connection & [mask] > 0 ..
+        # ) AS ranked WHERE rank <= [limit] ORDER BY user_id, rank
+        # ------------------------------------------------------------------
+        ranked = select([
+                this.label('user_id'),
+                other.label('related_id'),
+                func.row_number().over(
+                    partition_by=this, order_by=order).label('rank'),
+            ]).\
+            where(and_(*conditions)).\
+            alias('ranked')
+        stmt = select([ranked.c.user_id, ranked.c.related_id]).\
+            where(ranked.c.rank <= limit).\
+            order_by(ranked.c.user_id, ranked.c.rank)
+    return stmt
+
+
+def related_user_ids_select(user_id, relationship):
+    """Returns the `(select, column)` of the user_ids related to `user_id`
+    by `relationship`, where `column` is the related user_id."""
+    this, other, condition = relationship_columns(relationship)
+    stmt = select([other]).where(and_(this == user_id, condition))
+    return stmt, other
+
+
+def relationship_columns(relationship):
+    """Returns the `(this, other, condition)` of `relationship`, where
+    `this` and `other` are the user_id columns of the user and of the
+    related users, and `condition` filters the connection flags."""
+    outgoing, mask, exclude = RELATIONSHIPS[relationship]
+    c = connections.c
+    if outgoing:
+        this, other = c.source_id, c.target_id
+    else:
+        this, other = c.target_id, c.source_id
+    return this, other, connection_flags(mask, exclude)
+
+
+def _friends_cte(source_id):
+    c = connections.c
+    return select([c.target_id]).\
+        where(
+            and_(
+                c.source_id == source_id,
+                connection_flags(ConnectionType.FRIEND.value)
+            )
+        ).\
+        cte('friends')
+
+
+def common_friends_select(source_id, target_ids):
+    """Returns the select of the `(target_id, [common_friend_id, ..])` of
+    `PostgresStorage.common_friends`."""
+    # We use a WITH query (CTE Common Table Expression) to identify source's
+    # friends and use it against targets friends. This way we avoid making
+    # multiple round trips to the database. The query expression looks like:
+    # ----------------------------------------------------------------------
+    # -- Define `friends` subquery, returns source's friends user_id
+    # WITH friends AS (
+    #   SELECT target_id FROM connections
+    #     WHERE source_id = [source]
+    #     AND connection & 1 > 0
+    # )
+    # -- We let postgresql do the heavy lifting by grouping the results
+    # -- by target_id and getting the source_ids an array.
+    # SELECT source_id, array_agg(target_id)
+    # FROM connections
+    # WHERE
+    #   -- source_id are the befrienders, i.e. `targets`
+    #   source_id IN ([targets]) AND
+    #   -- target_id are the common friends we target
+    #   target_id IN (SELECT target_id FROM friends) AND
+    #   connection & 1 > 0
+    # GROUP BY source_id
+    # ----------------------------------------------------------------------
+    c = connections.c
+    friends = _friends_cte(source_id)
+    stmt = select([
+            c.source_id,
+            func.array_agg(c.target_id)
+        ]).\
+        where(
+            and_(
+                c.source_id.in_(target_ids),
+                c.target_id.in_(select([friends.c.target_id])),
+                connection_flags(ConnectionType.FRIEND.value)
+            )
+        ).\
+        group_by(c.source_id)
+    return stmt
+
+
+def common_friend_edges_select(source_id, target_ids):
+    """Returns the select of the `(target_id, common_friend_id)` of
+    `SQLStorage.common_friends`, i.e. `common_friends_select` without
+    aggregates."""
+    c = connections.c
+    friends = _friends_cte(source_id)
+    return select([c.source_id, c.target_id]).\
+        where(
+            and_(
+                c.source_id.in_(target_ids),
+                c.target_id.in_(select([friends.c.target_id])),
+                connection_flags(ConnectionType.FRIEND.value)
+            )
+        )
+
+
+def friend_edges_select(user_ids):
+    """Returns the select of the sorted `(user_id, friend_id)` of
+    `user_ids`."""
+    c = connections.c
+    return select([c.source_id, c.target_id]).\
+        where(
+            and_(
+                c.source_id.in_(set(user_ids)),
+                connection_flags(ConnectionType.FRIEND.value)
+            )
+        ).\
+        order_by(c.source_id, c.target_id)
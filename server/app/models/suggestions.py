@@ -0,0 +1,241 @@
+from .core import db, metadata, insert_ignore
+from .users import (
+    User, connections, connection_flags, get_user_id, on_connection_commit,
+    ConnectionType
+)
+from flask import current_app
+from sqlalchemy import (
+    Column, Integer, Table, ForeignKey, Index, and_, or_, exists, select,
+    func, literal_column
+)
+
+friend_suggestions = Table(
+    'friend_suggestions', metadata,
+    Column(
+        'user_id', Integer, ForeignKey('users.user_id', ondelete='CASCADE'),
+        primary_key=True),
+    Column(
+        'suggested_id', Integer,
+        ForeignKey('users.user_id', ondelete='CASCADE'),
+        primary_key=True),
+    Column('score', Integer, nullable=False),
+    Index(
+        'ix_friend_suggestions_user_id_score', 'user_id', 'score'),
+)
+"""The precomputed top `SUGGESTIONS_TOP_K` "people you may know" of each
+user, scored by their number of common friends."""
+
+stale_friend_suggestions = Table(
+    'stale_friend_suggestions', metadata,
+    Column(
+        'user_id', Integer, ForeignKey('users.user_id', ondelete='CASCADE'),
+        primary_key=True),
+)
+"""The users whose `friend_suggestions` are out of date."""
+
+FRIEND = ConnectionType.FRIEND.value
+BLOCK = ConnectionType.BLOCK.value
+
+_REFRESH_LOCK = 0x73756767
+"""The advisory lock namespace of the users whose suggestions are refreshed
+on read, see `suggested_friend_ids`."""
+
+
+def suggested_friend_ids(user_or_id, limit=None):
+    """Returns the user_ids suggested as friends to `user_or_id`, ranked by
+    the number of friends of `user_or_id` who befriended them.
+
+    Suggestions are read from the precomputed `friend_suggestions`, which
+    are refreshed first when stale or missing (e.g. never computed for
+    users loaded in bulk), while existing friends and blocks, in either
+    direction, are filtered out as of now.
+    """
+    user_id = get_user_id(user_or_id, strict=True)
+    if db.session.execute(_needs_refresh_select(user_id)).scalar():
+        _refresh_on_read(user_id)
+    s, c = friend_suggestions.c, connections.c
+    stmt = select([s.suggested_id]).\
+        where(
+            and_(
+                s.user_id == user_id,
+                ~exists().where(and_(
+                    c.source_id == user_id,
+                    c.target_id == s.suggested_id,
+                    connection_flags(FRIEND | BLOCK)
+                )),
+                ~exists().where(and_(
+                    c.source_id == s.suggested_id,
+                    c.target_id == user_id,
+                    connection_flags(BLOCK)
+                ))
+            )
+        ).\
+        order_by(s.score.desc(), s.suggested_id).\
+        limit(limit)
+    return [
+        suggested_id
+        for suggested_id, in db.session.execute(stmt).fetchall()
+    ]
+
+
+def _needs_refresh_select(user_id):
+    return select([or_(
+        exists().where(stale_friend_suggestions.c.user_id == user_id),
+        ~exists().where(friend_suggestions.c.user_id == user_id)
+    )])
+
+
+def _refresh_on_read(user_id):
+    # In a transaction of its own, committing the session would expire
+    # every instance loaded by the request.
+    with db.engine.begin() as connection:
+        if connection.dialect.name == 'postgresql':
+            # Concurrent reads of the same user refresh it once, the others
+            # wait then find it refreshed
+            connection.execute(select([
+                func.pg_advisory_xact_lock(_REFRESH_LOCK, user_id)]))
+            if not connection.execute(_needs_refresh_select(user_id)).\
+                    scalar():
+                return
+        refresh_friend_suggestions([user_id], connection)
+
+
+def refresh_friend_suggestions(user_ids, connection=None):
+    """Recomputes the `friend_suggestions` of `user_ids` in a single
+    statement and marks them as up to date.
+
+    Statements are executed on `connection`, defaults to `db.session`."""
+    execute = (connection or db.session).execute
+    user_ids = list(set(user_ids))
+    if not user_ids:
+        return
+    top_k = current_app.config['SUGGESTIONS_TOP_K']
+    # Ranks the friends of friends of every user, the query looks like:
+    # ----------------------------------------------------------------------
+    # SELECT user_id, suggested_id, score FROM (
+    #   SELECT
+    #     friend.source_id AS user_id,
+    #     fof.target_id AS suggested_id,
+    #     count(*) AS score,
+    #     row_number() OVER (
+    #       PARTITION BY friend.source_id
+    #       ORDER BY count(*) DESC, fof.target_id
+    #     ) AS rank
+    #   FROM connections AS friend
+    #   JOIN connections AS fof ON fof.source_id = friend.target_id
+    #   WHERE
+    #     friend.source_id IN ([user_ids]) AND
+    #     friend.connection & 1 > 0 AND fof.connection & 1 > 0 AND
+    #     fof.target_id != friend.source_id AND
+    #     -- not already a friend, nor blocked by the user
+    #     NOT EXISTS (SELECT 1 FROM connections AS mine
+    #       WHERE mine.source_id = friend.source_id
+    #       AND mine.target_id = fof.target_id AND mine.connection & 5 > 0)
+    #   GROUP BY friend.source_id, fof.target_id
+    # ) AS ranked WHERE rank <= [top_k]
+    # ----------------------------------------------------------------------
+    friend = connections.alias('friend')
+    fof = connections.alias('fof')
+    mine = connections.alias('mine')
+    score = func.count(literal_column('*'))
+    ranked = select([
+            friend.c.source_id.label('user_id'),
+            fof.c.target_id.label('suggested_id'),
+            score.label('score'),
+            func.row_number().over(
+                partition_by=friend.c.source_id,
+                order_by=(score.desc(), fof.c.target_id)
+            ).label('rank'),
+        ]).\
+        select_from(
+            friend.join(fof, fof.c.source_id == friend.c.target_id)).\
+        where(
+            and_(
+                friend.c.source_id.in_(user_ids),
+                connection_flags(FRIEND, column=friend.c.connection),
+                connection_flags(FRIEND, column=fof.c.connection),
+                fof.c.target_id != friend.c.source_id,
+                ~exists().where(and_(
+                    mine.c.source_id == friend.c.source_id,
+                    mine.c.target_id == fof.c.target_id,
+                    connection_flags(FRIEND | BLOCK, column=mine.c.connection)
+                ))
+            )
+        ).\
+        group_by(friend.c.source_id, fof.c.target_id).\
+        alias('ranked')
+    execute(
+        friend_suggestions.delete().
+        where(friend_suggestions.c.user_id.in_(user_ids)))
+    # Skips the rows inserted by a concurrent refresh of the same users
+    execute(
+        insert_ignore(friend_suggestions).from_select(
+            ['user_id', 'suggested_id', 'score'],
+            select([
+                ranked.c.user_id, ranked.c.suggested_id, ranked.c.score
+            ]).where(ranked.c.rank <= top_k)
+        ))
+    execute(
+        stale_friend_suggestions.delete().
+        where(stale_friend_suggestions.c.user_id.in_(user_ids)))
+
+
+def refresh_all_friend_suggestions(batch_size=1000, stale_only=False):
+    """Recomputes the `friend_suggestions` of every user (or only the stale
+    ones) in batches of `batch_size` users, committing each batch.
+    Returns the number of users refreshed."""
+    if stale_only:
+        column = stale_friend_suggestions.c.user_id
+    else:
+        column = User.__table__.c.user_id
+    n, last_id = 0, 0
+    while True:
+        stmt = select([column]).\
+            where(column > last_id).\
+            order_by(column).\
+            limit(batch_size)
+        user_ids = [
+            user_id for user_id, in db.session.execute(stmt).fetchall()]
+        if not user_ids:
+            return n
+        refresh_friend_suggestions(user_ids)
+        db.session.commit()
+        n += len(user_ids)
+        last_id = user_ids[-1]
+
+
+def mark_stale(user_ids):
+    """Marks the `friend_suggestions` of `user_ids` as out of date."""
+    user_ids = set(user_ids)
+    if user_ids:
+        db.session.execute(
+            insert_ignore(stale_friend_suggestions).
+            values([dict(user_id=user_id) for user_id in user_ids]))
+
+
+@on_connection_commit
+def _invalidate_friend_suggestions(changes):
+    # Friendships change the friends of friends of the befriender, and of
+    # whoever befriended the befriender. Blocks are filtered out as of now
+    # when reading, but leave a gap in the top k of both sides.
+    befrienders, blockers = set(), set()
+    for change in changes:
+        if (change.old ^ change.new) & FRIEND:
+            befrienders.add(change.source_id)
+        if (change.old ^ change.new) & BLOCK:
+            blockers.update((change.source_id, change.target_id))
+    mark_stale(befrienders | blockers)
+    if befrienders:
+        c = connections.c
+        db.session.execute(
+            insert_ignore(stale_friend_suggestions).from_select(
+                ['user_id'],
+                select([c.source_id]).
+                where(
+                    and_(
+                        c.target_id.in_(befrienders),
+                        connection_flags(FRIEND)
+                    )
+                ).
+                distinct()
+            ))
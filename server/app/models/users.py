@@ -1,11 +1,20 @@
-from .core import db, Model, metadata, relationship
+from .core import db, Model, metadata, reads_from_replica, relationship
+from .storage import storage
+from .versions import bump_versions, versioned
+from ..cache import connection_cache
 from ..errors import UserBlockedException
+from ..graph import (
+    graph_store, block_filter, group_sorted_edges, intersect_many
+)
 from ..logging import logger
-from flask import request, g
+from flask import request, g, current_app, has_app_context
 from sqlalchemy import (
-    Column, Integer, String, Table, ForeignKey, and_, select, func
+    Column, Integer, String, Table, ForeignKey, Index, and_, func, event,
+    literal_column
 )
-from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
 from enum import Enum
 
 
@@ -61,12 +70,357 @@ connections = Table(
         'target_id', Integer, ForeignKey('users.user_id'),
         primary_key=True),
     Column(
-        'connection', Integer, index=True,
+        'connection', Integer,
         default=lambda: ConnectionType.ConnectionType.NONE.value.value),
+    # Supports the reverse lookups, e.g. `followers`, and their pagination
+    Index('ix_connections_target_id_source_id', 'target_id', 'source_id'),
+)
+
+
+def connection_flags(mask, exclude=0, column=connections.c.connection):
+    """Returns the condition of a `column` of connection flags having any of
+    the `mask` flags and none of the `exclude` flags.
+
+    Flags are rendered as literals, e.g. `connection & 1 > 0`, so that the
+    planner can match the partial indexes of the relationships (see
+    `RELATIONSHIP_INDEXES`) including for prepared statements."""
+    condition = column.op('&')(literal_column(str(mask))) > \
+        literal_column('0')
+    if exclude:
+        condition = and_(
+            condition,
+            column.op('&')(literal_column(str(exclude))) ==
+            literal_column('0'))
+    return condition
+
+
+CONNECTION_OPERATIONS = {
+    'befriend': (ConnectionType.FRIEND, True),
+    'unfriend': (ConnectionType.FRIEND, False),
+    'follow': (ConnectionType.FOLLOW, True),
+    'unfollow': (ConnectionType.FOLLOW, False),
+    'block': (ConnectionType.BLOCK, True),
+    'unblock': (ConnectionType.BLOCK, False),
+}
+"""Maps a connection operation to its `(ConnectionType, is_adding)` pair,
+see `User.apply_connections`."""
+
+
+RELATIONSHIPS = {
+    'friends': (True, ConnectionType.FRIEND.value, 0),
+    'following': (True, ConnectionType.FOLLOW.value, 0),
+    'followers': (False, ConnectionType.FOLLOW.value, 0),
+    'blocked': (True, ConnectionType.BLOCK.value, 0),
+    'subscribing': (
+        True, ConnectionType.SUBSCRIBED.value, ConnectionType.BLOCK.value),
+    'subscribers': (
+        False, ConnectionType.SUBSCRIBED.value, ConnectionType.BLOCK.value),
+}
+"""Maps a `User` relationship to its `(is_outgoing, mask, exclude)` triple,
+where related users are connected with any of the `mask` flags and none of
+the `exclude` flags, see `related_user_ids`."""
+
+
+def _relationship_index(relationship):
+    outgoing, mask, exclude = RELATIONSHIPS[relationship]
+    c = connections.c
+    columns = (c.source_id, c.target_id) if outgoing \
+        else (c.target_id, c.source_id)
+    condition = connection_flags(mask, exclude)
+    return Index(
+        'ix_connections_{}'.format(relationship), *columns,
+        postgresql_where=condition, sqlite_where=condition)
+
+
+RELATIONSHIP_INDEXES = dict(
+    (relationship, _relationship_index(relationship))
+    for relationship in ('friends', 'followers', 'blocked', 'subscribers')
 )
+"""Partial indexes of the `connections` of a relationship, keyed by the
+user_id of the user then of the related users. The other relationships
+are served by the primary key."""
+
+DROPPED_INDEXES = ('ix_connections_connection', )
+"""Indexes of previous schemas, dropped by `app.models.upgrade_schema`."""
+
+
+ConnectionChange = namedtuple(
+    'ConnectionChange', ('source_id', 'target_id', 'old', 'new'))
+"""Describes a write to the `connections` table."""
+
+CONNECTION_CHANGES_KEY = 'connection_changes'
+
+PREPARED_CONNECTION_CHANGES_KEY = 'prepared_connection_changes'
+
+_connection_listeners = []
+
+_connection_preparers = []
+
+
+def on_connection_changed(listener):
+    """Registers `listener(changes)`, called with an array of
+    `ConnectionChange` once they have been committed. Can be used as a
+    decorator."""
+    _connection_listeners.append(listener)
+    return listener
+
+
+def on_connection_commit(preparer):
+    """Registers `preparer(changes)`, called with an array of
+    `ConnectionChange` right before they are committed, i.e. statements
+    executed by `preparer` are part of the same transaction. Errors abort
+    the commit. Can be used as a decorator."""
+    _connection_preparers.append(preparer)
+    return preparer
+
+
+def _record_connection_changes(changes):
+    """Records `ConnectionChange` made in the current transaction."""
+    db.session.info.setdefault(CONNECTION_CHANGES_KEY, []).extend(changes)
+
+
+@event.listens_for(Session, 'before_commit')
+def _prepare_connection_changes(session):
+    changes = session.info.get(CONNECTION_CHANGES_KEY)
+    if not changes:
+        return
+    # Changes of a committed SAVEPOINT have been prepared already
+    prepared = session.info.get(PREPARED_CONNECTION_CHANGES_KEY, 0)
+    session.info[PREPARED_CONNECTION_CHANGES_KEY] = len(changes)
+    if prepared < len(changes):
+        for preparer in _connection_preparers:
+            preparer(changes[prepared:])
+
+
+@event.listens_for(Session, 'after_commit')
+def _dispatch_connection_changes(session):
+    session.info.pop(PREPARED_CONNECTION_CHANGES_KEY, None)
+    changes = session.info.pop(CONNECTION_CHANGES_KEY, None)
+    if not changes:
+        return
+    for listener in _connection_listeners:
+        try:
+            listener(changes)
+        except Exception as e:
+            logger.exception(e)
+
+
+@event.listens_for(Session, 'after_transaction_end')
+def _discard_connection_changes(session, transaction):
+    # Changes left at the end of the outermost transaction were never
+    # committed, i.e. rolled back or closed.
+    if transaction.parent is None:
+        session.info.pop(PREPARED_CONNECTION_CHANGES_KEY, None)
+        session.info.pop(CONNECTION_CHANGES_KEY, None)
+
+
+@on_connection_changed
+def _apply_connection_changes(changes):
+    # Applied first, the storage must be current for the other listeners
+    if has_app_context():
+        storage.backend().apply(changes)
+
 
+on_connection_changed(graph_store.apply)
+on_connection_changed(connection_cache.apply)
+on_connection_changed(block_filter.apply)
+on_connection_commit(block_filter.prepare)
 
-def common_friends_between(source, targets):
+
+def _might_be_blocked(user_id, blocker_ids):
+    """Returns False when none of `blocker_ids` has blocked `user_id`,
+    neither in the block filter nor in the uncommitted changes."""
+    pending = set(
+        change.source_id
+        for change in db.session.info.get(CONNECTION_CHANGES_KEY, ())
+        if change.target_id == user_id and ConnectionType.is_block(change.new)
+    )
+    return any(
+        blocker_id in pending or block_filter.might_block(blocker_id, user_id)
+        for blocker_id in blocker_ids
+    )
+
+
+def user_version_key(user_or_id):
+    """Returns the key of the version of a user, bumped when the user or
+    any connection from or to the user is written while the GraphQL
+    response cache is enabled, see `app.models.versions`.
+    """
+    return 'user:{}'.format(get_user_id(user_or_id))
+
+
+def _user_versions_enabled():
+    """Whether the versions of users are bumped, they are only read by the
+    GraphQL response cache, see `app.graphql.responses`."""
+    return bool(current_app.config.get('GRAPHQL_RESPONSE_CACHE_SIZE'))
+
+
+def _cached_user_version_key(user):
+    if _user_versions_enabled():
+        return user_version_key(user)
+    return None
+
+
+@on_connection_commit
+def _bump_connection_versions(changes):
+    if not _user_versions_enabled():
+        return
+    bump_versions(
+        user_version_key(user_id)
+        for change in changes if change.old != change.new
+        for user_id in (change.source_id, change.target_id))
+
+
+def _graph():
+    """Returns the `CompactGraph` serving graph reads, or None when reads
+    should go to the database, i.e. the graph store is disabled or the
+    session has connection changes that are not committed yet."""
+    # Checked first, the graph must not be loaded within such a session
+    if db.session.info.get(CONNECTION_CHANGES_KEY):
+        return None
+    return graph_store.graph()
+
+
+def connections_between(source, targets):
+    """Returns `{target_id: connection}` of the connection flags from a
+    single `source` (User or user_id) to an array of `targets` (User or
+    user_id), including `ConnectionType.NONE` for unconnected targets.
+
+    Connections are read from the graph store when enabled, else from the
+    connection cache, fetching the missing ones in a single query.
+    """
+    source_id = get_user_id(source, strict=True)
+    target_ids = set(get_user_id(target, strict=True) for target in targets)
+    found = _connections_with(source_id, target_ids)
+    return dict(
+        (target_id, found[(source_id, target_id)])
+        for target_id in target_ids
+    )
+
+
+def connections_both_ways(user, others):
+    """Returns `{other_id: (outgoing, incoming)}` of the connection flags
+    from `user` (User or user_id) to each of `others` (User or user_id) and
+    from each of `others` to `user`. See `connections_between`.
+    """
+    user_id = get_user_id(user, strict=True)
+    other_ids = set(get_user_id(other, strict=True) for other in others)
+    found = _connections_with(user_id, other_ids, incoming=True)
+    return dict(
+        (other_id, (found[(user_id, other_id)], found[(other_id, user_id)]))
+        for other_id in other_ids
+    )
+
+
+def _connections_with(user_id, other_ids, incoming=False):
+    """Returns `{(source_id, target_id): connection}` of `user_id` to
+    `other_ids`, and of `other_ids` to `user_id` when `incoming` is True.
+    """
+    pairs = set((user_id, other_id) for other_id in other_ids)
+    if incoming:
+        pairs.update((other_id, user_id) for other_id in other_ids)
+    graph = _graph()
+    if graph is not None:
+        return dict((pair, graph.connection(*pair)) for pair in pairs)
+    # Uncommitted connection changes are not reflected in the cache
+    cacheable = not db.session.info.get(CONNECTION_CHANGES_KEY)
+    found = connection_cache.get_many(pairs) if cacheable else {}
+    missing = pairs.difference(found)
+    if missing:
+        fetched = dict.fromkeys(missing, ConnectionType.NONE.value)
+        fetched.update(
+            ((source_id, target_id), connection)
+            for source_id, target_id, connection
+            in storage.backend().connections(user_id, missing)
+        )
+        # Lagging replicas would cache stale connections until invalidated
+        if cacheable and not reads_from_replica():
+            connection_cache.set_many(fetched)
+        found.update(fetched)
+    return found
+
+
+def related_user_ids(user_or_id, relationship, after=None, before=None,
+                     limit=None, descending=False):
+    """Returns the sorted user_ids related to `user_or_id` where
+    `relationship` is one of `RELATIONSHIPS`, e.g. 'friends'.
+
+    This is the id-only equivalent of the `User` relationships, e.g.
+    `user.friends`, served from the graph store when it is enabled.
+
+    The user_ids can be paginated by keyset, i.e. only user_ids greater
+    than `after` and lesser than `before`, at most `limit` of them.
+    """
+    user_id = get_user_id(user_or_id, strict=True)
+    graph = _graph()
+    if graph is not None:
+        outgoing, mask, exclude = RELATIONSHIPS[relationship]
+        if outgoing:
+            user_ids = graph.successors(user_id, mask, exclude)
+        else:
+            user_ids = graph.predecessors(user_id, mask, exclude)
+        start = 0 if after is None else bisect_right(user_ids, after)
+        end = len(user_ids) if before is None \
+            else bisect_left(user_ids, before)
+        user_ids = user_ids[start:end]
+        if descending:
+            user_ids.reverse()
+        return user_ids if limit is None else user_ids[:limit]
+    return storage.backend().related_user_ids(
+        user_id, relationship, after=after, before=before, limit=limit,
+        descending=descending)
+
+
+def iter_related_user_ids(user_or_id, relationship, batch_size=1000):
+    """Yields the sorted user_ids related to `user_or_id` by `relationship`
+    (see `related_user_ids`) in arrays of up to `batch_size` user_ids.
+
+    User_ids are streamed from a server side cursor, i.e. memory usage is
+    bounded by `batch_size` regardless of the number of related users.
+    """
+    user_id = get_user_id(user_or_id, strict=True)
+    graph = _graph()
+    if graph is not None:
+        user_ids = related_user_ids(user_id, relationship)
+        for i in range(0, len(user_ids), batch_size):
+            yield user_ids[i:i + batch_size]
+        return
+    for user_ids in storage.backend().iter_related_user_ids(
+            user_id, relationship, batch_size):
+        yield user_ids
+
+
+def iter_subscriber_ids(user_or_id, batch_size=1000):
+    """Yields the user_ids subscribed to the updates of `user_or_id`, i.e.
+    the users to deliver a feed update to, in arrays of up to `batch_size`
+    user_ids. See `iter_related_user_ids`.
+
+    Subscribers have befriended or followed `user_or_id` and have not
+    blocked `user_or_id`.
+    """
+    return iter_related_user_ids(user_or_id, 'subscribers', batch_size)
+
+
+def related_user_ids_of(user_ids, relationship, after=None, before=None,
+                        limit=None, descending=False):
+    """Returns `{user_id: [related_id, ..]}` of every `user_ids`, i.e. the
+    batch equivalent of `related_user_ids`, fetched in a single query where
+    `after`, `before` and `limit` paginate each user separately.
+    """
+    user_ids = set(user_ids)
+    if _graph() is not None:
+        return dict(
+            (user_id, related_user_ids(
+                user_id, relationship, after=after, before=before,
+                limit=limit, descending=descending))
+            for user_id in user_ids
+        )
+    return storage.backend().related_user_ids_of(
+        user_ids, relationship, after=after, before=before, limit=limit,
+        descending=descending)
+
+
+def common_friends_between(source, targets, engine=None):
     """Returns an array of `(target_id, [common_friend_id, ..])` tuple where
     - A single `source` (User or user_id)
     - An array of `targets` (User or user_id)
@@ -74,6 +428,15 @@ def common_friends_between(source, targets):
     This is an highly optimised fetch for a fairly common operation to display
     a list of users who have common friends with `me`.
 
+    `engine` selects how the intersection is computed, defaults to the
+    `COMMON_FRIENDS_ENGINE` config:
+    - 'sql': the database intersects and groups the friends
+    - 'vector': the sorted friend_ids of `source` and `targets` are fetched
+      in one query and intersected in bulk, see `app.graph.intersect_many`
+
+    The friends are intersected in the graph store when enabled, unless
+    `engine` is given.
+
     Example:
     ```
     results = common_friends_between(1, [2,3,4])
@@ -88,57 +451,38 @@ def common_friends_between(source, targets):
     target_ids = [get_user_id(target_id) for target_id in targets]
     if not target_ids:
         return []
-    # We use a WITH query (CTE Common Table Expression) to identify source's
-    # friends and use it against targets friends. This way we avoid making
-    # multiple round trips to the database. The query expression looks like:
-    # ----------------------------------------------------------------------
-    # -- Define `friends` subquery, returns source's friends user_id
-    # WITH friends AS (
-    #   SELECT target_id FROM connections
-    #     WHERE source_id = [source]
-    #     AND connection & 1 > 0
-    # )
-    # -- We let postgresql do the heavy lifting by grouping the results
-    # -- by target_id and getting the source_ids an array.
-    # SELECT source_id, array_agg(target_id)
-    # FROM connections
-    # WHERE
-    #   -- source_id are the befrienders, i.e. `targets`
-    #   source_id IN ([targets]) AND
-    #   -- target_id are the common friends we target
-    #   target_id IN (SELECT target_id FROM friends) AND
-    #   connection & 1 > 0
-    # GROUP BY source_id
-    # ----------------------------------------------------------------------
-    c = connections.c
-    friends = select([c.target_id]).\
-        where(
-            and_(
-                c.source_id == source_id,
-                c.connection.op('&')(ConnectionType.FRIEND.value) > 0
-            )
-        ).\
-        cte('friends')
-    stmt = select([
-            c.source_id,
-            func.array_agg(c.target_id)
-        ]).\
-        where(
-            and_(
-                c.source_id.in_(target_ids),
-                c.target_id.in_(select([friends.c.target_id])),
-                c.connection.op('&')(ConnectionType.FRIEND.value) > 0
-            )
-        ).\
-        group_by(c.source_id)
-    # {target_id: [common_friend_id, ..]}
-    common = dict(db.session.execute(stmt).fetchall())
+    graph = _graph() if engine is None else None
+    if engine is None:
+        engine = current_app.config.get('COMMON_FRIENDS_ENGINE', 'sql')
+    assert engine in ('sql', 'vector'), \
+        'Unsupported common friends engine: {}'.format(engine)
+    if graph is not None:
+        friend = ConnectionType.FRIEND.value
+        friends = graph.successors(source_id, friend)
+        common = intersect_many(friends, [
+            graph.successors(target_id, friend) for target_id in target_ids
+        ])
+        return list(zip(target_ids, common))
+    if engine == 'vector':
+        friends = friend_ids_of([source_id] + target_ids)
+        common = intersect_many(friends.get(source_id, []), [
+            friends.get(target_id, []) for target_id in target_ids
+        ])
+        return list(zip(target_ids, common))
+    common = storage.backend().common_friends(source_id, target_ids)
     return [
         (target_id, common.get(target_id, []))
         for target_id in target_ids
     ]
 
 
+def friend_ids_of(user_ids):
+    """Returns `{user_id: [friend_id, ..]}` of `user_ids` with sorted
+    friend_ids (a numpy array when available), fetched in a single query.
+    Users without friends are omitted."""
+    return group_sorted_edges(storage.backend().friend_edges(user_ids))
+
+
 def get_user(user_or_id, strict=False):
     """Ensures an User instance, where `user_or_id` can be either:
     - a valid user_id
@@ -211,6 +555,7 @@ def current_user():
     return g.current_user
 
 
+@versioned('users', _cached_user_version_key)
 class User(Model):
     """Represents a user entity."""
 
@@ -241,7 +586,7 @@ class User(Model):
         cascade='all', lazy='dynamic', viewonly=True,
         primaryjoin=and_(
             user_id == connections.c.source_id,
-            connections.c.connection.op('&')(ConnectionType.FRIEND.value) > 0
+            connection_flags(ConnectionType.FRIEND.value)
         ),
         secondaryjoin=user_id == connections.c.target_id,
     )
@@ -251,7 +596,7 @@ class User(Model):
         cascade='all', lazy='dynamic', viewonly=True,
         primaryjoin=and_(
             user_id == connections.c.source_id,
-            connections.c.connection.op('&')(ConnectionType.FOLLOW.value) > 0
+            connection_flags(ConnectionType.FOLLOW.value)
         ),
         secondaryjoin=user_id == connections.c.target_id,
     )
@@ -261,7 +606,7 @@ class User(Model):
         cascade='all', lazy='dynamic', viewonly=True,
         primaryjoin=and_(
             user_id == connections.c.target_id,
-            connections.c.connection.op('&')(ConnectionType.FOLLOW.value) > 0
+            connection_flags(ConnectionType.FOLLOW.value)
         ),
         secondaryjoin=user_id == connections.c.source_id,
     )
@@ -271,7 +616,7 @@ class User(Model):
         cascade='all', lazy='dynamic', viewonly=True,
         primaryjoin=and_(
             user_id == connections.c.source_id,
-            connections.c.connection.op('&')(ConnectionType.BLOCK.value) > 0
+            connection_flags(ConnectionType.BLOCK.value)
         ),
         secondaryjoin=user_id == connections.c.target_id,
     )
@@ -281,9 +626,8 @@ class User(Model):
         cascade='all', lazy='dynamic', viewonly=True,
         primaryjoin=and_(
             user_id == connections.c.source_id,
-            connections.c.connection.op('&')(ConnectionType.BLOCK.value) == 0,
-            connections.c.connection.op('&')
-                (ConnectionType.SUBSCRIBED.value) > 0
+            connection_flags(
+                ConnectionType.SUBSCRIBED.value, ConnectionType.BLOCK.value)
         ),
         secondaryjoin=user_id == connections.c.target_id,
     )
@@ -293,9 +637,8 @@ class User(Model):
         cascade='all', lazy='dynamic', viewonly=True,
         primaryjoin=and_(
             user_id == connections.c.target_id,
-            connections.c.connection.op('&')(ConnectionType.BLOCK.value) == 0,
-            connections.c.connection.op('&')
-                (ConnectionType.SUBSCRIBED.value) > 0
+            connection_flags(
+                ConnectionType.SUBSCRIBED.value, ConnectionType.BLOCK.value)
         ),
         secondaryjoin=user_id == connections.c.source_id,
     )
@@ -319,19 +662,11 @@ class User(Model):
         user1.befriend(user2.befriend(user1))
         ```
         """
-        if not self.is_friend_of(user_or_id):
-            user = get_user(user_or_id, strict=True)
-            if user.is_blocking(self):
-                raise UserBlockedException()
-            self._add_connection_with(user_or_id, ConnectionType.FRIEND)
-        return self
+        return self.apply_connections('befriend', [user_or_id])
 
     def unfriend(self, user_or_id):
         """Unfriends `user_or_id`, returns `self`"""
-        if self.is_friend_of(user_or_id):
-            self._remove_connection_with(
-                user_or_id, ConnectionType.FRIEND)
-        return self
+        return self.apply_connections('unfriend', [user_or_id])
 
     def is_friend_of(self, user_or_id):
         """Returns True if `self` has befriended `user_or_id`."""
@@ -351,19 +686,11 @@ class User(Model):
         user1.follow(user2.follow(user1))
         ```
         """
-        if not self.is_following(user_or_id):
-            user = get_user(user_or_id, strict=True)
-            if user.is_blocking(self):
-                raise UserBlockedException()
-            self._add_connection_with(user_or_id, ConnectionType.FOLLOW)
-        return self
+        return self.apply_connections('follow', [user_or_id])
 
     def unfollow(self, user_or_id):
         """Unfollow `user_or_id`, returns `self`"""
-        if self.is_following(user_or_id):
-            self._remove_connection_with(
-                user_or_id, ConnectionType.FOLLOW)
-        return self
+        return self.apply_connections('unfollow', [user_or_id])
 
     def is_following(self, user_or_id):
         """Returns True if `self` has followed `user_or_id`."""
@@ -377,16 +704,11 @@ class User(Model):
         does not equate to user_or_id -- blocks --> self.
 
         """
-        if not self.is_blocking(user_or_id):
-            self._add_connection_with(user_or_id, ConnectionType.BLOCK)
-        return self
+        return self.apply_connections('block', [user_or_id])
 
     def unblock(self, user_or_id):
         """Unblocks `user_or_id`, returns `self`"""
-        if self.is_blocking(user_or_id):
-            self._remove_connection_with(
-                user_or_id, ConnectionType.BLOCK)
-        return self
+        return self.apply_connections('unblock', [user_or_id])
 
     def is_blocking(self, user_or_id):
         """Returns True if `self` has blocked `user_or_id`."""
@@ -428,6 +750,84 @@ class User(Model):
         connection = self._connection_with(user_or_id)
         return ConnectionType.is_subscribed(connection)
 
+    def apply_connections(self, operation, users_or_ids):
+        """Applies `operation` (e.g. 'befriend', see `CONNECTION_OPERATIONS`)
+        from `self` to every user in `users_or_ids`, returns `self`.
+
+        This is the bulk equivalent of calling `befriend`, `follow`, `block`
+        etc. in a loop, except that it costs two statements (with the
+        postgres storage, see `app.models.storage`) regardless of the number
+        of users:
+        - one SELECT to validate the users and fetch the connections
+          in both directions
+        - one multi-row upsert (or update) where the new bitwise flags are
+          computed by the database, e.g. `connection | 1`
+
+        Befriending or following a user who has blocked `self` raises
+        `UserBlockedException` before anything is written.
+
+        Both the current flags and the block checks are read from the
+        connections storage in the transaction, never from the graph store
+        or connection cache, which may lag behind the writes of other
+        processes. Blocks are not read when the block filter rules them all
+        out, see `app.graph.BlockFilter`.
+        """
+        assert operation in CONNECTION_OPERATIONS, \
+            'Unsupported connection operation: {}'.format(operation)
+        connection_type, adding = CONNECTION_OPERATIONS[operation]
+        user_ids = []
+        for user_or_id in users_or_ids:
+            user_id = get_user_id(user_or_id, strict=True)
+            if user_id not in user_ids:
+                user_ids.append(user_id)
+        if not user_ids:
+            return self
+        assert self.user_id not in user_ids, \
+            'Cannot set connection with oneself'
+        checks_blocks = adding and connection_type is not ConnectionType.BLOCK
+        # {user_id: (outgoing, incoming)}, where incoming connections are
+        # only read to check blocks
+        backend = storage.backend()
+        found = backend.user_connections(
+            self.user_id, user_ids,
+            incoming=checks_blocks and _might_be_blocked(
+                self.user_id, user_ids))
+        for user_id in user_ids:
+            assert user_id in found, \
+                'Expects valid `User` but got {}'.format(user_id)
+        flag = connection_type.value
+        if adding:
+            pending = [
+                user_id for user_id in user_ids
+                if not ConnectionType.has_connection(
+                    found[user_id][0], connection_type)
+            ]
+            if checks_blocks:
+                for user_id in pending:
+                    if ConnectionType.is_block(found[user_id][1]):
+                        raise UserBlockedException()
+        else:
+            pending = [
+                user_id for user_id in user_ids
+                if ConnectionType.has_connection(
+                    found[user_id][0], connection_type)
+            ]
+        if not pending:
+            return self
+        updated = backend.update_flag(
+            self.user_id,
+            dict((user_id, found[user_id][0]) for user_id in pending),
+            flag, adding)
+        _record_connection_changes([
+            ConnectionChange(
+                self.user_id, user_id, found[user_id][0], updated[user_id])
+            for user_id in pending
+        ])
+        if self.__connections is None:
+            self.__connections = {}
+        self.__connections.update(updated)
+        return self
+
     def _connection_with(self, user_or_id):
         """Returns an bitwise flag containing connection information
         with `other`. See `ConnectionTypes`.
@@ -438,38 +838,20 @@ class User(Model):
         if self.__connections is None:
             self.__connections = {}
         if user_id not in self.__connections:
-            q = db.session.query(connections.c.connection).\
-                filter(connections.c.source_id == self.user_id).\
-                filter(connections.c.target_id == user_id)
-            self.__connections[user_id] = \
-                q.scalar() or ConnectionType.NONE.value
+            self.__connections.update(
+                connections_between(self.user_id, [user_id]))
         return self.__connections.get(user_id, ConnectionType.NONE.value)
 
-    def _add_connection_with(self, user_or_id, connection_type):
-        current = self._connection_with(user_or_id)
-        return self._update_connection_with(
-            user_or_id, current | connection_type.value)
-
-    def _remove_connection_with(self, user_or_id, connection_type):
-        current = self._connection_with(user_or_id)
-        return self._update_connection_with(
-            user_or_id, current & ~connection_type.value)
-
     def _has_connection_with(self, user_or_id, connection_type):
         return ConnectionType.has_connection(
             self._connection_with(user_or_id), connection_type)
 
-    def _update_connection_with(self, user_or_id, value):
-        user_id = get_user_id(user_or_id, strict=True)
-        assert user_id != self.user_id, \
-            'Cannot set connection with oneself'
-        upsert = insert(connections).values(
-            source_id=self.user_id,
-            target_id=user_id,
-            connection=value
-        ).on_conflict_do_update(
-            index_elements=('source_id', 'target_id'),
-            set_=dict(connection=value)
-        )
-        db.session.execute(upsert)
-        self.__connections[user_id] = value
+
+USER_ORDER = (
+    func.coalesce(User.__table__.c.first_name, ''),
+    func.coalesce(User.__table__.c.last_name, ''),
+    User.__table__.c.user_id,
+)
+"""The unique sort key of user lists, i.e. by name."""
+
+Index('ix_users_order', *USER_ORDER)
@@ -0,0 +1,137 @@
+from .core import db, metadata, insert_ignore
+from flask import g
+from sqlalchemy import Column, BigInteger, String, Table, event, select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+versions = Table(
+    'versions', metadata,
+    Column('key', String, primary_key=True),
+    Column('version', BigInteger, nullable=False),
+)
+"""Version counters of cached data, e.g. 'users' is bumped whenever users
+are written, i.e. caches keyed by a version never serve stale data. Shared
+by every process."""
+
+GRAPH_VERSION_KEY = 'graph'
+"""Version bumped by bulk loads replacing users and connections wholesale,
+which bypass the versions of individual users."""
+
+BUMPED_VERSIONS_KEY = 'bumped_versions'
+
+_versioned_models = {}  # {model: (key or key(instance), ..)}
+
+
+def get_version(key):
+    """Returns the version of `key`, 0 when it was never bumped."""
+    return get_versions([key])[key]
+
+
+def get_graph_version():
+    """Returns the version of `GRAPH_VERSION_KEY`, read once per app
+    context, i.e. per request, by the in-process copies of the graph (see
+    `app.graph.GraphStore` and `app.cache.ConnectionCache`)."""
+    if 'graph_version' not in g:
+        g.graph_version = get_version(GRAPH_VERSION_KEY)
+    return g.graph_version
+
+
+def get_versions(keys):
+    """Returns `{key: version}` of `keys`, 0 when never bumped."""
+    found = dict.fromkeys(keys, 0)
+    if found:
+        found.update(db.session.execute(
+            select([versions.c.key, versions.c.version]).
+            where(versions.c.key.in_(list(found)))).fetchall())
+    return found
+
+
+def bump_versions(keys, connection=None):
+    """Increments the version of `keys` in the current transaction.
+
+    Statements are executed on `connection`, defaults to `db.session`."""
+    keys = set(keys)
+    if not keys:
+        return
+    execute = (connection or db.session).execute
+    keys = sorted(keys)
+    if db.engine.dialect.name == 'postgresql':
+        execute(
+            insert(versions).
+            values([dict(key=key, version=1) for key in keys]).
+            on_conflict_do_update(
+                index_elements=('key', ),
+                set_=dict(version=versions.c.version + 1)))
+        return
+    execute(insert_ignore(versions).values(
+        [dict(key=key, version=0) for key in keys]))
+    execute(
+        versions.update().
+        where(versions.c.key.in_(keys)).
+        values(version=versions.c.version + 1))
+
+
+def versioned(*keys):
+    """Class decorator bumping the version of `keys` once per transaction
+    when instances of the model are inserted, updated or deleted, where a
+    key is either a string or `key(instance)` returning one, or None to
+    skip the bump.
+
+    Bulk updates and deletes of the session only bump the string keys, as
+    their instances are unknown."""
+    def register(model):
+        _versioned_models[model] = keys
+        return model
+    return register
+
+
+def _keys_of(instance):
+    keys = [
+        key(instance) if callable(key) else key
+        for key in _versioned_models.get(type(instance), ())
+    ]
+    return [key for key in keys if key is not None]
+
+
+def _static_keys_of(model):
+    return [
+        key for key in _versioned_models.get(model, ()) if not callable(key)
+    ]
+
+
+def _bump_once(session, keys):
+    bumped = session.info.setdefault(BUMPED_VERSIONS_KEY, set())
+    keys = set(keys) - bumped
+    if keys:
+        bumped.update(keys)
+        bump_versions(keys, session)
+
+
+@event.listens_for(Session, 'after_flush')
+def _bump_flushed_versions(session, flush_context):
+    keys = set()
+    for instance in session.new | session.deleted:
+        keys.update(_keys_of(instance))
+    for instance in session.dirty:
+        if type(instance) in _versioned_models and \
+                session.is_modified(instance):
+            keys.update(_keys_of(instance))
+    _bump_once(session, keys)
+
+
+@event.listens_for(Session, 'after_bulk_update')
+def _bump_bulk_updated_versions(update_context):
+    _bump_once(
+        update_context.session, _static_keys_of(update_context.mapper.class_))
+
+
+@event.listens_for(Session, 'after_bulk_delete')
+def _bump_bulk_deleted_versions(delete_context):
+    _bump_once(
+        delete_context.session, _static_keys_of(delete_context.mapper.class_))
+
+
+@event.listens_for(Session, 'after_transaction_end')
+def _forget_bumped_versions(session, transaction):
+    if transaction.parent is None:
+        session.info.pop(BUMPED_VERSIONS_KEY, None)
@@ -0,0 +1,199 @@
+from flask import current_app, g, has_request_context
+from promise.dataloader import DataLoader
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from contextlib import contextmanager
+import heapq
+import time
+
+
+class RequestProfile(object):
+    """Statistics of the SQL statements and DataLoaders of a request.
+
+    Statements are attributed to the `path` being resolved when they are
+    executed, i.e. a GraphQL field as `Type.field`, or the name of the
+    DataLoader dispatching a batch. See `report`.
+    """
+
+    def __init__(self, n_slowest=5):
+        self.started_at = time.time()
+        self.n_slowest = n_slowest
+        self.path = None
+        self.n_statements = 0
+        self.db_time = 0
+        self.paths = {}  # {path: [n_statements, db_time]}
+        self.slowest = []  # min heap of (duration, n, statement, path)
+        self.loaders = {}  # {name: [loads, hits, [batch_size, ..]]}
+
+    @contextmanager
+    def resolving(self, path):
+        """Attributes the statements executed within to `path`."""
+        previous, self.path = self.path, path
+        try:
+            yield
+        finally:
+            self.path = previous
+
+    def record_statement(self, statement, duration):
+        self.n_statements += 1
+        self.db_time += duration
+        stats = self.paths.setdefault(self.path, [0, 0])
+        stats[0] += 1
+        stats[1] += duration
+        item = (duration, self.n_statements, statement, self.path)
+        if len(self.slowest) < self.n_slowest:
+            heapq.heappush(self.slowest, item)
+        else:
+            heapq.heappushpop(self.slowest, item)
+
+    def record_load(self, loader, hit):
+        stats = self.loaders.setdefault(loader, [0, 0, []])
+        stats[0] += 1
+        stats[1] += hit
+
+    def record_batch(self, loader, size):
+        self.loaders.setdefault(loader, [0, 0, []])[2].append(size)
+
+    def report(self):
+        """Returns the statistics as a JSON serializable dict, durations
+        are in milliseconds."""
+        return {
+            'durationMs': _ms(time.time() - self.started_at),
+            'sql': {
+                'count': self.n_statements,
+                'durationMs': _ms(self.db_time),
+                'paths': dict(
+                    (path or '', {'count': n, 'durationMs': _ms(duration)})
+                    for path, (n, duration) in self.paths.items()
+                ),
+                'slowest': [
+                    {
+                        'statement': statement,
+                        'durationMs': _ms(duration),
+                        'path': path,
+                    }
+                    for duration, _, statement, path
+                    in sorted(self.slowest, reverse=True)
+                ],
+            },
+            'loaders': dict(
+                (name, {
+                    'loads': loads,
+                    'hits': hits,
+                    'hitRate': round(float(hits) / loads, 3) if loads else 0,
+                    'batchSizes': batch_sizes,
+                })
+                for name, (loads, hits, batch_sizes) in self.loaders.items()
+            ),
+        }
+
+    def server_timing(self):
+        """Returns the `Server-Timing` header value."""
+        return 'db;dur={:.2f};desc="{} statements", app;dur={:.2f}'.format(
+            self.db_time * 1000, self.n_statements,
+            (time.time() - self.started_at) * 1000)
+
+
+def _ms(seconds):
+    return round(seconds * 1000, 3)
+
+
+def current_profile():
+    """Returns the `RequestProfile` of the current request, or None when
+    profiling is disabled or outside of a request."""
+    if not has_request_context():
+        return None
+    return getattr(g, 'profile', None)
+
+
+class Profiler(object):
+    """Flask extension profiling the SQL statements and DataLoaders of every
+    request, reported in the `Server-Timing` response header and in the
+    `extensions` of GraphQL responses, see `RequestProfile`.
+
+    Configuration:
+    - `PROFILING_ENABLED`: profiles every request, default False
+    - `PROFILING_SLOWEST`: number of slowest statements reported, default 5
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('PROFILING_ENABLED', False)
+        app.config.setdefault('PROFILING_SLOWEST', 5)
+        app.before_request(self._start)
+        app.after_request(self._add_server_timing)
+
+    def _start(self):
+        if current_app.config['PROFILING_ENABLED']:
+            g.profile = RequestProfile(current_app.config['PROFILING_SLOWEST'])
+
+    def _add_server_timing(self, response):
+        profile = current_profile()
+        if profile is not None:
+            response.headers['Server-Timing'] = profile.server_timing()
+        return response
+
+
+profiler = Profiler()
+
+
+class ProfilingMiddleware(object):
+    """GraphQL middleware attributing statements to the field resolved."""
+
+    def resolve(self, next, root, args, context, info):
+        profile = current_profile()
+        if profile is None:
+            return next(root, args, context, info)
+        path = '{}.{}'.format(info.parent_type.name, info.field_name)
+        with profile.resolving(path):
+            return next(root, args, context, info)
+
+
+class ProfiledDataLoader(DataLoader):
+    """`DataLoader` reporting its loads, cache hits and batch sizes to the
+    `RequestProfile`, where statements of `batch_load_fn` are attributed to
+    the `profile_name` of the loader."""
+
+    def __init__(self, *args, **kwargs):
+        super(ProfiledDataLoader, self).__init__(*args, **kwargs)
+        batch_load_fn = self.batch_load_fn
+
+        def profiled_batch_load_fn(keys):
+            profile = current_profile()
+            if profile is None:
+                return batch_load_fn(keys)
+            profile.record_batch(self.profile_name, len(keys))
+            with profile.resolving(self.profile_name):
+                return batch_load_fn(keys)
+        self.batch_load_fn = profiled_batch_load_fn
+
+    @property
+    def profile_name(self):
+        return type(self).__name__
+
+    def load(self, key=None):
+        profile = current_profile()
+        if profile is not None and key is not None:
+            hit = self.cache and \
+                self.get_cache_key(key) in self._promise_cache
+            profile.record_load(self.profile_name, hit)
+        return super(ProfiledDataLoader, self).load(key)
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context,
+                           executemany):
+    if current_profile() is not None:
+        conn.info.setdefault('profiling_started_at', []).append(time.time())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    profile = current_profile()
+    started = conn.info.get('profiling_started_at')
+    if profile is not None and started:
+        profile.record_statement(statement, time.time() - started.pop())
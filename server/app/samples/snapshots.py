@@ -0,0 +1,80 @@
+"""Exports and imports the connections as binary edge lists (see
+`app.graph.edgelist`), e.g. to snapshot the graph or to clone it into
+another environment having the same users.
+
+Both stream the connections in constant memory, i.e. a server-side cursor
+when exporting and a `COPY` when importing, e.g.
+
+```
+with open('graph.edges', 'wb') as fp:
+    export_graph(fp)
+```
+"""
+from .synthetic import copy_from, deferred_indexes
+from ..graph.edgelist import read_edges, write_edges
+from ..logging import logger
+from ..models import (
+    db, User, connections, storage, bump_versions, reconcile_degrees,
+    GRAPH_VERSION_KEY
+)
+from ..models.core import insert_ignore
+from ..models.suggestions import stale_friend_suggestions
+from sqlalchemy import select
+import time
+
+
+def export_graph(fp, chunk_size=65536, compression='zlib',
+                 batch_size=10000):
+    """Writes every connection of the connections storage into the binary
+    file `fp`, see `app.graph.edgelist.write_edges`, returns the number of
+    connections exported."""
+    started = time.time()
+    n_connections = write_edges(
+        fp, storage.backend().edges(batch_size=batch_size),
+        chunk_size=chunk_size, compression=compression)
+    logger.info('Exported {} connections in {:.1f}s'.format(
+        n_connections, time.time() - started))
+    return n_connections
+
+
+def import_graph(fp, skip_checks=False):
+    """Replaces the connections with the ones of the binary file `fp`, see
+    `export_graph`, returns the number of connections imported.
+
+    Users are kept, every user_id of `fp` must exist unless `skip_checks`
+    is True, which disables foreign key triggers while loading (requires a
+    superuser). Friend suggestions are all marked stale and the degree
+    counters recounted. The graph version is bumped, i.e. running processes
+    reload their graph store and clear their connection cache, and ignore
+    the graph snapshots saved before. Must be committed by the caller.
+    """
+    assert storage.backend().name == 'postgresql', \
+        'Expects the postgres storage'
+    started = time.time()
+    bind = db.session.connection()
+    if skip_checks:
+        bind.execute('SET LOCAL session_replication_role = replica')
+    bind.execute('TRUNCATE {}'.format(connections.name))
+    with deferred_indexes(connections, bind):
+        n_connections = copy_from(
+            connections,
+            ('source_id', 'target_id', 'connection'),
+            (
+                '%d\t%d\t%d\n' % row
+                for chunk in read_edges(fp)
+                for row in zip(*chunk)
+            ))
+        logger.info('Copied {} connections in {:.1f}s'.format(
+            n_connections, time.time() - started))
+    if skip_checks:
+        bind.execute('SET LOCAL session_replication_role = DEFAULT')
+    bind.execute(
+        insert_ignore(stale_friend_suggestions).from_select(
+            ['user_id'], select([User.user_id])))
+    # COPY bypasses the connection changes, which bump the versions
+    bump_versions([GRAPH_VERSION_KEY])
+    bind.execute('ANALYZE connections')
+    reconcile_degrees()
+    logger.info('Imported {} connections in {:.1f}s'.format(
+        n_connections, time.time() - started))
+    return n_connections
@@ -0,0 +1,217 @@
+"""Generates large synthetic social graphs for capacity testing.
+
+Users and connections are streamed into the database with `COPY`, which is
+orders of magnitude faster than inserting through the ORM, e.g.
+
+```
+load_synthetic_graph(1000000, degree=50, distribution='powerlaw', seed=0)
+```
+"""
+from . import _load_json_file
+from ..models import (
+    db, User, connections, storage, ConnectionType, bump_versions,
+    reconcile_degrees, GRAPH_VERSION_KEY
+)
+from ..logging import logger
+from contextlib import contextmanager
+import time
+
+DISTRIBUTIONS = ('uniform', 'powerlaw')
+
+PROFILE_FIELDS = (
+    'first_name', 'last_name', 'gender', 'education', 'address', 'job',
+    'introduction', 'avatar_url'
+)
+
+CONNECTION_FLAGS = (
+    ConnectionType.FRIEND.value,
+    ConnectionType.FOLLOW.value,
+    ConnectionType.FRIEND.value | ConnectionType.FOLLOW.value,
+    ConnectionType.BLOCK.value,
+)
+"""The flags of generated connections, see `CONNECTION_WEIGHTS`."""
+
+CONNECTION_WEIGHTS = (0.45, 0.3, 0.2, 0.05)
+
+
+def load_synthetic_graph(n_users, degree=50, distribution='uniform',
+                         alpha=2.0, hub_fraction=0.2, seed=0,
+                         chunk_size=10000, skip_checks=True):
+    """Replaces the `users` and `connections` with a synthetic graph of
+    `n_users` users with an average of `degree` connections each, returns
+    the `(n_users, n_connections)` loaded.
+
+    See `generate_connections` for the `distribution`, `alpha`,
+    `hub_fraction` and `seed` arguments. The same arguments always
+    generate the same graph.
+
+    When `skip_checks` is True, foreign key triggers are disabled while
+    loading (generated user_ids are always valid), which requires a
+    superuser. Must be committed by the caller.
+    """
+    assert distribution in DISTRIBUTIONS, \
+        'Unsupported distribution: {}'.format(distribution)
+    assert storage.backend().name == 'postgresql', \
+        'Expects the postgres storage'
+    started = time.time()
+    bind = db.session.connection()
+    if skip_checks:
+        bind.execute('SET LOCAL session_replication_role = replica')
+    # Also empties every table referencing users
+    bind.execute('TRUNCATE {} CASCADE'.format(User.__tablename__))
+    with deferred_indexes(connections, bind):
+        copy_from(
+            User.__table__,
+            ('user_id', 'email') + PROFILE_FIELDS,
+            (copy_line(row) for row in generate_users(n_users)))
+        logger.info('Copied {} users in {:.1f}s'.format(
+            n_users, time.time() - started))
+        n_connections = copy_from(
+            connections,
+            ('source_id', 'target_id', 'connection'),
+            (
+                '%d\t%d\t%d\n' % row
+                for chunk in generate_connections(
+                    n_users, degree, distribution, alpha=alpha,
+                    hub_fraction=hub_fraction, seed=seed,
+                    chunk_size=chunk_size)
+                for row in zip(*[column.tolist() for column in chunk])
+            ))
+        logger.info('Copied {} connections in {:.1f}s'.format(
+            n_connections, time.time() - started))
+    bind.execute(
+        "SELECT setval('users_user_id_seq', (SELECT max(user_id) FROM users))")
+    if skip_checks:
+        bind.execute('SET LOCAL session_replication_role = DEFAULT')
+    # COPY bypasses the ORM, which bumps the version of users otherwise
+    bump_versions(['users', GRAPH_VERSION_KEY])
+    bind.execute('ANALYZE users')
+    bind.execute('ANALYZE connections')
+    reconcile_degrees()
+    logger.info('Loaded synthetic graph in {:.1f}s'.format(
+        time.time() - started))
+    return n_users, n_connections
+
+
+def generate_users(n_users):
+    """Yields `n_users` rows of `('user_id', 'email') + PROFILE_FIELDS`,
+    where profiles are recycled from the sample users."""
+    samples = [
+        tuple(data.get(field) for field in PROFILE_FIELDS)
+        for data in _load_json_file('users.json')
+    ]
+    for user_id in range(1, n_users + 1):
+        yield (user_id, 'user{}@example.com'.format(user_id)) + \
+            samples[(user_id - 1) % len(samples)]
+
+
+def generate_connections(n_users, degree, distribution='uniform', alpha=2.0,
+                         hub_fraction=0.2, seed=0, chunk_size=10000):
+    """Yields `(source_ids, target_ids, flags)` numpy arrays of random
+    connections between user_ids `1..n_users`, grouped by `chunk_size`
+    sources and sorted by `(source_id, target_id)`.
+
+    The out degree of each user is drawn from `distribution`:
+    - 'uniform': between 0 and 2 * `degree`
+    - 'powerlaw': pareto distributed with shape `alpha`, i.e. a few users
+      have a very large number of connections
+
+    With 'powerlaw', `hub_fraction` of the connections also target
+    "celebrity" hubs, with a zipf distributed popularity of shape `alpha`.
+    Other targets are drawn uniformly. Flags are drawn with
+    `CONNECTION_WEIGHTS`.
+    """
+    # Deferred, only required by synthetic graphs
+    import numpy
+    rnd = numpy.random.RandomState(seed)
+    # Hubs are spread over the user_ids by a random permutation
+    hubs = rnd.permutation(n_users) + 1
+    max_degree = max(n_users - 1, 0)
+    for start in range(1, n_users + 1, chunk_size):
+        sources = numpy.arange(
+            start, min(start + chunk_size, n_users + 1), dtype=numpy.int64)
+        if distribution == 'uniform':
+            degrees = rnd.randint(0, 2 * degree + 1, len(sources))
+        else:
+            # Pareto with shape alpha > 1 has a mean of xm * alpha/(alpha-1)
+            xm = degree * (alpha - 1) / alpha
+            degrees = (rnd.pareto(alpha, len(sources)) + 1) * xm
+        degrees = numpy.minimum(degrees.astype(numpy.int64), max_degree)
+        source_ids = numpy.repeat(sources, degrees)
+        target_ids = rnd.randint(1, n_users + 1, len(source_ids))
+        if distribution == 'powerlaw' and len(target_ids):
+            to_hub = rnd.random_sample(len(target_ids)) < hub_fraction
+            ranks = numpy.minimum(
+                rnd.zipf(alpha, to_hub.sum()) - 1, n_users - 1)
+            target_ids[to_hub] = hubs[ranks]
+        # Drop self connections and duplicates, which also sorts the pairs
+        pairs = source_ids * (n_users + 1) + target_ids
+        pairs = numpy.unique(pairs[source_ids != target_ids])
+        source_ids, target_ids = pairs // (n_users + 1), pairs % (n_users + 1)
+        flags = rnd.choice(
+            CONNECTION_FLAGS, len(pairs), p=CONNECTION_WEIGHTS)
+        yield source_ids, target_ids, flags
+
+
+@contextmanager
+def deferred_indexes(table, bind):
+    """Drops the secondary indexes of `table` within, rebuilt on exit, which
+    is much faster than maintaining them row by row when loading."""
+    indexes = list(table.indexes)
+    for index in indexes:
+        index.drop(bind)
+    yield
+    for index in indexes:
+        index.create(bind)
+
+
+def copy_from(table, columns, lines):
+    """Streams `lines` (see `copy_line`) into `table` with a
+    `COPY .. FROM STDIN` on the session connection, returns the number of
+    lines copied."""
+    cursor = db.session.connection().connection.cursor()
+    reader = _CopyReader(lines)
+    cursor.copy_expert(
+        'COPY {} ({}) FROM STDIN'.format(table.name, ', '.join(columns)),
+        reader)
+    return reader.n_lines
+
+
+def copy_line(row):
+    """Returns a `COPY` text format line of the `row` values."""
+    return '\t'.join(_copy_value(value) for value in row) + '\n'
+
+
+class _CopyReader(object):
+    """File-like object reading from an iterable of lines."""
+
+    def __init__(self, lines):
+        self.lines = iter(lines)
+        self.n_lines = 0
+        self.buffer = ''
+
+    def read(self, size=-1):
+        chunks = [self.buffer]
+        length = len(self.buffer)
+        for line in self.lines:
+            chunks.append(line)
+            length += len(line)
+            self.n_lines += 1
+            if 0 <= size <= length:
+                break
+        data = ''.join(chunks)
+        if size < 0:
+            self.buffer = ''
+            return data
+        self.buffer = data[size:]
+        return data[:size]
+
+
+def _copy_value(value):
+    if value is None:
+        return '\\N'
+    return str(value).\
+        replace('\\', '\\\\').\
+        replace('\t', '\\t').\
+        replace('\n', '\\n').\
+        replace('\r', '\\r')
@@ -0,0 +1,95 @@
+"""Compares the 'sql' and 'vector' engines of `common_friends_between`.
+
+Recreates the configured database with random friendship graphs of
+increasing size, all existing data will be lost. Usage:
+
+```
+python -m benchmarks.common_friends --edges 10000,100000,1000000
+```
+"""
+import click
+import random
+import time
+from app import create_app
+from app.models import db, User, connections, common_friends_between
+from app.models import ConnectionType
+
+CHUNK_SIZE = 10000
+
+
+def create_graph(n_edges, degree, seed):
+    """Recreates the database with `n_edges` random friendships between
+    `n_edges / degree` users, returns the number of users."""
+    rnd = random.Random(seed)
+    n_users = max(2, n_edges // degree)
+    db.drop_all()
+    db.create_all()
+    users = User.__table__
+    for start in range(1, n_users + 1, CHUNK_SIZE):
+        db.session.execute(users.insert(), [
+            dict(user_id=user_id, email='user{}@bench.test'.format(user_id))
+            for user_id in range(start, min(start + CHUNK_SIZE, n_users + 1))
+        ])
+    edges = set()
+    while len(edges) < n_edges:
+        source_id, target_id = rnd.randint(1, n_users), rnd.randint(1, n_users)
+        if source_id != target_id:
+            edges.add((source_id, target_id))
+    edges = sorted(edges)
+    for start in range(0, len(edges), CHUNK_SIZE):
+        db.session.execute(connections.insert(), [
+            dict(source_id=source_id, target_id=target_id,
+                 connection=ConnectionType.FRIEND.value)
+            for source_id, target_id in edges[start:start + CHUNK_SIZE]
+        ])
+    db.session.commit()
+    db.session.execute('ANALYZE connections')
+    return n_users
+
+
+def timeit(fn, repeat):
+    """Returns the median seconds of `repeat` calls to `fn`."""
+    timings = []
+    for _ in range(repeat):
+        started = time.time()
+        fn()
+        timings.append(time.time() - started)
+    return sorted(timings)[len(timings) // 2]
+
+
+@click.command()
+@click.option('--edges', default='10000,100000,1000000',
+              help='Comma separated graph sizes, in number of edges')
+@click.option('--degree', default=50, help='Average friends per user')
+@click.option('--targets', default=100, help='Targets per lookup')
+@click.option('--repeat', default=20, help='Lookups per engine')
+@click.option('--seed', default=0, help='Random seed')
+@click.confirmation_option(
+    prompt='All existing data will be lost, do you want to continue?')
+def benchmark(edges, degree, targets, repeat, seed):
+    "Benchmark common_friends_between engines"
+    app = create_app()
+    with app.app_context():
+        click.echo('{:>10} {:>8} {:>10} {:>10}'.format(
+            'edges', 'users', 'sql (ms)', 'vector (ms)'))
+        for n_edges in [int(n) for n in edges.split(',')]:
+            n_users = create_graph(n_edges, degree, seed)
+            rnd = random.Random(seed)
+            viewer_id = rnd.randint(1, n_users)
+            target_ids = [
+                rnd.randint(1, n_users)
+                for _ in range(min(targets, n_users))]
+            results = {}
+            for engine in ('sql', 'vector'):
+                results[engine] = timeit(
+                    lambda: common_friends_between(
+                        viewer_id, target_ids, engine=engine),
+                    repeat)
+            click.echo('{:>10} {:>8} {:>10.2f} {:>10.2f}'.format(
+                n_edges, n_users,
+                results['sql'] * 1000, results['vector'] * 1000))
+        db.session.remove()
+
+
+if __name__ == '__main__':
+    benchmark()
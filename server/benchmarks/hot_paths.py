@@ -0,0 +1,382 @@
+"""Times the model and resolver hot paths against a seeded database.
+
+Loads a synthetic graph (see `app.samples.synthetic`, all existing data
+will be lost) unless `--reuse` is given, then times every benchmark of
+`BENCHMARKS` and reports the median, mean, p95 etc. of each. Usage:
+
+```
+python -m benchmarks.hot_paths --users 100000 --output baseline.json
+python -m benchmarks.hot_paths --reuse --compare baseline.json
+```
+
+Results are written as JSON with `--output` (or printed with
+`--format json`), and `--compare` exits with status 1 when a median is
+slower than the baseline by more than `--threshold`, e.g. to catch
+regressions before deploying.
+"""
+from collections import namedtuple, OrderedDict
+import click
+import json
+import platform
+import random
+import subprocess
+import sys
+import time
+from app import create_app
+from app.graphql import get_schema
+from app.graphql.users import (
+    UserLoader, CurrentUserCommonFriendIdsLoader, CurrentUserConnectionLoader
+)
+from app.models import (
+    db, User, common_friends_between, connections_both_ways, related_user_ids
+)
+from app.models.users import HEADER_CURRENT_USER_ID_KEY
+from app.samples.synthetic import load_synthetic_graph, DISTRIBUTIONS
+
+ALL_USERS_QUERY = '''
+query AllUsers($count: Int!, $cursor: String) {
+  allUsers(first: $count, after: $cursor) {
+    edges {
+      node {
+        id
+        userId
+        fullName
+        address
+        avatarUrl
+        isFriendOfMe
+        isFollowedByMe
+        isBlockedByMe
+        isSubscribedByMe
+        commonFriendsWithMe {
+          id
+          userId
+          fullName
+          avatarUrl
+        }
+      }
+      cursor
+    }
+    pageInfo {
+      endCursor
+      hasNextPage
+    }
+  }
+}
+'''
+
+FRIENDS_QUERY = '''
+query Friends($count: Int!) {
+  me {
+    userId
+    friends(first: $count) {
+      edges {
+        node {
+          userId
+          fullName
+          isMutualFriend
+        }
+      }
+    }
+    followers(first: $count) {
+      edges {
+        node {
+          userId
+          fullName
+          followsMe
+        }
+      }
+    }
+  }
+}
+'''
+
+CONNECTION_MUTATION = '''
+mutation %(name)s($input: UserConnectionMutationInput!) {
+  %(name)s(input: $input) {
+    users {
+      id
+      fullName
+      isFriendOfMe
+      isSubscribedByMe
+      commonFriendsWithMe {
+        id
+        fullName
+        avatarUrl
+      }
+    }
+    relatedUsers {
+      id
+      fullName
+    }
+  }
+}
+'''
+
+Fixtures = namedtuple('Fixtures', ('viewer_id', 'target_ids', 'stranger_id'))
+"""The users benchmarks are run with:
+- `viewer_id`: the current user
+- `target_ids`: a page of users, as displayed to the viewer
+- `stranger_id`: a user without connections to and from the viewer, e.g.
+  to befriend then unfriend
+"""
+
+BENCHMARKS = OrderedDict()
+"""Maps a benchmark name to its `factory(fixtures)`, see `benchmark`."""
+
+
+def benchmark(name):
+    """Registers `factory(fixtures)` as the benchmark `name`, where
+    `factory` prepares and returns the function to time. Both are called
+    within a fresh request context of the viewer. Can be used as a
+    decorator."""
+    def register(factory):
+        BENCHMARKS[name] = factory
+        return factory
+    return register
+
+
+@benchmark('models.common_friends_between.sql')
+def _common_friends_sql(f):
+    return lambda: common_friends_between(
+        f.viewer_id, f.target_ids, engine='sql')
+
+
+@benchmark('models.common_friends_between.vector')
+def _common_friends_vector(f):
+    return lambda: common_friends_between(
+        f.viewer_id, f.target_ids, engine='vector')
+
+
+@benchmark('models.connection_with')
+def _connection_with(f):
+    viewer = User(user_id=f.viewer_id)
+    return lambda: viewer._connection_with(f.target_ids[0])
+
+
+@benchmark('models.connections_both_ways')
+def _connections_both_ways(f):
+    return lambda: connections_both_ways(f.viewer_id, f.target_ids)
+
+
+def _related_user_ids(relationship):
+    def factory(f):
+        return lambda: related_user_ids(f.viewer_id, relationship, limit=100)
+    return factory
+
+
+for relationship in ('friends', 'following', 'followers', 'subscribers'):
+    benchmark('models.related_user_ids.{}'.format(relationship))(
+        _related_user_ids(relationship))
+
+
+@benchmark('loaders.user')
+def _user_loader(f):
+    loader = UserLoader.loader()
+    return lambda: loader.batch_load_fn(f.target_ids).get()
+
+
+@benchmark('loaders.common_friend_ids')
+def _common_friend_ids_loader(f):
+    loader = CurrentUserCommonFriendIdsLoader.loader()
+    return lambda: loader.batch_load_fn(f.target_ids).get()
+
+
+@benchmark('loaders.connection')
+def _connection_loader(f):
+    loader = CurrentUserConnectionLoader.loader()
+    return lambda: loader.batch_load_fn(f.target_ids).get()
+
+
+@benchmark('graphql.all_users')
+def _all_users(f):
+    return lambda: execute(ALL_USERS_QUERY, count=20)
+
+
+@benchmark('graphql.me_friends')
+def _me_friends(f):
+    return lambda: execute(FRIENDS_QUERY, count=20)
+
+
+@benchmark('graphql.befriend_unfriend')
+def _befriend_unfriend(f):
+    variables = dict(input=dict(userId=[f.stranger_id]))
+
+    def befriend_unfriend():
+        execute(CONNECTION_MUTATION % dict(name='befriend'), **variables)
+        execute(CONNECTION_MUTATION % dict(name='unfriend'), **variables)
+    return befriend_unfriend
+
+
+def execute(query, **variables):
+    """Executes the GraphQL `query`, raises the first error if any."""
+    result = get_schema().execute(query, variable_values=variables)
+    if result.errors:
+        raise result.errors[0]
+    return result.data
+
+
+def create_fixtures(n_targets, seed):
+    """Returns random `Fixtures`, where the viewer has friends."""
+    rnd = random.Random(seed)
+    user_ids = [
+        user_id for user_id, in
+        db.session.query(User.user_id).order_by(User.user_id).all()
+    ]
+    assert len(user_ids) > 2, 'Expects a seeded database'
+    viewer_id = rnd.choice(user_ids)
+    for _ in range(100):
+        if related_user_ids(viewer_id, 'friends', limit=1):
+            break
+        viewer_id = rnd.choice(user_ids)
+    others = [user_id for user_id in user_ids if user_id != viewer_id]
+    target_ids = rnd.sample(others, min(n_targets, len(others)))
+    stranger_id = None
+    for user_id in rnd.sample(others, min(100, len(others))):
+        if connections_both_ways(viewer_id, [user_id])[user_id] == (0, 0):
+            stranger_id = user_id
+            break
+    assert stranger_id, 'Expects a user unconnected to {}'.format(viewer_id)
+    return Fixtures(viewer_id, target_ids, stranger_id)
+
+
+def run(app, factory, fixtures, repeat, warmup=1):
+    """Returns the seconds of `repeat` timed calls of the benchmark
+    `factory`, after `warmup` untimed calls."""
+    headers = {HEADER_CURRENT_USER_ID_KEY: str(fixtures.viewer_id)}
+    timings = []
+    for i in range(warmup + repeat):
+        # A new app context per call, i.e. fresh `g` loaders and session
+        with app.app_context(), app.test_request_context(headers=headers):
+            fn = factory(fixtures)
+            started = time.perf_counter()
+            fn()
+            elapsed = time.perf_counter() - started
+        if i >= warmup:
+            timings.append(elapsed)
+    return timings
+
+
+def summarize(timings):
+    """Returns the statistics of `timings`, in milliseconds."""
+    timings = sorted(timings)
+    n = len(timings)
+    return OrderedDict([
+        ('repeat', n),
+        ('min_ms', timings[0] * 1000),
+        ('median_ms', timings[n // 2] * 1000),
+        ('mean_ms', sum(timings) / n * 1000),
+        ('p95_ms', timings[min(n - 1, int(n * 0.95))] * 1000),
+        ('max_ms', timings[-1] * 1000),
+    ])
+
+
+def git_commit():
+    """Returns the current git commit, or None outside of a git checkout."""
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'],
+            stderr=subprocess.DEVNULL).decode('ascii').strip()
+    except Exception:
+        return None
+
+
+def compare(results, baseline, threshold):
+    """Returns `[(name, baseline_ms, median_ms, ratio, is_regression)]` of
+    the benchmarks found in both `results` and `baseline`."""
+    rows = []
+    for name, stats in results.items():
+        if name not in baseline:
+            continue
+        before = baseline[name]['median_ms']
+        ratio = stats['median_ms'] / before if before else 1.0
+        rows.append(
+            (name, before, stats['median_ms'], ratio, ratio > 1 + threshold))
+    return rows
+
+
+@click.command()
+@click.option('--users', default=10000, help='Number of users to load')
+@click.option('--degree', default=50, help='Average connections per user')
+@click.option(
+    '--distribution', type=click.Choice(DISTRIBUTIONS), default='powerlaw',
+    help='Distribution of the connections per user')
+@click.option('--seed', default=0, help='Random seed')
+@click.option(
+    '--reuse', is_flag=True,
+    help='Benchmark the existing database instead of loading a graph')
+@click.option('--targets', default=20, help='Users per page')
+@click.option('--repeat', default=50, help='Timed calls per benchmark')
+@click.option(
+    '--only', default=None,
+    help='Comma separated prefixes of the benchmarks to run')
+@click.option(
+    '--format', 'output_format', type=click.Choice(('text', 'json')),
+    default='text', help='Format of the results printed')
+@click.option('--output', default=None, help='Writes JSON results to a file')
+@click.option(
+    '--compare', 'baseline_path', default=None,
+    help='JSON results of a previous run to compare with')
+@click.option(
+    '--threshold', default=0.2,
+    help='Ratio of slowdown reported as a regression')
+@click.option('--yes', is_flag=True, help='Do not ask for confirmation')
+def main(users, degree, distribution, seed, reuse, targets, repeat, only,
+         output_format, output, baseline_path, threshold, yes):
+    "Benchmark model and resolver hot paths"
+    if not reuse and not yes and not click.confirm(
+            'All existing data will be lost, do you want to continue?'):
+        return
+    app = create_app()
+    with app.app_context():
+        if not reuse:
+            db.create_all()
+            load_synthetic_graph(
+                users, degree=degree, distribution=distribution, seed=seed)
+            db.session.commit()
+        fixtures = create_fixtures(targets, seed)
+        n_users = db.session.query(User).count()
+        db.session.remove()
+    prefixes = only.split(',') if only else None
+    results = OrderedDict()
+    for name, factory in BENCHMARKS.items():
+        if prefixes and not any(name.startswith(p) for p in prefixes):
+            continue
+        results[name] = summarize(run(app, factory, fixtures, repeat))
+        if output_format == 'text':
+            click.echo('{:<40} {:>10.3f} ms'.format(
+                name, results[name]['median_ms']), err=True)
+    report = OrderedDict([
+        ('meta', OrderedDict([
+            ('commit', git_commit()),
+            ('timestamp', int(time.time())),
+            ('python', platform.python_version()),
+            ('users', n_users),
+            ('fixtures', fixtures._asdict()),
+            ('config', dict(
+                (key, app.config.get(key)) for key in (
+                    'COMMON_FRIENDS_ENGINE', 'GRAPH_STORE_ENABLED',
+                    'CONNECTION_CACHE_BACKEND'))),
+        ])),
+        ('results', results),
+    ])
+    if output:
+        with open(output, 'w') as fp:
+            json.dump(report, fp, indent=2)
+    if output_format == 'json':
+        click.echo(json.dumps(report, indent=2))
+    if baseline_path:
+        with open(baseline_path) as fp:
+            baseline = json.load(fp)['results']
+        rows = compare(results, baseline, threshold)
+        click.echo('{:<40} {:>12} {:>12} {:>8}'.format(
+            'benchmark', 'baseline ms', 'median ms', 'ratio'), err=True)
+        for name, before, after, ratio, regressed in rows:
+            click.echo('{:<40} {:>12.3f} {:>12.3f} {:>7.2f}x{}'.format(
+                name, before, after, ratio,
+                ' REGRESSION' if regressed else ''), err=True)
+        if any(row[-1] for row in rows):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
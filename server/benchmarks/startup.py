@@ -0,0 +1,124 @@
+"""Times the cold start of the app, i.e. what a new worker pays before
+serving: importing `app`, `create_app`, then the first and second requests
+to `/graphql`.
+
+Every run starts a fresh python process, timed both lazily (the schema is
+built by the first request) and prebuilt (by `app.warm_up`, as the uwsgi
+master does before forking). Usage:
+
+```
+python -m benchmarks.startup --output baseline.json
+python -m benchmarks.startup --compare baseline.json
+```
+
+Results are reported like `benchmarks.hot_paths`, e.g. `--compare` exits
+with status 1 when a median is slower than the baseline by more than
+`--threshold`.
+"""
+from collections import OrderedDict
+import click
+import json
+import platform
+import subprocess
+import sys
+import time
+from .hot_paths import compare, git_commit, summarize
+
+PHASES = ('import', 'create_app', 'warm_up', 'first_request',
+          'second_request')
+"""The phases timed by each run, see `RUN`."""
+
+RUN = '''
+import json, sys, time
+timings = {}
+started = time.perf_counter()
+from app import create_app, warm_up
+timings['import'] = time.perf_counter() - started
+started = time.perf_counter()
+app = create_app()
+timings['create_app'] = time.perf_counter() - started
+started = time.perf_counter()
+if %(prebuilt)r:
+    warm_up(app)
+timings['warm_up'] = time.perf_counter() - started
+client = app.test_client()
+for phase in ('first_request', 'second_request'):
+    started = time.perf_counter()
+    response = client.post(
+        '/graphql', data=json.dumps(dict(query=%(query)r)),
+        content_type='application/json')
+    timings[phase] = time.perf_counter() - started
+    assert response.status_code == 200, response.data
+json.dump(timings, sys.stdout)
+'''
+"""The script of a run, printing the seconds of each `PHASES`."""
+
+
+def run(prebuilt, query):
+    """Returns `{phase: seconds}` of a run in a new process, where `total`
+    includes starting the interpreter."""
+    started = time.perf_counter()
+    output = subprocess.check_output([
+        sys.executable, '-c', RUN % dict(prebuilt=prebuilt, query=query)])
+    elapsed = time.perf_counter() - started
+    timings = json.loads(output.decode('utf-8'))
+    timings['total'] = elapsed
+    return timings
+
+
+@click.command()
+@click.option('--repeat', default=10, help='Runs per mode')
+@click.option(
+    '--query', default='{ __typename }',
+    help='GraphQL query of the requests, the default one reads no data')
+@click.option(
+    '--format', 'output_format', type=click.Choice(('text', 'json')),
+    default='text', help='Format of the results printed')
+@click.option('--output', default=None, help='Writes JSON results to a file')
+@click.option(
+    '--compare', 'baseline_path', default=None,
+    help='JSON results of a previous run to compare with')
+@click.option(
+    '--threshold', default=0.2,
+    help='Ratio of slowdown reported as a regression')
+def main(repeat, query, output_format, output, baseline_path, threshold):
+    "Benchmark the cold start of the app"
+    results = OrderedDict()
+    for mode, prebuilt in (('lazy', False), ('prebuilt', True)):
+        runs = [run(prebuilt, query) for _ in range(repeat)]
+        for phase in PHASES + ('total', ):
+            name = 'startup.{}.{}'.format(mode, phase)
+            results[name] = summarize([timings[phase] for timings in runs])
+            if output_format == 'text':
+                click.echo('{:<40} {:>10.3f} ms'.format(
+                    name, results[name]['median_ms']), err=True)
+    report = OrderedDict([
+        ('meta', OrderedDict([
+            ('commit', git_commit()),
+            ('timestamp', int(time.time())),
+            ('python', platform.python_version()),
+            ('query', query),
+        ])),
+        ('results', results),
+    ])
+    if output:
+        with open(output, 'w') as fp:
+            json.dump(report, fp, indent=2)
+    if output_format == 'json':
+        click.echo(json.dumps(report, indent=2))
+    if baseline_path:
+        with open(baseline_path) as fp:
+            baseline = json.load(fp)['results']
+        rows = compare(results, baseline, threshold)
+        click.echo('{:<40} {:>12} {:>12} {:>8}'.format(
+            'benchmark', 'baseline ms', 'median ms', 'ratio'), err=True)
+        for name, before, after, ratio, regressed in rows:
+            click.echo('{:<40} {:>12.3f} {:>12.3f} {:>7.2f}x{}'.format(
+                name, before, after, ratio,
+                ' REGRESSION' if regressed else ''), err=True)
+        if any(row[-1] for row in rows):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
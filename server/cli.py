@@ -1,11 +1,20 @@
 import click
 import json
+import os
+import re
+import time
 from os import path
-from app.graphql import schema
-from app.models import db
-from app.samples import load_samples
+from app.graphql import get_schema
+from app.graphql.documents import document_id_of
 from app import create_app
 
+# The models, samples and graph are imported by the commands using them,
+# i.e. `--help` and the other commands do not pay for their imports
+
+DISTRIBUTIONS = ('uniform', 'powerlaw')  # See app.samples.synthetic
+
+COMPRESSIONS = ('none', 'zlib')  # See app.graph.edgelist
+
 
 @click.group(chain=True)
 @click.pass_context
@@ -19,7 +28,7 @@ def cli(ctx):
 def graphql(write=True):
     "Print GraphQL schema"
     data = {
-        'data': schema.introspect()
+        'data': get_schema().introspect()
     }
     output = json.dumps(data, indent=2)
     if write:
@@ -32,6 +41,39 @@ def graphql(write=True):
         click.echo(output)
 
 
+@cli.command('persist-queries')
+@click.option(
+    '--src', default=None,
+    help="Frontend sources, defaults to `../frontend/src`")
+@click.option(
+    '--write/--no-write', default=True, help="Write to default file location")
+def persist_queries(src=None, write=True):
+    "Register the relay compiled queries as persisted queries"
+    cwd = path.dirname(path.realpath(__file__))
+    src = src or path.join(cwd, '..', 'frontend', 'src')
+    # Relay compiled operations have their query text as a JSON string:
+    # "text": "query UsersContainerQuery {\n ..}"
+    pattern = re.compile(r'^\s*"text": (".*")$', re.MULTILINE)
+    queries = {}
+    for dirpath, _, filenames in os.walk(src):
+        for filename in filenames:
+            if not filename.endswith('.graphql.js'):
+                continue
+            with open(path.join(dirpath, filename)) as fp:
+                for text in pattern.findall(fp.read()):
+                    query = json.loads(text)
+                    queries[document_id_of(query)] = query
+    output = json.dumps(queries, indent=2, sort_keys=True)
+    if write:
+        filepath = path.join(cwd, 'schema', 'persisted_queries.json')
+        click.echo('Writing {} persisted queries to `{}`'.format(
+            len(queries), filepath))
+        with open(filepath, 'w') as fp:
+            fp.write(output)
+    else:
+        click.echo(output)
+
+
 @cli.command()
 def initdb():
     """Initialize database."""
@@ -39,6 +81,8 @@ def initdb():
         'Preparing recreate the database, all existing data will be lost.')
     if not click.confirm('Do you want to continue?'):
         return
+    from app.models import db
+    from app.samples import load_samples
     app = create_app()
     with app.app_context():
         db.drop_all()
@@ -48,5 +92,208 @@ def initdb():
         click.echo('Done!')
 
 
+@cli.command('upgrade-schema')
+def upgrade():
+    """Create the missing tables and indexes, keeping existing data."""
+    from app.models import upgrade_schema, DROPPED_INDEXES
+    app = create_app()
+    with app.app_context():
+        created, dropped = upgrade_schema(DROPPED_INDEXES)
+        for name in created:
+            click.echo('Created index `{}`'.format(name))
+        for name in dropped:
+            click.echo('Dropped index `{}`'.format(name))
+        click.echo('Done!')
+
+
+@cli.command()
+@click.option('--users', default=100000, help="Number of users")
+@click.option('--degree', default=50, help="Average connections per user")
+@click.option(
+    '--distribution', type=click.Choice(DISTRIBUTIONS), default='uniform',
+    help="Distribution of the connections per user")
+@click.option(
+    '--alpha', default=2.0, help="Shape of the powerlaw distribution")
+@click.option(
+    '--hub-fraction', default=0.2,
+    help="Fraction of the powerlaw connections targeting hubs")
+@click.option('--seed', default=0, help="Random seed")
+@click.option('--chunk-size', default=10000, help="Users per generated chunk")
+@click.option(
+    '--skip-checks/--check', default=True,
+    help="Disable foreign key checks while loading (requires a superuser)")
+def generate(users=100000, degree=50, distribution='uniform', alpha=2.0,
+             hub_fraction=0.2, seed=0, chunk_size=10000, skip_checks=True):
+    """Load a synthetic graph for capacity testing."""
+    click.echo(
+        'Preparing to replace every user and connection with a synthetic '
+        'graph, all existing data will be lost.')
+    if not click.confirm('Do you want to continue?'):
+        return
+    from app.models import db
+    from app.samples.synthetic import load_synthetic_graph
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+        n_users, n_connections = load_synthetic_graph(
+            users, degree=degree, distribution=distribution, alpha=alpha,
+            hub_fraction=hub_fraction, seed=seed, chunk_size=chunk_size,
+            skip_checks=skip_checks)
+        db.session.commit()
+        click.echo('Loaded {} users and {} connections'.format(
+            n_users, n_connections))
+        _resave_graph_snapshot(app)
+
+
+@cli.command('export-graph')
+@click.argument('output', type=click.File('wb'))
+@click.option(
+    '--compression', type=click.Choice(COMPRESSIONS), default='zlib',
+    help="Compression of the chunks")
+@click.option('--chunk-size', default=65536, help="Connections per chunk")
+def export_graph(output, compression='zlib', chunk_size=65536):
+    """Write every connection to OUTPUT ('-' for stdout)."""
+    from app.samples import snapshots
+    app = create_app()
+    with app.app_context():
+        n = snapshots.export_graph(
+            output, chunk_size=chunk_size, compression=compression)
+        click.echo('Exported {} connections'.format(n), err=True)
+
+
+@cli.command('import-graph')
+@click.argument('input', type=click.File('rb'))
+@click.option(
+    '--skip-checks/--check', default=False,
+    help="Disable foreign key checks while loading (requires a superuser)")
+@click.option('--yes', is_flag=True, help="Do not ask for confirmation")
+def import_graph(input, skip_checks=False, yes=False):
+    """Replace every connection with the ones of INPUT ('-' for stdin)."""
+    click.echo(
+        'Preparing to replace every connection, existing connections will '
+        'be lost.', err=True)
+    if not yes and not click.confirm('Do you want to continue?', err=True):
+        return
+    from app.models import db
+    from app.samples import snapshots
+    app = create_app()
+    with app.app_context():
+        n = snapshots.import_graph(input, skip_checks=skip_checks)
+        db.session.commit()
+        click.echo('Imported {} connections'.format(n), err=True)
+        _resave_graph_snapshot(app)
+
+
+@cli.command('save-graph-snapshot')
+@click.argument('path', required=False)
+def save_graph_snapshot(path=None):
+    """Save a snapshot of the graph mapped by the workers, to PATH or to
+    GRAPH_STORE_SNAPSHOT."""
+    from app.graph import graph_store
+    app = create_app()
+    with app.app_context():
+        n = graph_store.save_snapshot(path)
+        click.echo('Saved {} connections'.format(n))
+
+
+@cli.command('refresh-suggestions')
+@click.option(
+    '--stale-only/--all', default=True,
+    help="Refresh only the users marked as stale")
+@click.option('--batch-size', default=1000, help="Users per transaction")
+def refresh_suggestions(stale_only=True, batch_size=1000):
+    """Precompute friend suggestions."""
+    from app.models import refresh_all_friend_suggestions
+    app = create_app()
+    with app.app_context():
+        n = refresh_all_friend_suggestions(
+            batch_size=batch_size, stale_only=stale_only)
+        click.echo('Refreshed friend suggestions of {} users'.format(n))
+
+
+@cli.command('reconcile-degrees')
+@click.option('--batch-size', default=1000, help="Users per statement")
+def reconcile(batch_size=1000):
+    """Recount the friend, following, follower and subscriber counters."""
+    from app.models import db, reconcile_degrees
+    app = create_app()
+    with app.app_context():
+        n = reconcile_degrees(batch_size=batch_size)
+        db.session.commit()
+        click.echo('Corrected the counters of {} users'.format(n))
+
+
+@cli.command('stream-changes')
+@click.option(
+    '--consumer',
+    help="Resume from the checkpoint of CONSUMER, saved after each batch")
+@click.option(
+    '--after', default='0:0', help="Stream the changes after this TXID:SEQ "
+    "position, unless --consumer is set")
+@click.option('--follow', is_flag=True, help="Keep polling for new changes")
+@click.option('--interval', default=1.0, help="Seconds between polls")
+@click.option('--batch-size', default=1000, help="Changes per batch")
+def stream_changes(consumer=None, after='0:0', follow=False, interval=1.0,
+                   batch_size=1000):
+    """Stream the connection changes, one JSON object per line."""
+    def echo(events):
+        click.echo('\n'.join(
+            json.dumps(event._replace(ts=event.ts.isoformat())._asdict())
+            for event in events))
+
+    from app.models import (
+        db, consume_connection_events, iter_connection_events
+    )
+    after = tuple(int(part) for part in after.split(':'))
+    app = create_app()
+    with app.app_context():
+        while True:
+            if consumer:
+                consume_connection_events(
+                    consumer, echo, batch_size=batch_size)
+            else:
+                for events in iter_connection_events(
+                        after, batch_size=batch_size):
+                    echo(events)
+                    after = (events[-1].txid, events[-1].seq)
+            if not follow:
+                break
+            # Ends the transaction, i.e. the next poll sees new changes
+            db.session.commit()
+            time.sleep(interval)
+
+
+@cli.command('prune-changes')
+def prune_changes():
+    """Delete the connection changes streamed by every consumer."""
+    from app.models import db, prune_connection_events
+    app = create_app()
+    with app.app_context():
+        n = prune_connection_events()
+        db.session.commit()
+        click.echo('Deleted {} connection changes'.format(n))
+
+
+@cli.command()
+@click.argument('user_id', type=int)
+@click.option('--batch-size', default=1000, help="User_ids per batch")
+def subscribers(user_id, batch_size=1000):
+    """Stream the user_ids subscribed to USER_ID, one per line."""
+    from app.models import iter_subscriber_ids
+    app = create_app()
+    with app.app_context():
+        for user_ids in iter_subscriber_ids(user_id, batch_size=batch_size):
+            click.echo('\n'.join(str(user_id) for user_id in user_ids))
+
+
+def _resave_graph_snapshot(app):
+    # Workers ignore the snapshots saved before a bulk load
+    if app.config['GRAPH_STORE_SNAPSHOT']:
+        from app.graph import graph_store
+        n = graph_store.save_snapshot()
+        click.echo('Saved a graph snapshot of {} connections'.format(n),
+                   err=True)
+
+
 if __name__ == '__main__':
     cli(obj={})
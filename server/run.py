@@ -1,3 +1,5 @@
-from app import create_app
+from app import create_app, warm_up
 
 app = create_app()
+# Prebuilt by the uwsgi master, i.e. shared by the forked workers
+warm_up(app)
@@ -0,0 +1,26 @@
+from unittest import TestCase
+from os import path
+import json
+import subprocess
+import sys
+
+DEFERRED_MODULES = (
+    'graphene', 'graphene_sqlalchemy', 'graphql', 'requests', 'numpy')
+
+CREATE_APP = '''
+import json, sys
+from app import create_app
+from tests.utils import TestConfig
+create_app(config=TestConfig)
+json.dump([name for name in %r if name in sys.modules], sys.stdout)
+'''
+
+
+class StartupTest(TestCase):
+
+    def test_deferred_imports(self):
+        # In a new process, as other tests import every module
+        output = subprocess.check_output(
+            [sys.executable, '-c', CREATE_APP % (DEFERRED_MODULES, )],
+            cwd=path.dirname(path.dirname(path.abspath(__file__))))
+        self.assertEqual(json.loads(output.decode('utf-8')), [])
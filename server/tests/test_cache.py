@@ -0,0 +1,150 @@
+from unittest import TestCase
+from .utils import DBTest, TestConfig
+from app.cache import LRUCache, connection_cache
+from app.models import (
+    db, User, bump_versions, connections, connections_between,
+    reads_from_replica, replica_reads, storage, ConnectionType,
+    GRAPH_VERSION_KEY
+)
+from flask import g
+from app.models.core import REPLICA_BIND_KEY
+import time
+
+
+class LRUCacheTest(TestCase):
+
+    def test_eviction(self):
+        cache = LRUCache(maxsize=2)
+        cache.set_many({'a': 1, 'b': 2})
+        self.assertEqual(cache.get_many(['a']), {'a': 1})
+        cache.set_many({'c': 3})
+        self.assertEqual(cache.get_many(['a', 'b', 'c']), {'a': 1, 'c': 3})
+        self.assertEqual(
+            cache.stats(), dict(size=2, hits=3, misses=1, evictions=1))
+        cache.delete_many(['a'])
+        self.assertEqual(cache.get_many(['a']), {})
+
+    def test_ttl(self):
+        cache = LRUCache(ttl=0.01)
+        cache.set_many({'a': 1})
+        self.assertEqual(cache.get_many(['a']), {'a': 1})
+        time.sleep(0.02)
+        self.assertEqual(cache.get_many(['a']), {})
+        self.assertEqual(len(cache), 0)
+
+
+class ConnectionCacheConfig(TestConfig):
+    CONNECTION_CACHE_BACKEND = 'memory'
+
+
+class ConnectionCacheTest(DBTest):
+
+    def create_app(self):
+        app = super(ConnectionCacheTest, self).create_app()
+        app.config.from_object(ConnectionCacheConfig)
+        connection_cache.init_app(app)
+        return app
+
+    def test_connection_cache(self):
+        u1 = User(email='user1@test.com')
+        u2 = User(email='user2@test.com')
+        db.session.add(u1)
+        db.session.add(u2)
+        db.session.commit()
+
+        self.assertEqual(connections_between(u1, [u2]), {u2.user_id: 0})
+        self.assertEqual(connection_cache.stats()['misses'], 1)
+        self.assertEqual(connections_between(u1, [u2]), {u2.user_id: 0})
+        self.assertEqual(connection_cache.stats()['hits'], 1)
+
+        u1.befriend(u2)
+        # Uncommitted changes bypass the cache
+        self.assertEqual(connections_between(u1, [u2]), {u2.user_id: 1})
+        self.assertEqual(connection_cache.stats()['hits'], 1)
+        db.session.commit()
+        self.assertEqual(connections_between(u1, [u2]), {u2.user_id: 1})
+        self.assertEqual(connection_cache.stats()['hits'], 2)
+
+    def test_writes_ignore_stale_cache(self):
+        u1 = User(email='user1@test.com')
+        u2 = User(email='user2@test.com')
+        db.session.add_all([u1, u2])
+        db.session.commit()
+        self.assertEqual(connections_between(u1, [u2]), {u2.user_id: 0})
+
+        # Written by another process, i.e. not applied to this cache
+        db.session.execute(connections.insert().values(
+            source_id=u1.user_id, target_id=u2.user_id,
+            connection=ConnectionType.FOLLOW.value))
+        db.session.commit()
+        self.assertEqual(connections_between(u1, [u2]), {u2.user_id: 0})
+
+        u1.befriend(u2)
+        db.session.commit()
+        rows = storage.backend().connections(
+            u1.user_id, [(u1.user_id, u2.user_id)])
+        self.assertEqual(
+            [tuple(row) for row in rows],
+            [(u1.user_id, u2.user_id, ConnectionType.SUBSCRIBED.value)])
+        self.assertEqual(
+            connections_between(u1, [u2]),
+            {u2.user_id: ConnectionType.SUBSCRIBED.value})
+
+    def test_bulk_load(self):
+        u1 = User(email='user1@test.com')
+        u2 = User(email='user2@test.com')
+        db.session.add_all([u1, u2])
+        db.session.commit()
+        self.assertEqual(connections_between(u1, [u2]), {u2.user_id: 0})
+
+        # As `app.samples.snapshots.import_graph`
+        db.session.execute(connections.insert().values(
+            source_id=u1.user_id, target_id=u2.user_id,
+            connection=ConnectionType.FOLLOW.value))
+        bump_versions([GRAPH_VERSION_KEY])
+        db.session.commit()
+        self.assertEqual(connections_between(u1, [u2]), {u2.user_id: 0})
+        g.pop('graph_version')
+        self.assertEqual(
+            connections_between(u1, [u2]),
+            {u2.user_id: ConnectionType.FOLLOW.value})
+
+    def test_replica_reads_not_cached(self):
+        if db.engine.dialect.name != 'postgresql':
+            # e.g. each in-memory SQLite engine has its own database
+            self.skipTest('Replicas are tested on postgres')
+        self.app.config['SQLALCHEMY_BINDS'] = {
+            REPLICA_BIND_KEY: self.app.config['SQLALCHEMY_DATABASE_URI']
+        }
+        u1 = User(email='user1@test.com')
+        u2 = User(email='user2@test.com')
+        db.session.add_all([u1, u2])
+        db.session.commit()
+        u1_id, u2_id = u1.user_id, u2.user_id
+        # A new session, which reads from the replica until it writes
+        db.session.remove()
+
+        with replica_reads():
+            self.assertTrue(reads_from_replica())
+            self.assertEqual(connections_between(u1_id, [u2_id]), {u2_id: 0})
+        self.assertEqual(connection_cache.stats()['size'], 0)
+        self.assertEqual(connections_between(u1_id, [u2_id]), {u2_id: 0})
+        self.assertEqual(connection_cache.stats()['size'], 1)
+
+
+class UWSGICacheConfig(TestConfig):
+    CONNECTION_CACHE_BACKEND = 'uwsgi'
+
+
+class UWSGICacheTest(DBTest):
+
+    def create_app(self):
+        app = super(UWSGICacheTest, self).create_app()
+        app.config.from_object(UWSGICacheConfig)
+        connection_cache.init_app(app)
+        return app
+
+    def test_disabled_outside_uwsgi(self):
+        # e.g. `cli.py` commands, which can't import uwsgi
+        self.assertIsNone(connection_cache.cache)
+        self.assertEqual(connection_cache.get_many([(1, 2)]), {})
@@ -0,0 +1,385 @@
+from unittest import TestCase
+import os
+import tempfile
+from .utils import DBTest, TestConfig
+from app.errors import UserBlockedException
+from app.graph import (
+    BloomFilter, CompactGraph, graph_store, block_filter, map_snapshot,
+    write_snapshot, BLOCKS_VERSION_KEY
+)
+from app.models import (
+    db, User, ConnectionChange, ConnectionType, common_friends_between,
+    related_user_ids, bump_versions, get_version, connections, storage,
+    GRAPH_VERSION_KEY
+)
+from flask import g
+
+FRIEND = ConnectionType.FRIEND.value
+FOLLOW = ConnectionType.FOLLOW.value
+BLOCK = ConnectionType.BLOCK.value
+SUBSCRIBED = ConnectionType.SUBSCRIBED.value
+
+
+class CompactGraphTest(TestCase):
+
+    def create_graph(self, **kwargs):
+        return CompactGraph.from_edges([
+            (1, 2, FRIEND),
+            (1, 3, FRIEND | FOLLOW),
+            (1, 5, BLOCK),
+            (2, 1, FOLLOW),
+            (3, 1, FRIEND | BLOCK),
+            (4, 1, 0),
+        ], **kwargs)
+
+    def test_lookups(self):
+        graph = self.create_graph()
+        self.assertEqual(len(graph), 5)
+        self.assertEqual(graph.connection(1, 3), FRIEND | FOLLOW)
+        self.assertEqual(graph.connection(4, 1), 0)
+        self.assertEqual(graph.connection(9, 1), 0)
+        self.assertEqual(graph.successors(1, FRIEND), [2, 3])
+        self.assertEqual(graph.successors(1, BLOCK), [5])
+        self.assertEqual(graph.successors(9, FRIEND), [])
+        self.assertEqual(graph.predecessors(1, SUBSCRIBED), [2, 3])
+        self.assertEqual(graph.predecessors(1, SUBSCRIBED, BLOCK), [2])
+
+    def test_apply(self):
+        graph = self.create_graph()
+        graph.apply([
+            ConnectionChange(1, 2, FRIEND, 0),
+            ConnectionChange(1, 4, 0, FRIEND),
+            ConnectionChange(7, 1, 0, FOLLOW),
+        ])
+        self.assertEqual(graph.connection(1, 2), 0)
+        self.assertEqual(graph.successors(1, FRIEND), [3, 4])
+        self.assertEqual(graph.predecessors(1, FOLLOW), [2, 7])
+        self.assertEqual(graph.predecessors(2, FRIEND), [])
+
+    def test_compact(self):
+        graph = self.create_graph(compact_threshold=1)
+        graph.apply([
+            ConnectionChange(1, 2, FRIEND, 0),
+            ConnectionChange(7, 1, 0, FOLLOW),
+        ])
+        self.assertEqual(len(graph), 5)
+        self.assertEqual(graph.forward.size, 8)
+        self.assertEqual(graph.successors(1, FRIEND), [3])
+        self.assertEqual(graph.predecessors(1, FOLLOW), [2, 7])
+        self.assertEqual(list(graph.edges()), [
+            (1, 3, FRIEND | FOLLOW),
+            (1, 5, BLOCK),
+            (2, 1, FOLLOW),
+            (3, 1, FRIEND | BLOCK),
+            (7, 1, FOLLOW),
+        ])
+
+    def test_snapshot(self):
+        graph = self.create_graph()
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            write_snapshot(path, graph.forward, graph.reverse, 1.0, 2)
+            forward, reverse, built_at, version = map_snapshot(path)
+            mapped = CompactGraph(forward, reverse, compact_threshold=0)
+            self.assertEqual((built_at, version), (1.0, 2))
+            self.assertEqual(list(mapped.edges()), list(graph.edges()))
+            self.assertEqual(mapped.predecessors(1, SUBSCRIBED), [2, 3])
+            mapped.apply([ConnectionChange(1, 2, FRIEND, 0)])
+            self.assertEqual(mapped.successors(1, FRIEND), [3])
+        finally:
+            os.remove(path)
+
+
+class GraphStoreConfig(TestConfig):
+    GRAPH_STORE_ENABLED = True
+
+
+class GraphStoreTest(DBTest):
+
+    def create_app(self):
+        app = super(GraphStoreTest, self).create_app()
+        app.config.from_object(GraphStoreConfig)
+        return app
+
+    def test_graph_store(self):
+        u1 = User(email='user1@test.com')
+        u2 = User(email='user2@test.com')
+        u3 = User(email='user3@test.com')
+        db.session.add(u1)
+        db.session.add(u2)
+        db.session.add(u3)
+        db.session.flush()
+        u1.befriend(u2)
+        u2.befriend(u3)
+        u3.follow(u1)
+        db.session.commit()
+
+        graph = graph_store.graph()
+        self.assertEqual(len(graph), 3)
+        self.assertEqual(related_user_ids(u1, 'friends'), [u2.user_id])
+        self.assertEqual(related_user_ids(u1, 'followers'), [u3.user_id])
+
+        u1.apply_connections('befriend', [u3])
+        # Uncommitted changes are read from the database
+        self.assertEqual(
+            related_user_ids(u1, 'friends'), [u2.user_id, u3.user_id])
+        db.session.commit()
+
+        self.assertTrue(graph_store.graph() is graph)
+        self.assertEqual(
+            related_user_ids(u1, 'friends'), [u2.user_id, u3.user_id])
+        self.assertEqual(
+            common_friends_between(u2, [u1, u3]),
+            [(u1.user_id, [u3.user_id]), (u3.user_id, [])])
+        self.assertEqual(
+            common_friends_between(u1, [u2]), [(u2.user_id, [u3.user_id])])
+        self.assertEqual(
+            common_friends_between(u1, [u2], engine='sql'),
+            [(u2.user_id, [u3.user_id])])
+
+        u1.unfriend(u2)
+        db.session.rollback()
+        self.assertEqual(
+            related_user_ids(u1, 'friends'), [u2.user_id, u3.user_id])
+
+    def test_first_load_with_pending_changes(self):
+        u1 = User(email='user1@test.com')
+        u2 = User(email='user2@test.com')
+        db.session.add_all([u1, u2])
+        db.session.commit()
+        u1.befriend(u2)
+        self.assertEqual(related_user_ids(u1, 'friends'), [u2.user_id])
+        db.session.rollback()
+        # Loaded without the rolled back connection
+        self.assertEqual(len(graph_store.graph()), 0)
+        self.assertEqual(related_user_ids(u1, 'friends'), [])
+
+    def test_bulk_load(self):
+        u1 = User(email='user1@test.com')
+        u2 = User(email='user2@test.com')
+        db.session.add_all([u1, u2])
+        db.session.commit()
+        graph = graph_store.graph()
+        self.assertEqual(related_user_ids(u1, 'friends'), [])
+
+        # As `app.samples.snapshots.import_graph`
+        db.session.execute(connections.insert().values(
+            source_id=u1.user_id, target_id=u2.user_id, connection=FRIEND))
+        bump_versions([GRAPH_VERSION_KEY])
+        db.session.commit()
+        self.assertTrue(graph_store.graph() is graph)
+        g.pop('graph_version')
+        self.assertFalse(graph_store.graph() is graph)
+        self.assertEqual(related_user_ids(u1, 'friends'), [u2.user_id])
+
+
+class BloomFilterTest(TestCase):
+
+    def test_membership(self):
+        pairs = [(i, i * 7 % 1000) for i in range(1000)]
+        bloom = BloomFilter.from_pairs(pairs, error_rate=0.01)
+        self.assertEqual(len(bloom), 1000)
+        self.assertEqual(bloom.capacity, 2000)
+        for pair in pairs:
+            self.assertTrue(pair in bloom)
+        false_positives = sum(
+            1 for i in range(1000) if (i, i * 7 % 1000 + 1) in bloom)
+        self.assertLess(false_positives, 50)
+
+
+class BlockFilterConfig(TestConfig):
+    BLOCK_FILTER_ENABLED = True
+
+
+class BlockFilterTest(DBTest):
+
+    def create_app(self):
+        app = super(BlockFilterTest, self).create_app()
+        app.config.from_object(BlockFilterConfig)
+        return app
+
+    def test_block_filter(self):
+        u1 = User(email='user1@test.com')
+        u2 = User(email='user2@test.com')
+        u3 = User(email='user3@test.com')
+        db.session.add_all([u1, u2, u3])
+        db.session.flush()
+        u2.block(u1)
+        db.session.commit()
+        self.assertEqual(get_version(BLOCKS_VERSION_KEY), 1)
+
+        bloom = block_filter.bloom()
+        self.assertEqual(len(bloom), 1)
+        self.assertTrue(block_filter.might_block(u2.user_id, u1.user_id))
+        self.assertRaises(UserBlockedException, u1.befriend, u2)
+        u1.befriend(u3)
+        db.session.commit()
+        self.assertTrue(u1.is_friend_of(u3))
+
+        # Blocks of the session are checked before committed
+        u3.block(u1)
+        self.assertRaises(UserBlockedException, u1.follow, u3)
+        db.session.commit()
+        self.assertTrue(block_filter.bloom() is bloom)
+        self.assertEqual(len(bloom), 2)
+        self.assertTrue(block_filter.might_block(u3.user_id, u1.user_id))
+
+        # Blocks of other processes rebuild the filter
+        u3.unblock(u1)
+        db.session.commit()
+        g.pop('block_filter_versions')
+        db.session.execute(
+            'UPDATE versions SET version = version + 1 '
+            "WHERE key = 'blocks'")
+        self.assertFalse(block_filter.bloom() is bloom)
+        self.assertEqual(len(block_filter.bloom()), 1)
+        self.assertFalse(block_filter.might_block(u3.user_id, u1.user_id))
+        u1.follow(u3)
+        db.session.commit()
+        self.assertTrue(u1.is_following(u3))
+
+
+    def test_ruled_out_blocks_not_read(self):
+        u1 = User(email='user1@test.com')
+        u2 = User(email='user2@test.com')
+        u3 = User(email='user3@test.com')
+        db.session.add_all([u1, u2, u3])
+        db.session.flush()
+        u2.block(u1)
+        db.session.commit()
+
+        backend = storage.backend()
+        user_connections = backend.user_connections
+        incoming_reads = []
+
+        def spy(user_id, other_ids, incoming=True):
+            incoming_reads.append(incoming)
+            return user_connections(user_id, other_ids, incoming=incoming)
+
+        backend.user_connections = spy
+        try:
+            u1.follow(u3)
+            self.assertRaises(UserBlockedException, u1.follow, u2)
+        finally:
+            del backend.user_connections
+        self.assertEqual(incoming_reads, [False, True])
+
+    def test_disabled(self):
+        self.app.config['BLOCK_FILTER_ENABLED'] = False
+        u1 = User(email='user1@test.com')
+        u2 = User(email='user2@test.com')
+        db.session.add_all([u1, u2])
+        db.session.flush()
+        u2.block(u1)
+        db.session.commit()
+        # No version bumped for a filter never used
+        self.assertEqual(get_version(BLOCKS_VERSION_KEY), 0)
+        self.assertRaises(UserBlockedException, u1.befriend, u2)
+
+class GraphSnapshotTest(DBTest):
+
+    def create_app(self):
+        app = super(GraphSnapshotTest, self).create_app()
+        app.config.from_object(GraphStoreConfig)
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+        os.remove(self.path)
+        app.config['GRAPH_STORE_SNAPSHOT'] = self.path
+        app.config['GRAPH_STORE_REFRESH_INTERVAL'] = 60
+        return app
+
+    def tearDown(self):
+        super(GraphSnapshotTest, self).tearDown()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def test_graph_snapshot(self):
+        u1 = User(email='user1@test.com')
+        u2 = User(email='user2@test.com')
+        u3 = User(email='user3@test.com')
+        db.session.add_all([u1, u2, u3])
+        db.session.flush()
+        u1.befriend(u2)
+        db.session.commit()
+        self.assertEqual(graph_store.save_snapshot(), 1)
+
+        graph = graph_store.graph()
+        self.assertIsInstance(graph.forward.neighbors, memoryview)
+        self.assertEqual(related_user_ids(u1, 'friends'), [u2.user_id])
+
+        u1.befriend(u3)
+        db.session.commit()
+        state = self.app.extensions['graph_store']
+        self.assertEqual(len(state.deltas), 1)
+        self.assertEqual(
+            related_user_ids(u1, 'friends'), [u2.user_id, u3.user_id])
+
+        # Refreshed once a newer snapshot is saved
+        self.assertTrue(graph_store.graph() is graph)
+        graph_store.save_snapshot()
+        state.loaded_at = 0
+        self.assertFalse(graph_store.graph() is graph)
+        self.assertEqual(state.deltas, [])
+        self.assertEqual(
+            related_user_ids(u1, 'friends'), [u2.user_id, u3.user_id])
+
+    def test_max_deltas(self):
+        self.app.config['GRAPH_STORE_MAX_DELTAS'] = 0
+        u1 = User(email='user1@test.com')
+        u2 = User(email='user2@test.com')
+        u3 = User(email='user3@test.com')
+        db.session.add_all([u1, u2, u3])
+        db.session.commit()
+        graph_store.save_snapshot()
+        graph = graph_store.graph()
+        self.assertIsInstance(graph.forward.neighbors, memoryview)
+
+        u1.befriend(u2)
+        db.session.commit()
+        state = self.app.extensions['graph_store']
+        self.assertIsNone(state.graph)
+        self.assertEqual(state.deltas, [])
+
+        # Reloaded from the storage until a newer snapshot is saved
+        graph = graph_store.graph()
+        self.assertNotIsInstance(graph.forward.neighbors, memoryview)
+        self.assertEqual(related_user_ids(u1, 'friends'), [u2.user_id])
+        u1.befriend(u3)
+        db.session.commit()
+        self.assertTrue(graph_store.graph() is graph)
+        self.assertEqual(state.deltas, [])
+        self.assertEqual(
+            related_user_ids(u1, 'friends'), [u2.user_id, u3.user_id])
+
+        graph_store.save_snapshot()
+        state.loaded_at = 0
+        graph = graph_store.graph()
+        self.assertIsInstance(graph.forward.neighbors, memoryview)
+        self.assertEqual(
+            related_user_ids(u1, 'friends'), [u2.user_id, u3.user_id])
+
+    def test_bulk_load(self):
+        u1 = User(email='user1@test.com')
+        u2 = User(email='user2@test.com')
+        db.session.add_all([u1, u2])
+        db.session.commit()
+        graph_store.save_snapshot()
+        graph = graph_store.graph()
+        self.assertIsInstance(graph.forward.neighbors, memoryview)
+
+        db.session.execute(connections.insert().values(
+            source_id=u1.user_id, target_id=u2.user_id, connection=FRIEND))
+        bump_versions([GRAPH_VERSION_KEY])
+        db.session.commit()
+        g.pop('graph_version')
+        # The snapshot predates the bulk load
+        graph = graph_store.graph()
+        self.assertNotIsInstance(graph.forward.neighbors, memoryview)
+        self.assertEqual(related_user_ids(u1, 'friends'), [u2.user_id])
+
+        graph_store.save_snapshot()
+        self.app.extensions['graph_store'].loaded_at = 0
+        graph = graph_store.graph()
+        self.assertIsInstance(graph.forward.neighbors, memoryview)
+        self.assertEqual(related_user_ids(u1, 'friends'), [u2.user_id])
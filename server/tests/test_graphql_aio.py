@@ -0,0 +1,44 @@
+from .utils import DBTest
+from app.models import db, User
+import json
+
+QUERY = '''
+{
+  allUsers {
+    edges {
+      node {
+        userId
+        isFriendOfMe
+        followsMe
+        commonFriendsWithMe { userId }
+        friends { edges { node { userId } } }
+      }
+    }
+  }
+}
+'''
+
+
+class AsyncioExecutorTest(DBTest):
+
+    def query(self, executor):
+        self.app.config['GRAPHQL_EXECUTOR'] = executor
+        response = self.client.post(
+            '/graphql', data=json.dumps(dict(query=QUERY)),
+            content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.data.decode())
+
+    def test_asyncio_executor(self):
+        users = [User(email='user{}@test.com'.format(i)) for i in range(4)]
+        db.session.add_all(users)
+        db.session.flush()
+        u1, u2, u3, u4 = users
+        u1.apply_connections('befriend', [u2, u3])
+        u2.apply_connections('befriend', [u1, u3])
+        u3.apply_connections('befriend', [u4]).follow(u1)
+        db.session.commit()
+
+        result = self.query('asyncio')
+        self.assertNotIn('errors', result)
+        self.assertEqual(result, self.query('sync'))
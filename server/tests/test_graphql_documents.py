@@ -0,0 +1,55 @@
+from .utils import DBTest
+from app.graphql.documents import (
+    document_cache, document_id_of, PERSISTED_QUERY_NOT_FOUND
+)
+from app.models import db, User
+import json
+import os
+import tempfile
+
+QUERY = '{ me { userId } }'
+
+
+class DocumentCacheTest(DBTest):
+
+    def create_app(self):
+        app = super(DocumentCacheTest, self).create_app()
+        fd, self.persisted_queries = tempfile.mkstemp(suffix='.json')
+        with os.fdopen(fd, 'w') as fp:
+            json.dump({document_id_of(QUERY): QUERY}, fp)
+        app.config['GRAPHQL_PERSISTED_QUERIES'] = self.persisted_queries
+        document_cache.init_app(app)
+        return app
+
+    def tearDown(self):
+        super(DocumentCacheTest, self).tearDown()
+        os.remove(self.persisted_queries)
+
+    def post(self, **data):
+        response = self.client.post(
+            '/graphql', data=json.dumps(data),
+            content_type='application/json')
+        return response.status_code, json.loads(response.data.decode())
+
+    def test_documents(self):
+        user = User(email='user1@test.com')
+        db.session.add(user)
+        db.session.commit()
+        # Primary keys are of the `ID` type, i.e. strings
+        expected = {'data': {'me': {'userId': str(user.user_id)}}}
+
+        self.assertEqual(self.post(query=QUERY), (200, expected))
+        self.assertEqual(self.post(query=QUERY), (200, expected))
+        self.assertEqual(document_cache.stats()['hits'], 1)
+
+        # Invalid documents are not cached
+        status, result = self.post(query='{ me { unknown } }')
+        self.assertEqual(status, 400)
+        self.assertEqual(document_cache.stats()['size'], 1)
+
+        self.assertEqual(
+            self.post(id=document_id_of(QUERY)), (200, expected))
+        status, result = self.post(id='unknown')
+        self.assertEqual(status, 400)
+        self.assertEqual(
+            result['errors'][0]['message'], PERSISTED_QUERY_NOT_FOUND)
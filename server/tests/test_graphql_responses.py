@@ -0,0 +1,95 @@
+from .utils import DBTest
+from app.graphql.responses import response_cache
+from app.models import db, User, get_versions, user_version_key
+from app.models.users import HEADER_CURRENT_USER_ID_KEY
+from flask import g
+import json
+
+QUERY = '''
+query Friends {
+  me {
+    fullName
+    friends(first: 10) {
+      edges { node { userId fullName isFriendOfMe } }
+    }
+  }
+}
+'''
+
+MUTATION = '''
+mutation Befriend($input: UserConnectionMutationInput!) {
+  befriend(input: $input) { users { userId } }
+}
+'''
+
+
+class ResponseCacheTest(DBTest):
+
+    def create_app(self):
+        app = super(ResponseCacheTest, self).create_app()
+        app.config['GRAPHQL_RESPONSE_CACHE_SIZE'] = 100
+        response_cache.init_app(app)
+        return app
+
+    def post(self, viewer, query, **variables):
+        # The app context, thus `g`, is shared by the requests of the test
+        g.pop('current_user_id', None)
+        g.pop('current_user', None)
+        response = self.client.post(
+            '/graphql',
+            data=json.dumps(dict(query=query, variables=variables)),
+            content_type='application/json',
+            headers={HEADER_CURRENT_USER_ID_KEY: str(viewer.user_id)})
+        result = json.loads(response.data.decode())
+        self.assertNotIn('errors', result)
+        return result['data']
+
+    def friend_names(self, viewer):
+        data = self.post(viewer, QUERY)
+        return [
+            edge['node']['fullName']
+            for edge in data['me']['friends']['edges']
+        ]
+
+    def test_responses(self):
+        u1 = User(email='user1@test.com', first_name='A', last_name='User')
+        u2 = User(email='user2@test.com', first_name='B', last_name='User')
+        u3 = User(email='user3@test.com', first_name='C', last_name='User')
+        db.session.add_all([u1, u2, u3])
+        db.session.flush()
+        u1.befriend(u2)
+        db.session.commit()
+
+        self.assertEqual(self.friend_names(u1), ['B User'])
+        self.assertEqual(self.friend_names(u1), ['B User'])
+        self.assertEqual(response_cache.stats()['hits'], 1)
+        # Cached per viewer
+        self.assertEqual(self.friend_names(u2), [])
+        self.assertEqual(response_cache.stats()['hits'], 1)
+
+        # Connection writes of the viewer invalidate
+        self.post(u1, MUTATION, input=dict(userId=[u3.user_id]))
+        self.assertEqual(self.friend_names(u1), ['B User', 'C User'])
+
+        # Profile writes of a resolved user invalidate
+        u2 = User.query.get(u2.user_id)
+        u2.first_name = 'D'
+        db.session.commit()
+        self.assertEqual(self.friend_names(u1), ['D User', 'C User'])
+        self.assertEqual(self.friend_names(u1), ['D User', 'C User'])
+        self.assertEqual(response_cache.stats()['hits'], 2)
+
+
+class DisabledResponseCacheTest(DBTest):
+
+    def test_versions_not_bumped(self):
+        u1 = User(email='user1@test.com')
+        u2 = User(email='user2@test.com')
+        db.session.add_all([u1, u2])
+        db.session.flush()
+        u1.befriend(u2)
+        db.session.commit()
+        keys = [user_version_key(u1), user_version_key(u2)]
+        self.assertEqual(get_versions(keys), dict.fromkeys(keys, 0))
+        # Still validates the index page
+        self.assertEqual(get_versions(['users']), {'users': 1})
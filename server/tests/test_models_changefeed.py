@@ -0,0 +1,116 @@
+from .utils import DBTest, SQLiteTestConfig
+from app.models import (
+    db, User, connection_events_after, iter_connection_events,
+    consume_connection_events, get_checkpoint, prune_connection_events,
+    ConnectionType
+)
+from sqlalchemy import func, select
+
+FRIEND = ConnectionType.FRIEND.value
+FOLLOW = ConnectionType.FOLLOW.value
+
+
+class ChangefeedTest(DBTest):
+
+    def setUp(self):
+        super(ChangefeedTest, self).setUp()
+        self.users = [
+            User(email='user{}@test.com'.format(i)) for i in range(3)]
+        db.session.add_all(self.users)
+        db.session.commit()
+
+    def test_events(self):
+        u1, u2, u3 = self.users
+        u1.befriend(u2)
+        u1.follow(u3)
+        db.session.commit()
+        u1.unfriend(u2)
+        u2.befriend(u3)
+        db.session.rollback()
+        u1.follow(u2)
+        db.session.commit()
+
+        events = connection_events_after()
+        self.assertEqual(
+            [(e.source_id, e.target_id, e.old, e.new) for e in events],
+            [
+                (u1.user_id, u2.user_id, 0, FRIEND),
+                (u1.user_id, u3.user_id, 0, FOLLOW),
+                (u1.user_id, u2.user_id, FRIEND, FRIEND | FOLLOW),
+            ])
+        self.assertEqual(
+            [e.seq for e in events], sorted(set(e.seq for e in events)))
+        self.assertEqual(
+            [(e.txid, e.seq) for e in events],
+            sorted((e.txid, e.seq) for e in events))
+        self.assertTrue(all(e.ts for e in events))
+        self.assertEqual(
+            connection_events_after((events[0].txid, events[0].seq)),
+            events[1:])
+        self.assertEqual(
+            list(iter_connection_events(batch_size=2)),
+            [events[:2], events[2:]])
+
+    def test_horizon(self):
+        if db.engine.dialect.name != 'postgresql':
+            self.skipTest('Transaction horizons are asserted on postgres')
+        u1, u2, _ = self.users
+        connection = db.engine.connect()
+        transaction = connection.begin()
+        try:
+            connection.execute(select([func.txid_current()]))
+            u1.befriend(u2)
+            db.session.commit()
+            # Committed after a transaction still in progress, which may
+            # append events before them
+            self.assertEqual(connection_events_after(), [])
+        finally:
+            transaction.rollback()
+            connection.close()
+        self.assertEqual(len(connection_events_after()), 1)
+
+    def test_consume(self):
+        u1, u2, u3 = self.users
+        u1.befriend(u2)
+        u1.befriend(u3)
+        db.session.commit()
+        consumed = []
+        self.assertEqual(
+            consume_connection_events('test', consumed.extend, batch_size=1),
+            2)
+        self.assertEqual(
+            [e.target_id for e in consumed], [u2.user_id, u3.user_id])
+        self.assertEqual(
+            get_checkpoint('test'), (consumed[-1].txid, consumed[-1].seq))
+
+        def fail(events):
+            raise ValueError()
+
+        u2.befriend(u3)
+        db.session.commit()
+        with self.assertRaises(ValueError):
+            consume_connection_events('test', fail)
+        db.session.rollback()
+        self.assertEqual(
+            get_checkpoint('test'), (consumed[-1].txid, consumed[-1].seq))
+        self.assertEqual(
+            consume_connection_events('test', consumed.extend), 1)
+        self.assertEqual(consumed[-1].source_id, u2.user_id)
+        self.assertEqual(consume_connection_events('test', fail), 0)
+
+        self.assertEqual(get_checkpoint('other'), (0, 0))
+        self.assertEqual(prune_connection_events(), 3)
+        db.session.commit()
+        self.assertEqual(connection_events_after(), [])
+
+        # Events appended once pruned are after the checkpoints
+        u3.befriend(u1)
+        db.session.commit()
+        self.assertEqual(
+            consume_connection_events('test', consumed.extend), 1)
+        self.assertEqual(consumed[-1].source_id, u3.user_id)
+
+
+class SQLiteChangefeedTest(ChangefeedTest):
+
+    config_class = SQLiteTestConfig
@@ -0,0 +1,39 @@
+from .utils import DBTest
+from app.models import db, User, replica_reads, reads_from_replica
+from app.models.core import REPLICA_BIND_KEY
+from sqlalchemy import select
+
+
+class RoutingSessionTest(DBTest):
+
+    def create_app(self):
+        app = super(RoutingSessionTest, self).create_app()
+        # A distinct engine to the same database is enough to test routing
+        app.config['SQLALCHEMY_BINDS'] = {
+            REPLICA_BIND_KEY: app.config['SQLALCHEMY_DATABASE_URI']
+        }
+        return app
+
+    def setUp(self):
+        super(RoutingSessionTest, self).setUp()
+        if db.engine.dialect.name != 'postgresql':
+            # e.g. each in-memory SQLite engine has its own database
+            self.skipTest('Replicas are tested on postgres')
+
+    def test_routing(self):
+        replica = db.get_engine(self.app, bind=REPLICA_BIND_KEY)
+        stmt = select([User.__table__.c.user_id])
+
+        self.assertIsNot(db.session.get_bind(clause=stmt), replica)
+        with replica_reads():
+            self.assertTrue(reads_from_replica())
+            self.assertIs(db.session.get_bind(clause=stmt), replica)
+            self.assertEqual(User.query.count(), 0)
+
+            db.session.add(User(email='user1@test.com'))
+            db.session.flush()
+            # Reads its own writes
+            self.assertFalse(reads_from_replica())
+            self.assertIsNot(db.session.get_bind(clause=stmt), replica)
+            self.assertEqual(User.query.count(), 1)
+        self.assertFalse(reads_from_replica())
@@ -0,0 +1,55 @@
+from .utils import DBTest, SQLiteTestConfig
+from app.models import db, User, degrees_of, reconcile_degrees
+from app.models.degrees import user_degrees
+
+
+class DegreesTest(DBTest):
+
+    def test_degrees(self):
+        users = [User(email='user{}@test.com'.format(i)) for i in range(4)]
+        db.session.add_all(users)
+        db.session.flush()
+        u1, u2, u3, u4 = users
+        u1.befriend(u2)
+        u1.befriend(u3)
+        u4.follow(u1)
+        db.session.commit()
+
+        degrees = degrees_of([u1.user_id, u2.user_id, u4.user_id])
+        self.assertEqual(degrees[u1.user_id], dict(
+            friends=2, following=0, followers=1, subscribers=1))
+        # Friendships are one way, befriended users are subscribers
+        self.assertEqual(degrees[u2.user_id], dict(
+            friends=0, following=0, followers=0, subscribers=1))
+        self.assertEqual(degrees[u4.user_id], dict(
+            friends=0, following=1, followers=0, subscribers=0))
+
+        u1.unfriend(u3)
+        db.session.commit()
+        self.assertEqual(
+            degrees_of([u3.user_id])[u3.user_id]['subscribers'], 0)
+        self.assertEqual(degrees_of([u1.user_id])[u1.user_id]['friends'], 1)
+        self.assertEqual(reconcile_degrees(), 0)
+
+    def test_reconcile(self):
+        u1 = User(email='user1@test.com')
+        u2 = User(email='user2@test.com')
+        db.session.add_all([u1, u2])
+        db.session.flush()
+        u1.befriend(u2)
+        db.session.commit()
+
+        db.session.execute(
+            user_degrees.update().
+            where(user_degrees.c.user_id == u1.user_id).
+            values(friends=5, followers=1))
+        self.assertEqual(reconcile_degrees(), 1)
+        db.session.commit()
+        self.assertEqual(degrees_of([u1.user_id])[u1.user_id], dict(
+            friends=1, following=0, followers=0, subscribers=0))
+        self.assertEqual(reconcile_degrees(), 0)
+
+
+class SQLiteDegreesTest(DegreesTest):
+
+    config_class = SQLiteTestConfig
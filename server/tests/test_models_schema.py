@@ -0,0 +1,93 @@
+from .utils import DBTest
+from app.models import (
+    db, User, connections, upgrade_schema, ConnectionType,
+    RELATIONSHIP_INDEXES, DROPPED_INDEXES
+)
+from app.models.storage.sql import (
+    common_friends_select, friend_edges_select, related_user_ids_select
+)
+
+FRIEND = ConnectionType.FRIEND.value
+FOLLOW = ConnectionType.FOLLOW.value
+BLOCK = ConnectionType.BLOCK.value
+
+PRIMARY_KEY = 'connections_pkey'
+
+
+class QueryPlanTest(DBTest):
+    """Catches planner regressions of the hot connection queries, which
+    must be served by the indexes of `connections`."""
+
+    def setUp(self):
+        super(QueryPlanTest, self).setUp()
+        if db.engine.dialect.name != 'postgresql':
+            self.skipTest('Query plans are asserted on postgres')
+        db.session.add_all([
+            User(email='user{}@test.com'.format(i)) for i in range(1, 201)
+        ])
+        db.session.flush()
+        # Mostly friends, followers and blocks are rare
+        db.session.execute(connections.insert(), [
+            dict(source_id=source_id, target_id=target_id, connection=(
+                BLOCK if (source_id + target_id) % 50 == 0 else
+                FOLLOW if (source_id + target_id) % 10 == 0 else FRIEND))
+            for source_id in range(1, 201)
+            for target_id in range(source_id + 1, min(source_id + 30, 201))
+        ])
+        db.session.execute('ANALYZE connections')
+        # Small tables are scanned whatever the indexes, the plans then
+        # assert which index the planner prefers
+        db.session.execute('SET LOCAL enable_seqscan = off')
+
+    def explain(self, stmt):
+        sql = str(stmt.compile(
+            dialect=db.engine.dialect, compile_kwargs={'literal_binds': True}))
+        return '\n'.join(
+            line for line, in db.session.execute('EXPLAIN ' + sql))
+
+    def assertIndexScan(self, stmt, index):
+        plan = self.explain(stmt)
+        self.assertNotIn('Seq Scan on connections', plan)
+        # e.g. `Index Only Scan using ix on connections` or the index of
+        # a bitmap scan, `Bitmap Index Scan on ix`
+        self.assertRegex(
+            plan, r'(Index (Only )?Scan using|Bitmap Index Scan on) {}\b'.
+            format(index))
+
+    def test_relationships(self):
+        for relationship in ('followers', 'subscribers', 'blocked'):
+            stmt, _ = related_user_ids_select(10, relationship)
+            self.assertIndexScan(
+                stmt, RELATIONSHIP_INDEXES[relationship].name)
+        stmt, _ = related_user_ids_select(10, 'friends')
+        self.assertIndexScan(stmt, RELATIONSHIP_INDEXES['friends'].name)
+        for relationship in ('following', 'subscribing'):
+            stmt, _ = related_user_ids_select(10, relationship)
+            self.assertIndexScan(stmt, PRIMARY_KEY)
+        user = User.query.get(10)
+        self.assertIndexScan(
+            user.followers.statement,
+            RELATIONSHIP_INDEXES['followers'].name)
+        self.assertIndexScan(
+            user.subscribers.statement,
+            RELATIONSHIP_INDEXES['subscribers'].name)
+
+    def test_friends(self):
+        index = RELATIONSHIP_INDEXES['friends'].name
+        self.assertIndexScan(common_friends_select(10, [11, 12, 13]), index)
+        self.assertIndexScan(friend_edges_select([10, 11, 12]), index)
+
+
+class UpgradeSchemaTest(DBTest):
+
+    def test_upgrade_schema(self):
+        self.assertEqual(upgrade_schema(DROPPED_INDEXES), ([], []))
+        index = RELATIONSHIP_INDEXES['followers']
+        index.drop(db.engine)
+        # The index on the flags of the previous schema
+        db.engine.execute(
+            'CREATE INDEX {} ON connections (connection)'.format(
+                DROPPED_INDEXES[0]))
+        self.assertEqual(
+            upgrade_schema(DROPPED_INDEXES),
+            ([index.name], [DROPPED_INDEXES[0]]))
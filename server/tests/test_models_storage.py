@@ -0,0 +1,78 @@
+from .utils import DBTest, SQLiteTestConfig
+from app.models import (
+    db, User, storage, common_friends_between, related_user_ids,
+    ConnectionChange, ConnectionType
+)
+
+
+class StorageTests(object):
+    """The tests of each `ConnectionStorage`, of the `backend` storage."""
+
+    backend = None
+
+    def create_app(self):
+        app = super(StorageTests, self).create_app()
+        app.config['STORAGE_BACKEND'] = self.backend
+        storage.init_app(app)
+        return app
+
+    def test_connections(self):
+        users = [User(email='user{}@test.com'.format(i)) for i in range(4)]
+        db.session.add_all(users)
+        db.session.flush()
+        u1, u2, u3, u4 = users
+        self.assertEqual(storage.backend().name, self.backend)
+
+        u1.befriend(u2)
+        u1.befriend(u3)
+        u4.befriend(u2)
+        u4.follow(u1)
+        # Reads the uncommitted writes of the session
+        self.assertTrue(u1.is_friend_of(u2))
+        db.session.commit()
+
+        # Friendships are one way
+        self.assertFalse(u2.is_friend_of(u1))
+        self.assertEqual(related_user_ids(u1, 'friends'),
+                         [u2.user_id, u3.user_id])
+        self.assertEqual(related_user_ids(u1, 'followers'), [u4.user_id])
+        self.assertEqual(common_friends_between(u1, [u4]),
+                         [(u4.user_id, [u2.user_id])])
+
+        u1.unfriend(u3)
+        db.session.rollback()
+        self.assertTrue(u1.is_friend_of(u3))
+
+        u1.unfriend(u3)
+        db.session.commit()
+        self.assertFalse(u1.is_friend_of(u3))
+        self.assertEqual(list(storage.backend().edges()), [
+            (u1.user_id, u2.user_id, 1),
+            (u4.user_id, u1.user_id, 2),
+            (u4.user_id, u2.user_id, 1),
+        ])
+
+
+class MemoryStorageTest(StorageTests, DBTest):
+
+    backend = 'memory'
+
+    def test_concurrent_changes(self):
+        friend = ConnectionType.FRIEND.value
+        follow = ConnectionType.FOLLOW.value
+        # Committed by sessions which both read no connection
+        storage.backend().apply([ConnectionChange(1, 2, 0, friend)])
+        storage.backend().apply([ConnectionChange(1, 2, 0, follow)])
+        self.assertEqual(
+            list(storage.backend().edges()), [(1, 2, friend | follow)])
+
+        storage.backend().apply([ConnectionChange(1, 2, friend, 0)])
+        self.assertEqual(list(storage.backend().edges()), [(1, 2, follow)])
+        storage.backend().apply([ConnectionChange(1, 2, follow, 0)])
+        self.assertEqual(list(storage.backend().edges()), [])
+
+
+class SQLiteStorageTest(StorageTests, DBTest):
+
+    config_class = SQLiteTestConfig
+    backend = 'sqlite'
@@ -0,0 +1,68 @@
+from .utils import DBTest, SQLiteTestConfig
+from app.models import db, User, suggested_friend_ids
+from app.models.suggestions import (
+    friend_suggestions, stale_friend_suggestions
+)
+
+
+class SuggestionsModelTest(DBTest):
+
+    def test_suggested_friends(self):
+        u1 = User(email='user1@test.com')
+        u2 = User(email='user2@test.com')
+        u3 = User(email='user3@test.com')
+        u4 = User(email='user4@test.com')
+        u5 = User(email='user5@test.com')
+        for user in (u1, u2, u3, u4, u5):
+            db.session.add(user)
+        db.session.flush()
+        u1.apply_connections('befriend', [u2, u3])
+        u2.apply_connections('befriend', [u1, u4, u5])
+        u3.apply_connections('befriend', [u4])
+        db.session.commit()
+
+        self.assertEqual(
+            suggested_friend_ids(u1), [u4.user_id, u5.user_id])
+        self.assertEqual(suggested_friend_ids(u1, 1), [u4.user_id])
+        self.assertEqual(suggested_friend_ids(u4), [])
+
+        u5.block(u1)
+        db.session.commit()
+        self.assertEqual(suggested_friend_ids(u1), [u4.user_id])
+
+        u1.befriend(u4)
+        db.session.commit()
+        self.assertEqual(suggested_friend_ids(u1), [])
+
+        u4.befriend(u1)
+        db.session.commit()
+        self.assertEqual(suggested_friend_ids(u4), [u2.user_id, u3.user_id])
+
+        # Changes to u1 friends also refresh the suggestions of u4, who
+        # befriended u1
+        u1.unfriend(u3)
+        db.session.commit()
+        self.assertEqual(suggested_friend_ids(u4), [u2.user_id])
+
+    def test_never_computed(self):
+        u1 = User(email='user1@test.com')
+        u2 = User(email='user2@test.com')
+        u3 = User(email='user3@test.com')
+        db.session.add_all([u1, u2, u3])
+        db.session.flush()
+        u1.befriend(u2)
+        u2.befriend(u3)
+        db.session.commit()
+        # e.g. loaded in bulk, neither computed nor marked as stale
+        db.session.execute(friend_suggestions.delete())
+        db.session.execute(stale_friend_suggestions.delete())
+        db.session.commit()
+
+        self.assertEqual(suggested_friend_ids(u1), [u3.user_id])
+        self.assertEqual(
+            db.session.query(stale_friend_suggestions).count(), 0)
+
+
+class SQLiteSuggestionsModelTest(SuggestionsModelTest):
+
+    config_class = SQLiteTestConfig
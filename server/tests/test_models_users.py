@@ -1,5 +1,8 @@
-from .utils import DBTest
-from app.models import db, User, common_friends_between
+from .utils import DBTest, SQLiteTestConfig
+from app.models import (
+    db, User, common_friends_between, connections_both_ways,
+    related_user_ids, related_user_ids_of, iter_subscriber_ids
+)
 from app.errors import UserBlockedException
 from app.logging import logger  # noqa
 
@@ -171,3 +174,151 @@ class UserModelTest(DBTest):
         # u5 common friends
         self.assertEqual(friends[3][0], 5)
         self.assertEqual(friends[3][1], [2, 3, 4])
+
+        friends = common_friends_between(1, [2, 3, 4, 5], engine='vector')
+        self.assertEqual(
+            friends, [(2, [3]), (3, [2]), (4, []), (5, [2, 3, 4])])
+
+    def test_apply_connections(self):
+        u1 = User(email='user1@test.com')
+        u2 = User(email='user2@test.com')
+        u3 = User(email='user3@test.com')
+        u4 = User(email='user4@test.com')
+        db.session.add(u1)
+        db.session.add(u2)
+        db.session.add(u3)
+        db.session.add(u4)
+        db.session.flush()
+        u1.follow(u2)
+        u1.apply_connections('befriend', [u2, u3.user_id, u3])
+        db.session.commit()
+
+        self.assertTrue(u1.is_friend_of(u2))
+        self.assertTrue(u1.is_friend_of(u3))
+        self.assertTrue(u1.is_following(u2))
+        self.assertFalse(u1.is_friend_of(u4))
+        self.assertEqual(set(u1.friends.all()), set([u2, u3]))
+
+        u1.apply_connections('unfriend', [u2, u3, u4])
+        db.session.commit()
+
+        self.assertFalse(u1.is_friend_of(u2))
+        self.assertFalse(u1.is_friend_of(u3))
+        self.assertTrue(u1.is_following(u2))
+        self.assertEqual(u1.friends.all(), [])
+
+        # Blocked users are rejected as a whole
+        u4.block(u1)
+        db.session.commit()
+        with self.assertRaises(UserBlockedException):
+            u1.apply_connections('follow', [u3, u4])
+        db.session.rollback()
+        self.assertFalse(u3 in u1.following.all())
+        with self.assertRaises(AssertionError):
+            u1.apply_connections('follow', [u1])
+
+    def test_related_user_ids(self):
+        users = [User(email='user{}@test.com'.format(i)) for i in range(6)]
+        for user in users:
+            db.session.add(user)
+        db.session.flush()
+        u1 = users[0]
+        user_ids = [user.user_id for user in users[1:]]
+        u1.apply_connections('follow', user_ids)
+        for user in users[1:4]:
+            user.follow(u1)
+        db.session.commit()
+
+        self.assertEqual(related_user_ids(u1, 'following'), user_ids)
+        self.assertEqual(related_user_ids(u1, 'followers'), user_ids[:3])
+        self.assertEqual(related_user_ids(u1, 'friends'), [])
+        self.assertEqual(
+            related_user_ids(u1, 'following', after=user_ids[1], limit=2),
+            user_ids[2:4])
+        self.assertEqual(
+            related_user_ids(
+                u1, 'following', before=user_ids[3], limit=2,
+                descending=True),
+            [user_ids[2], user_ids[1]])
+        self.assertEqual(
+            related_user_ids(
+                users[2], 'followers', after=user_ids[0], before=user_ids[0]),
+            [])
+
+    def test_related_user_ids_of(self):
+        users = [User(email='user{}@test.com'.format(i)) for i in range(5)]
+        for user in users:
+            db.session.add(user)
+        db.session.flush()
+        u1, u2, u3, u4, u5 = users
+        u1.apply_connections('befriend', [u2, u3, u4])
+        u2.apply_connections('befriend', [u1, u5])
+        u3.follow(u1)
+        db.session.commit()
+
+        self.assertEqual(
+            related_user_ids_of(
+                [u1.user_id, u2.user_id, u3.user_id], 'friends'), {
+                u1.user_id: [u2.user_id, u3.user_id, u4.user_id],
+                u2.user_id: [u1.user_id, u5.user_id],
+                u3.user_id: [],
+            })
+        self.assertEqual(
+            related_user_ids_of(
+                [u1.user_id, u2.user_id], 'friends', after=u2.user_id,
+                limit=1), {
+                u1.user_id: [u3.user_id],
+                u2.user_id: [u5.user_id],
+            })
+        self.assertEqual(
+            related_user_ids_of([u1.user_id], 'friends', descending=True),
+            {u1.user_id: [u4.user_id, u3.user_id, u2.user_id]})
+        self.assertEqual(
+            related_user_ids_of([u1.user_id], 'followers'),
+            {u1.user_id: [u3.user_id]})
+
+    def test_iter_subscriber_ids(self):
+        users = [User(email='user{}@test.com'.format(i)) for i in range(6)]
+        for user in users:
+            db.session.add(user)
+        db.session.flush()
+        u1 = users[0]
+        users[1].befriend(u1)
+        users[2].follow(u1)
+        users[3].befriend(u1).block(u1)
+        users[4].follow(u1)
+        u1.befriend(users[5])
+        db.session.commit()
+
+        user_ids = [users[i].user_id for i in (1, 2, 4)]
+        self.assertEqual(
+            list(iter_subscriber_ids(u1, batch_size=2)),
+            [user_ids[:2], user_ids[2:]])
+        self.assertEqual(list(iter_subscriber_ids(users[5])), [[u1.user_id]])
+        self.assertEqual(list(iter_subscriber_ids(users[1])), [])
+
+    def test_connections_both_ways(self):
+        u1 = User(email='user1@test.com')
+        u2 = User(email='user2@test.com')
+        u3 = User(email='user3@test.com')
+        u4 = User(email='user4@test.com')
+        for user in (u1, u2, u3, u4):
+            db.session.add(user)
+        db.session.flush()
+        u1.befriend(u2)
+        u2.befriend(u1).follow(u1)
+        u3.block(u1)
+        db.session.commit()
+
+        self.assertEqual(
+            connections_both_ways(u1, [u1, u2, u3, u4]), {
+                u1.user_id: (0, 0),
+                u2.user_id: (1, 3),
+                u3.user_id: (0, 4),
+                u4.user_id: (0, 0),
+            })
+
+
+class SQLiteUserModelTest(UserModelTest):
+
+    config_class = SQLiteTestConfig
@@ -0,0 +1,126 @@
+from unittest import TestCase
+from .utils import DBTest, TestConfig
+from app.models import db, User
+from app.profiling import RequestProfile
+import json
+
+QUERY = '''
+{
+  allUsers(first: 10) {
+    edges {
+      node {
+        userId
+        isFriendOfMe
+        commonFriendsWithMe { userId }
+      }
+    }
+  }
+}
+'''
+
+
+class RequestProfileTest(TestCase):
+
+    def test_report(self):
+        profile = RequestProfile(n_slowest=2)
+        profile.record_statement('SELECT 1', 0.001)
+        with profile.resolving('Query.allUsers'):
+            profile.record_statement('SELECT 2', 0.003)
+            profile.record_statement('SELECT 3', 0.002)
+        profile.record_load('UserLoader', False)
+        profile.record_load('UserLoader', True)
+        profile.record_batch('UserLoader', 1)
+        report = profile.report()
+        self.assertEqual(report['sql']['count'], 3)
+        self.assertEqual(report['sql']['paths']['Query.allUsers']['count'], 2)
+        self.assertEqual(
+            [s['statement'] for s in report['sql']['slowest']],
+            ['SELECT 2', 'SELECT 3'])
+        self.assertEqual(report['loaders']['UserLoader'], {
+            'loads': 2, 'hits': 1, 'hitRate': 0.5, 'batchSizes': [1]})
+
+
+class ProfilingConfig(TestConfig):
+    PROFILING_ENABLED = True
+
+
+class ProfilingTest(DBTest):
+
+    def create_app(self):
+        app = super(ProfilingTest, self).create_app()
+        app.config.from_object(ProfilingConfig)
+        return app
+
+    def test_graphql_extensions(self):
+        u1 = User(email='user1@test.com')
+        u2 = User(email='user2@test.com')
+        u3 = User(email='user3@test.com')
+        db.session.add_all([u1, u2, u3])
+        db.session.commit()
+        u1.befriend(u2)
+        u3.befriend(u2)
+        db.session.commit()
+
+        response = self.client.post(
+            '/graphql', data=json.dumps(dict(query=QUERY)),
+            content_type='application/json',
+            headers={'x-app-current-user-id': str(u1.user_id)})
+        self.assertIn('db;dur=', response.headers['Server-Timing'])
+        profile = json.loads(response.data.decode())['extensions']['profile']
+        self.assertGreater(profile['sql']['count'], 0)
+        self.assertIn('Query.allUsers', profile['sql']['paths'])
+        self.assertIn(
+            'CurrentUserCommonFriendIdsLoader', profile['sql']['paths'])
+        self.assertEqual(
+            profile['loaders']['CurrentUserConnectionLoader']['batchSizes'],
+            [3])
+        self.assertEqual(
+            profile['loaders']['UserLoader']['batchSizes'], [1])
+
+    def test_related_users_loaders(self):
+        users = [User(email='user{}@test.com'.format(i)) for i in range(4)]
+        db.session.add_all(users)
+        db.session.flush()
+        u1, u2, u3, u4 = users
+        u1.apply_connections('befriend', [u2, u3])
+        u2.apply_connections('befriend', [u1, u3])
+        u3.apply_connections('befriend', [u4])
+        db.session.commit()
+
+        query = '''
+        {
+          allUsers {
+            edges {
+              node {
+                userId
+                friends(first: 1) {
+                  edges { node { userId } }
+                  pageInfo { hasNextPage }
+                }
+              }
+            }
+          }
+        }
+        '''
+        response = self.client.post(
+            '/graphql', data=json.dumps(dict(query=query)),
+            content_type='application/json')
+        data = json.loads(response.data.decode())
+        friends = dict(
+            (node['userId'], (
+                [e['node']['userId'] for e in node['friends']['edges']],
+                node['friends']['pageInfo']['hasNextPage']))
+            for node in (
+                edge['node'] for edge in data['data']['allUsers']['edges'])
+        )
+        # Primary keys are of the `ID` type, i.e. strings
+        self.assertEqual(friends, {
+            str(u1.user_id): ([str(u2.user_id)], True),
+            str(u2.user_id): ([str(u1.user_id)], True),
+            str(u3.user_id): ([str(u4.user_id)], False),
+            str(u4.user_id): ([], False),
+        })
+        loaders = data['extensions']['profile']['loaders']
+        self.assertEqual(
+            loaders['RelatedUserIdsLoader.friends']['batchSizes'], [4])
+        self.assertEqual(len(loaders['UserLoader']['batchSizes']), 1)
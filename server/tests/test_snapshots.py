@@ -0,0 +1,65 @@
+from io import BytesIO
+from unittest import TestCase
+from .utils import DBTest
+from app.graph.edgelist import COMPRESSIONS, read_edges, write_edges
+from app.models import db, User, connections_between, related_user_ids
+from app.samples.snapshots import export_graph, import_graph
+
+
+class EdgeListTest(TestCase):
+
+    def test_round_trip(self):
+        for compression in COMPRESSIONS:
+            for n in (0, 4, 10):
+                edges = [(i, i * 3, i % 7) for i in range(1, n + 1)]
+                fp = BytesIO()
+                self.assertEqual(write_edges(
+                    fp, edges, chunk_size=4, compression=compression), n)
+                fp.seek(0)
+                chunks = list(read_edges(fp))
+                self.assertEqual(
+                    [len(chunk[0]) for chunk in chunks],
+                    [4, 4, 2][:(n + 3) // 4])
+                self.assertEqual(
+                    [edge for chunk in chunks for edge in zip(*chunk)],
+                    edges)
+
+    def test_truncated(self):
+        fp = BytesIO()
+        write_edges(fp, [(1, 2, 1)])
+        with self.assertRaises(AssertionError):
+            list(read_edges(BytesIO(fp.getvalue()[:-3])))
+
+
+class SnapshotTest(DBTest):
+
+    def setUp(self):
+        super(SnapshotTest, self).setUp()
+        if db.engine.dialect.name != 'postgresql':
+            self.skipTest('Graphs are imported into postgres only')
+
+    def test_export_import(self):
+        u1 = User(email='user1@test.com')
+        u2 = User(email='user2@test.com')
+        u3 = User(email='user3@test.com')
+        db.session.add_all([u1, u2, u3])
+        db.session.flush()
+        u1.befriend(u2)
+        u1.follow(u3)
+        u3.block(u2)
+        db.session.commit()
+        expected = connections_between(u1, [u2, u3])
+
+        fp = BytesIO()
+        self.assertEqual(export_graph(fp, chunk_size=2), 3)
+        u1.unfriend(u2)
+        u2.befriend(u3)
+        db.session.commit()
+
+        fp.seek(0)
+        self.assertEqual(import_graph(fp), 3)
+        db.session.commit()
+        db.session.expire_all()
+        self.assertEqual(connections_between(u1.user_id, [u2, u3]), expected)
+        self.assertEqual(related_user_ids(u2, 'friends'), [])
+        self.assertEqual(related_user_ids(u3, 'blocked'), [u2.user_id])
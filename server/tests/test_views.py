@@ -0,0 +1,85 @@
+from .utils import DBTest
+from app.blueprints import views
+from app.models import db, User, get_version
+import json
+import re
+
+
+class IndexViewTest(DBTest):
+
+    def embedded_users(self, response):
+        match = re.search(
+            r'var __users__ = (.*);', response.data.decode(), re.MULTILINE)
+        return json.loads(match.group(1))
+
+    def test_index(self):
+        db.session.add(User(
+            email='user1@test.com', first_name='B', last_name='User'))
+        db.session.add(User(
+            email='user2@test.com', first_name='A', last_name='User'))
+        db.session.commit()
+
+        response = self.client.get('/')
+        self.assertEqual(response.status_code, 200)
+        etag, _ = response.get_etag()
+        self.assertTrue(etag)
+        self.assertEqual(
+            [user['fullName'] for user in self.embedded_users(response)],
+            ['A User', 'B User'])
+
+        response = self.client.get('/', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.get_etag(), (etag, False))
+
+        user = User.query.filter_by(email='user1@test.com').one()
+        user.first_name = 'C'
+        db.session.commit()
+
+        response = self.client.get('/', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.get_etag()[0], etag)
+        self.assertEqual(
+            [user['fullName'] for user in self.embedded_users(response)],
+            ['A User', 'C User'])
+
+    def test_index_build_version(self):
+        response = self.client.get('/')
+        etag, _ = response.get_etag()
+
+        # As when a new build is deployed
+        views._build_versions[self.app.root_path] = 'next'
+        try:
+            response = self.client.get('/', headers={'If-None-Match': etag})
+        finally:
+            views._build_versions.clear()
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.get_etag()[0], etag)
+
+    def test_index_limit(self):
+        for i in range(3):
+            db.session.add(User(email='user{}@test.com'.format(i)))
+        db.session.commit()
+        self.app.config['INDEX_USERS_LIMIT'] = 2
+
+        response = self.client.get('/')
+        self.assertEqual(len(self.embedded_users(response)), 2)
+
+    def test_versions(self):
+        version = get_version('users')
+        user = User(email='user1@test.com')
+        db.session.add(user)
+        db.session.flush()
+        user.first_name = 'Test'
+        db.session.commit()
+        # Bumped once per transaction
+        self.assertEqual(get_version('users'), version + 1)
+
+        # Unmodified users do not bump
+        self.assertEqual(user.first_name, 'Test')
+        user.first_name = 'Test'
+        db.session.commit()
+        self.assertEqual(get_version('users'), version + 1)
+
+        User.query.delete()
+        db.session.commit()
+        self.assertEqual(get_version('users'), version + 2)
@@ -2,17 +2,31 @@ from flask_testing import TestCase
 from app import create_app
 from app.config import Config
 from app.models import db
+import os
 
 
 class TestConfig(Config):
     TESTING = True
     SQLALCHEMY_ECHO = False
+    # The database of the tests, e.g. `TEST_DATABASE_URI=sqlite://` to run
+    # without postgres, with the storage of its dialect
+    SQLALCHEMY_DATABASE_URI = os.environ.get('TEST_DATABASE_URI') or \
+        Config.SQLALCHEMY_DATABASE_URI
+    STORAGE_BACKEND = None
+
+
+class SQLiteTestConfig(TestConfig):
+    """An in-memory SQLite database, see `SQLiteStorage`."""
+    SQLALCHEMY_DATABASE_URI = 'sqlite://'
+    SQLALCHEMY_BINDS = None
 
 
 class AppTest(TestCase):
 
+    config_class = TestConfig
+
     def create_app(self):
-        app = create_app(config=TestConfig)
+        app = create_app(config=self.config_class)
         return app
 
 